@@ -45,8 +45,11 @@ except ImportError:  # pragma: no cover
 
 from . import db
 from .admin_space import admin_app
+from .book_manifest import refresh_manifests_command
 from .cache import cache
 from .kofi import kofi_app
+from .map import build_track_assets_command
+from .map import export_worker_command
 from .map import map_app
 from .qmapshack import qmapshack_app
 from .social_networks import share_link
@@ -59,6 +62,7 @@ def create_app(is_testing: bool = False) -> Flask:
     """ Create and configure an instance of the Flask application. """
 
     app = Flask(__name__)
+    app.url_map.converters["content_hash"] = ContentHashConverter
 
     @app.template_filter("numerator")
     def numerator(str_fraction: str) -> int:  # pylint: disable=unused-variable
@@ -103,6 +107,9 @@ def create_app(is_testing: bool = False) -> Flask:
     )  # validation will be active for all POST requests if not testing
 
     db.init_app(app)
+    app.cli.add_command(export_worker_command)
+    app.cli.add_command(build_track_assets_command)
+    app.cli.add_command(refresh_manifests_command)
 
     @app.route("/error")
     @app.errorhandler(403)
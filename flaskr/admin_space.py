@@ -32,8 +32,17 @@
 Administration interface.
 """
 
+from .book_manifest import refresh_manifest
 from .db import get_db
 from .secure_email import SecureEmail
+from .track_index import get_file_hash
+from .track_index import get_track_index
+from .upload_session import append_upload_chunk
+from .upload_session import create_upload
+from .upload_session import get_upload_offset
+from .upload_session import get_upload_path
+from .upload_session import open_upload
+from .upload_session import remove_upload
 from .utils import *
 from .visitor_space import fetch_audit_log
 
@@ -364,6 +373,145 @@ def add_book() -> Any:
     return render_template("add_book.html")
 
 
+@admin_app.route("/uploads/new", methods=("POST",))
+@restricted_admin
+def xhr_new_upload() -> FlaskResponse:
+    """
+    XHR procedure to start a resumable upload of the file ``filename`` of
+    ``size`` bytes. The returned ``upload_id`` is sent to
+    :func:`xhr_upload_chunk` with the content, and then given to the form
+    processing the file in the ``<file field>-upload`` field instead of the file.
+
+    Raises:
+        404: if the user is not admin or the request is not POST.
+    """
+    if not is_admin():
+        abort(404)  # pragma: no cover
+    if not all(x in request.form for x in ["filename", "size"]):
+        return basic_json(False, "Missing data!")
+    try:
+        upload_id = create_upload(
+            current_app.config["UPLOAD_FOLDER"],
+            request.form["filename"],
+            int(request.form["size"]),
+            current_app.config["UPLOAD_LIFETIME"],
+        )
+    except ValueError:
+        return basic_json(False, "Invalid file size!")
+    return basic_json(True, "Upload started!", {"upload_id": upload_id, "offset": 0})
+
+
+@admin_app.route("/uploads/<string:upload_id>", methods=("GET", "POST"))
+@restricted_admin
+def xhr_upload_chunk(upload_id: str) -> FlaskResponse:
+    """
+    XHR procedure to resume an upload. A GET request returns the number of
+    bytes already received as ``offset``. A POST request appends the raw body
+    to the upload at the ``offset`` given in the query string, which must be
+    the number of bytes already received, and returns the new offset. The
+    bytes received before a dropped connection are kept.
+
+    Raises:
+        404: if the user is not admin or the upload does not exist.
+    """
+    if not is_admin():
+        abort(404)  # pragma: no cover
+    upload_folder = current_app.config["UPLOAD_FOLDER"]
+    try:
+        offset, size = get_upload_offset(upload_folder, upload_id)
+    except (ValueError, FileNotFoundError):
+        abort(404)
+    if request.method == "GET":
+        return basic_json(True, "Upload in progress!", {"offset": offset, "size": size})
+    if (request.content_length or 0) > current_app.config["UPLOAD_MAX_CHUNK_SIZE"]:
+        return basic_json(False, "Chunk too large!", {"offset": offset})
+    try:
+        offset = append_upload_chunk(
+            upload_folder,
+            upload_id,
+            request.args.get("offset", -1, type=int),
+            request.stream,
+        )
+    except ValueError as error:
+        return basic_json(
+            False,
+            str(error) + "!",
+            {"offset": get_upload_offset(upload_folder, upload_id)[0]},
+        )
+    return basic_json(True, "Chunk received!", {"offset": offset, "size": size})
+
+
+def get_uploaded_file(name: str) -> Optional[FileStorage]:
+    """
+    Returns the file `name` sent in the multipart form, or the complete
+    resumable upload referred by the ``<name>-upload`` field. The upload file
+    is closed after the request.
+
+    Args:
+        name (str): Name of the file field.
+
+    Returns:
+        The file or None if not sent.
+
+    Raises:
+        ValueError: If the upload is not complete.
+        FileNotFoundError: If the upload does not exist or expired.
+    """
+    if name in request.files:
+        return request.files[name]
+    if name + "-upload" not in request.form:
+        return None
+    file = open_upload(
+        current_app.config["UPLOAD_FOLDER"], request.form[name + "-upload"]
+    )
+
+    @after_this_request
+    def close_upload(response: Response) -> Response:
+        file.close()
+        return response
+
+    return file
+
+
+def remove_uploads(*names: str) -> None:
+    """
+    Remove the resumable uploads of the file fields `names` once processed.
+    """
+    for name in names:
+        if name + "-upload" in request.form:
+            try:
+                remove_upload(
+                    current_app.config["UPLOAD_FOLDER"], request.form[name + "-upload"]
+                )
+            except FileNotFoundError:  # expired
+                pass
+
+
+def save_hashed_upload(name: str, file: FileStorage, directory: str) -> Tuple[str, str]:
+    """
+    Save the file `name` like save_hashed_stream(), except that a complete
+    resumable upload is hashed in place and not copied, the returned path
+    being the content of the upload. The caller moves the file with
+    shutil.move(), a rename if the upload folder is on the file system of
+    `directory`.
+
+    Args:
+        name (str): Name of the file field.
+        file (FileStorage): The file returned by get_uploaded_file().
+        directory (str): Directory of the temporary file of a file sent in
+            the multipart form.
+
+    Returns:
+        (path to the file to move, SHA-1 hex digest of the content)
+    """
+    if name + "-upload" not in request.form:
+        return save_hashed_stream(file.stream, directory)
+    upload_path = get_upload_path(
+        current_app.config["UPLOAD_FOLDER"], request.form[name + "-upload"]
+    )
+    return upload_path, get_file_hash(upload_path)
+
+
 @admin_app.route("/photos/add/request", methods=("POST",))
 @restricted_admin
 def xhr_add_photo() -> FlaskResponse:
@@ -376,6 +524,16 @@ def xhr_add_photo() -> FlaskResponse:
     """
     if not is_admin():
         abort(404)  # pragma: no cover
+    try:
+        file = get_uploaded_file("add-photo-file")
+    except (ValueError, FileNotFoundError):  # kept to be resumed
+        return basic_json(False, "Upload not complete!")
+
+    @after_this_request
+    def remove_photo_upload(response: Response) -> Response:
+        remove_uploads("add-photo-file")  # whatever the outcome
+        return response
+
     if not all(
         x in request.form
         for x in ["add-photo-access-level", "add-photo-title", "add-photo-description"]
@@ -384,103 +542,67 @@ def xhr_add_photo() -> FlaskResponse:
     access_level = int(request.form["add-photo-access-level"])
     if not check_access_level_range(access_level):
         return basic_json(False, "Invalid access level!")
-    if "add-photo-file" not in request.files:
+    if file is None:
         return basic_json(False, "No file part!")
-    file = request.files["add-photo-file"]
     if file.filename == "":
         return basic_json(False, "No selected file!")
     raw_filename_ext = file_extension(file.filename)
     if not raw_filename_ext:
         return basic_json(False, "Wrong file extension!")
-    raw_filename = hashlib.sha1(file.read()).hexdigest() + "." + raw_filename_ext
-    cursor = mysql.cursor()
-    cursor.execute(
-        """SELECT photo_id
-        FROM gallery
-        WHERE raw_src='{raw}'""".format(
-            raw=raw_filename
-        )
-    )
-    data = cursor.fetchone()  # pylint: disable=unused-variable
-    if not cursor.rowcount == 0:  # the file name must be unique
-        return basic_json(False, "Photo already in the database!")
-    raw_path = os.path.join(current_app.config["GALLERY_FOLDER"], raw_filename)
-    if Path(raw_path).is_file():
-        return basic_json(
-            False,
-            "File '" + raw_filename + "' already existing but missing in the database!",
-        )
-    file.seek(0)  # reset the pointer moved during the hashing
-    file.save(raw_path)
     try:
-        image = Image.open(raw_path)
-        image = image.convert("RGB")
-        image_w = image.size[0]
-        image_h = image.size[1]
-        raw_size = image.size
-        if image_w > image_h:
-            thumbnail_h = float(current_app.config["THUMBNAIL_SIZE"])
-            thumbnail_w = thumbnail_h * float(image_w) / float(image_h)
-            offset_x = (thumbnail_w - thumbnail_h) / 2.0
-            thumbnail_crop = (
-                int(offset_x),
-                0,
-                int(thumbnail_h + offset_x),
-                current_app.config["THUMBNAIL_SIZE"],
-            )
-        else:
-            thumbnail_w = float(current_app.config["THUMBNAIL_SIZE"])
-            thumbnail_h = thumbnail_w * float(image_h) / float(image_w)
-            offset_y = (thumbnail_h - thumbnail_w) / 2.0
-            thumbnail_crop = (
-                0,
-                int(offset_y),
-                current_app.config["THUMBNAIL_SIZE"],
-                int(thumbnail_w + offset_y),
-            )
-        image = image.resize((int(thumbnail_w), int(thumbnail_h)), Image.ANTIALIAS)
-        image = image.crop(thumbnail_crop)
-        thumbnail_filename = random_filename(
-            current_app.config["THUMBNAIL_FILENAME_SIZE"]
-        )
-        image.save(
-            os.path.join(current_app.config["GALLERY_FOLDER"], thumbnail_filename),
-            "JPEG",
-            quality=current_app.config["PHOTO_QUALITY"],
+        tmp_path, raw_hash = save_hashed_upload(
+            "add-photo-file", file, current_app.config["GALLERY_FOLDER"]
         )
-        image.close()
-    except IOError:  # pragma: no cover
-        return basic_json(False, "Cannot create thumbnail!")
+    except OSError:  # pragma: no cover
+        return basic_json(False, "Cannot save the photo!")
     try:
-        photo_l_filename = create_and_save(
-            raw_path,
-            current_app.config["PHOTO_L_MAX_SIZE"],
-            current_app.config["PHOTO_L_FILENAME_SIZE"],
-            current_app.config["PHOTO_QUALITY"],
-            current_app.config["GALLERY_FOLDER"],
+        raw_filename = raw_hash + "." + raw_filename_ext
+        cursor = mysql.cursor()
+        cursor.execute(
+            """SELECT photo_id
+            FROM gallery
+            WHERE raw_src='{raw}'""".format(
+                raw=raw_filename
+            )
         )
-    except IOError:  # pragma: no cover
-        return basic_json(False, "Cannot create the large photo!")
+        data = cursor.fetchone()  # pylint: disable=unused-variable
+        if not cursor.rowcount == 0:  # the file name must be unique
+            return basic_json(False, "Photo already in the database!")
+        raw_path = os.path.join(current_app.config["GALLERY_FOLDER"], raw_filename)
+        if Path(raw_path).is_file():
+            return basic_json(
+                False,
+                "File '"
+                + raw_filename
+                + "' already existing but missing in the database!",
+            )
+        shutil.move(tmp_path, raw_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
     try:
-        photo_m_filename = create_and_save(
+        (
+            raw_size,
+            ((photo_l_filename, photo_l_size), (photo_m_filename, photo_m_size)),
+            thumbnail_filename,
+            image_exif,
+        ) = create_photo_derivatives(
             raw_path,
-            current_app.config["PHOTO_M_MAX_SIZE"],
-            current_app.config["PHOTO_M_FILENAME_SIZE"],
+            (
+                current_app.config["PHOTO_L_MAX_SIZE"],
+                current_app.config["PHOTO_M_MAX_SIZE"],
+            ),
+            (
+                current_app.config["PHOTO_L_FILENAME_SIZE"],
+                current_app.config["PHOTO_M_FILENAME_SIZE"],
+            ),
+            current_app.config["THUMBNAIL_SIZE"],
+            current_app.config["THUMBNAIL_FILENAME_SIZE"],
             current_app.config["PHOTO_QUALITY"],
             current_app.config["GALLERY_FOLDER"],
         )
     except IOError:  # pragma: no cover
-        return basic_json(False, "Cannot create the medium photo!")
-    try:
-        photo_l_size = get_image_size(
-            os.path.join(current_app.config["GALLERY_FOLDER"], photo_l_filename)
-        )
-        photo_m_size = get_image_size(
-            os.path.join(current_app.config["GALLERY_FOLDER"], photo_m_filename)
-        )
-        image_exif = get_image_exif(raw_path)
-    except IOError:  # pragma: no cover
-        return basic_json(False, "Cannot get metadata!")
+        return basic_json(False, "Cannot create the photos!")
     position = "SELECT IF(COUNT(clone.photo_id), MAX(clone.position) + 1, 1) FROM gallery clone"
     cursor.execute(
         """INSERT INTO gallery(thumbnail_src, photo_l_src, photo_m_src,
@@ -566,10 +688,13 @@ def xhr_add_book() -> FlaskResponse:
     data = cursor.fetchone()  # pylint: disable=unused-variable
     if not cursor.rowcount == 0:  # the title and url must be unique
         return basic_json(False, "Book title already in the database!")
-    if not ("add-book-file" in request.files and "add-book-thumbnail" in request.files):
+    try:
+        file = get_uploaded_file("add-book-file")
+        thumbnail = get_uploaded_file("add-book-thumbnail")
+    except (ValueError, FileNotFoundError):
+        return basic_json(False, "Upload not complete!")
+    if file is None or thumbnail is None:
         return basic_json(False, "Missing file(s)!")
-    file = request.files["add-book-file"]
-    thumbnail = request.files["add-book-thumbnail"]
     if file.filename == "" or thumbnail.filename == "":
         return basic_json(False, "Missing file(s)!")
     if not file_extension(file.filename, "book"):
@@ -589,6 +714,7 @@ def xhr_add_book() -> FlaskResponse:
     thumbnail_path = os.path.join(book_dir_path, "card.jpg")
     thumbnail.save(thumbnail_path)
     file.save(os.path.join(book_dir_path, filename))
+    refresh_manifest(book_dir_path)
     book_period = (
         escape(request.form["add-book-period"].strip())
         if "add-book-period" in request.form
@@ -612,6 +738,7 @@ def xhr_add_book() -> FlaskResponse:
         )
     )
     mysql.commit()
+    remove_uploads("add-book-file", "add-book-thumbnail")
     return basic_json(True, "Book successfully added to the shelf!")
 
 
@@ -805,6 +932,7 @@ def manage_books() -> Any:
         ]
         return [path.split("/")[-1] for path in reduced_path]
 
+    track_index = get_track_index()
     for i, book in enumerate(shelf_as_list):
         pathname = os.path.join(current_app.config["SHELF_FOLDER"], book[1])
         images = get_files(pathname, "jpg")
@@ -822,7 +950,11 @@ def manage_books() -> Any:
             resources = None
         else:
             resources = {"gpx": gpx, "image": images, "movie": movies, "pdf": pdfs}
-        shelf_as_list[i] = book + (resources,)
+        track_stats = {
+            stats.gpx_name + ".gpx": stats
+            for stats in track_index.get_book_tracks(book[1])
+        }
+        shelf_as_list[i] = book + (resources, track_stats)
     shelf = tuple(shelf_as_list)
 
     cursor.execute(
@@ -1023,6 +1155,8 @@ def save_book_metadata() -> FlaskResponse:
         thumbnail_path = os.path.join(book_dir_path, "card.jpg")
         thumbnail.save(thumbnail_path)
         preview_card = preview_image(thumbnail_path).decode()
+    if new_book or new_thumbnail:
+        refresh_manifest(book_dir_path)
     cursor = mysql.cursor()
     cursor.execute(
         """UPDATE shelf SET file_name='{file_name}', title='{title}',
@@ -1341,6 +1475,7 @@ def delete_book() -> FlaskResponse:
 
     # remove the book folder "permanently"
     shutil.rmtree(os.path.join(current_app.config["SHELF_FOLDER"], book_url))
+    get_track_index().remove(book_url)
     return basic_json(True, "Book successfully deleted!")
 
 
@@ -1410,7 +1545,7 @@ def photo_admin_dir(filename: str) -> FlaskResponse:
     if not is_admin():
         abort(404)  # pragma: no cover
     filename = secure_filename(escape(filename))
-    return send_from_directory(current_app.config["GALLERY_FOLDER"], filename)
+    return send_offloaded_file(current_app.config["GALLERY_FOLDER"], filename)
 
 
 @admin_app.route("/statistics")
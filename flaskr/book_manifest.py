@@ -0,0 +1,352 @@
+#
+# Copyright 2021 Clement
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Manifest of the files of a book directory.
+
+The size, modification time and SHA-1 of every file of a book (GPX,
+Markdown, exports, images...) are saved into the JSON file MANIFEST_NAME
+of the book directory, so that the request path checks if an export is
+outdated without any system call but the stat of the manifest. The
+manifest is kept in memory by each process and reloaded when it is
+replaced by an other process.
+
+The manifest is refreshed after generating an export or processing a
+book, by the admin views writing into a book, when a GPX file is not found
+in the manifest but exists, and by the ``refresh-manifests`` command. Run
+the command after changing files of a book by hand (``make touch-books``
+does).
+"""
+
+import os
+from time import sleep
+
+from .track_index import get_file_hash
+from .utils import *
+from .webtrack import WebTrack
+
+#: Name of the manifest file in each book directory.
+MANIFEST_NAME: str = ".manifest.json"
+
+#: Extensions of the files with a SHA-1 in the manifest, the other files
+#: (movies, PDF...) are not read.
+HASHED_EXTENSIONS: Tuple[str, ...] = (
+    "gpx",
+    "webtrack",
+    "geojson",
+    "fgb",
+    "jpg",
+    "md",
+    "json",
+    "html",
+)
+
+#: Extensions of the temporary files, not in the manifest.
+IGNORED_EXTENSIONS: Tuple[str, ...] = ("lock", "tmp")
+
+#: Manifests loaded by this process, with the inode and the modification
+#: time of the manifest file, by book directory.
+_manifests: Dict[str, Tuple[Tuple[int, int], "BookManifest"]] = {}
+
+
+class BookManifest:
+    """
+    State of the files of a book directory. The files are referred by their
+    path, only the filename being used.
+    """
+
+    def __init__(self, book_dir: str, files: Dict[str, Dict[str, Any]]):
+        """
+        Args:
+            book_dir (str): Secured path to the book directory.
+            files (Dict): File states by filename, refer to scan_book_dir().
+        """
+        #: Secured path to the book directory.
+        self.book_dir = book_dir
+
+        #: File states by filename.
+        self.files = files
+
+    def get_file(self, path: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the state of the file `path`: ``size``, ``mtime_ns``, and
+        ``sha1``, ``format_version`` (WebTrack), ``width`` and ``height``
+        (JPEG) when relevant. None if not in the manifest.
+        """
+        return self.files.get(os.path.basename(path))
+
+    def has_file(self, path: str) -> bool:
+        """ Returns true if the file `path` exists and is not empty. """
+        state = self.get_file(path)
+        return state is not None and state["size"] > 0
+
+    def get_hash(self, path: str) -> Optional[str]:
+        """ Returns the SHA-1 of the file `path`, None if not available. """
+        state = self.get_file(path)
+        return None if state is None else state.get("sha1")
+
+    def get_content_hash(self, paths: List[str]) -> Optional[str]:
+        """
+        Returns the hash of the content of the files `paths`, which is the
+        SHA-1 of the file or the SHA-1 of the SHA-1s, truncated to
+        CONTENT_HASH_LENGTH. None if a file is missing or not hashed.
+        """
+        hashes = []
+        for path in paths:
+            file_hash = self.get_hash(path)
+            if file_hash is None:
+                return None
+            hashes.append(file_hash)
+        if len(hashes) == 1:
+            return hashes[0][:CONTENT_HASH_LENGTH]
+        return hashlib.sha1("".join(hashes).encode()).hexdigest()[:CONTENT_HASH_LENGTH]
+
+    def is_outdated(self, source_path: str, derivative_path: str) -> bool:
+        """
+        Returns true if the file `derivative_path` is missing, empty, or
+        older than the file `source_path`, like export_is_outdated().
+        """
+        source = self.get_file(source_path)
+        derivative = self.get_file(derivative_path)
+        return (
+            derivative is None
+            or derivative["size"] == 0
+            or (source is not None and derivative["mtime_ns"] < source["mtime_ns"])
+        )
+
+    def has_format_version(self, file_path: str, format_version: bytes) -> bool:
+        """
+        Returns true if the WebTrack `file_path` is in the format version
+        `format_version`, like good_webtrack_version().
+        """
+        state = self.get_file(file_path)
+        return state is not None and (
+            state.get("format_version") == format_version.decode()
+        )
+
+    def list_files(self, ext: str) -> List[str]:
+        """
+        Returns the sorted paths of the non-empty files with the extension
+        `ext` (WITHOUT ``.``), like get_book_gpx_paths().
+        """
+        return [
+            os.path.join(self.book_dir, filename)
+            for filename, state in sorted(self.files.items())
+            if filename.endswith("." + ext) and state["size"] > 0
+        ]
+
+
+def get_file_state(
+    path: str, stat_result: os.stat_result, previous: Optional[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """
+    Returns the state of the file `path` as saved in the manifest. The
+    previous state is kept if the size and the modification time are the
+    same, so that the unchanged files are not read.
+
+    Args:
+        path (str): Path to the file.
+        stat_result (os.stat_result): Status of the file.
+        previous (Dict): Previous state of the file, if any.
+    """
+    state: Dict[str, Any] = {
+        "size": stat_result.st_size,
+        "mtime_ns": stat_result.st_mtime_ns,
+    }
+    if (
+        previous is not None
+        and previous["size"] == state["size"]
+        and previous["mtime_ns"] == state["mtime_ns"]
+    ):
+        return previous
+    ext = path.rsplit(".", 1)[-1].lower()
+    if ext not in HASHED_EXTENSIONS or not state["size"]:
+        return state
+    state["sha1"] = get_file_hash(path)
+    if ext == "webtrack":
+        expected_format = WebTrack().get_format_information()
+        try:
+            file_format = WebTrack().get_format_information(path)
+        except IndexError:
+            pass  # shorter than the header, regenerated later
+        else:
+            if file_format["format_name"] == expected_format["format_name"]:
+                state["format_version"] = file_format["format_version"].decode(
+                    errors="replace"
+                )
+    elif ext == "jpg":
+        try:
+            state["width"], state["height"] = get_image_size(path)
+        except OSError:
+            pass  # not an image
+    return state
+
+
+def scan_book_dir(
+    book_dir: str, previous: Optional[Dict[str, Dict[str, Any]]] = None
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Returns the state of every file of `book_dir` by filename, refer to
+    get_file_state(). The sub-directories, the temporary files and the
+    manifest are skipped.
+
+    Args:
+        book_dir (str): Secured path to the book directory.
+        previous (Dict): Previous states, refer to BookManifest.files.
+
+    Raises:
+        FileNotFoundError: The book directory does not exist.
+    """
+    if previous is None:
+        previous = {}
+    files = {}
+    with os.scandir(book_dir) as entries:
+        for entry in entries:
+            if (
+                entry.name.startswith(MANIFEST_NAME)
+                or entry.name.rsplit(".", 1)[-1] in IGNORED_EXTENSIONS
+                or not entry.is_file()
+            ):
+                continue
+            try:
+                files[entry.name] = get_file_state(
+                    entry.path, entry.stat(), previous.get(entry.name)
+                )
+            except FileNotFoundError:
+                pass  # removed in the meantime
+    return files
+
+
+def read_manifest(book_dir: str) -> Tuple[Tuple[int, int], BookManifest]:
+    """
+    Read the manifest file of `book_dir`.
+
+    Returns:
+        The inode and modification time of the manifest file, and the manifest.
+
+    Raises:
+        FileNotFoundError: The manifest does not exist.
+    """
+    with open(os.path.join(book_dir, MANIFEST_NAME), "r") as manifest_file:
+        stat_result = os.fstat(manifest_file.fileno())
+        try:
+            files = json.load(manifest_file)["files"]
+        except (ValueError, KeyError):
+            files = {}  # corrupted, rebuilt on the next refresh
+    return (stat_result.st_ino, stat_result.st_mtime_ns), BookManifest(book_dir, files)
+
+
+def refresh_manifest(book_dir: str) -> BookManifest:
+    """
+    Scan the book directory and save the manifest if any file changed. Only
+    the new or modified files are read. The refresh is protected by a lock
+    shared by all processes.
+
+    Args:
+        book_dir (str): Secured path to the book directory.
+
+    Returns:
+        BookManifest: The up to date manifest.
+
+    Raises:
+        FileNotFoundError: The book directory does not exist.
+    """
+    manifest_path = os.path.join(book_dir, MANIFEST_NAME)
+    if not os.path.isdir(book_dir):
+        _manifests.pop(book_dir, None)
+        raise FileNotFoundError("Book directory not found")
+    with file_lock(manifest_path + ".lock"):
+        try:
+            previous = read_manifest(book_dir)[1].files
+        except FileNotFoundError:
+            previous = None
+        files = scan_book_dir(book_dir, previous)
+        if files != previous:
+
+            def write_manifest(path: str) -> None:
+                with open(path, "w") as manifest_file:
+                    json.dump({"files": files}, manifest_file, sort_keys=True)
+
+            replace_file_atomically(manifest_path, write_manifest)
+        _manifests[book_dir] = read_manifest(book_dir)
+    return _manifests[book_dir][1]
+
+
+def get_manifest(book_dir: str) -> BookManifest:
+    """
+    Returns the manifest of `book_dir` from the memory if the manifest file
+    did not change, otherwise it is read or created.
+
+    Args:
+        book_dir (str): Secured path to the book directory.
+
+    Raises:
+        FileNotFoundError: The book directory does not exist.
+    """
+    try:
+        stat_result = os.stat(os.path.join(book_dir, MANIFEST_NAME))
+    except FileNotFoundError:
+        return refresh_manifest(book_dir)
+    version = (stat_result.st_ino, stat_result.st_mtime_ns)
+    if book_dir not in _manifests or _manifests[book_dir][0] != version:
+        _manifests[book_dir] = read_manifest(book_dir)
+    return _manifests[book_dir][1]
+
+
+def refresh_shelf_manifests(shelf_dir: str) -> int:
+    """
+    Refresh the manifest of every book directory of `shelf_dir`.
+
+    Returns:
+        int: Amount of refreshed manifests.
+    """
+    with os.scandir(shelf_dir) as entries:
+        book_dirs = [entry.path for entry in entries if entry.is_dir()]
+    for book_dir in book_dirs:
+        refresh_manifest(book_dir)
+    return len(book_dirs)
+
+
+@click.command("refresh-manifests")
+@click.option("--watch", is_flag=True, help="Keep refreshing the manifests.")
+@click.option("--poll", default=5.0, help="Seconds between two refreshes.")
+@with_appcontext
+def refresh_manifests_command(watch: bool, poll: float) -> None:
+    """
+    Refresh the manifest of every book of the shelf. Run it on deploy and
+    after changing files of a book by hand, or keep it running with
+    ``--watch``.
+    """
+    while True:
+        total = refresh_shelf_manifests(current_app.config["SHELF_FOLDER"])
+        if not watch:
+            click.echo("{} manifest(s) refreshed.".format(total))
+            break
+        sleep(poll)
@@ -50,6 +50,9 @@ from markdown.extensions.footnotes import FootnoteInlineProcessor
 from markdown.inlinepatterns import LinkInlineProcessor
 from markdown.inlinepatterns import Pattern
 
+from .book_manifest import get_manifest
+from .book_manifest import refresh_manifest
+from .map import EXPORT_EXTENSIONS
 from .utils import *
 
 NOIMG = r"(?<!\!)"
@@ -150,20 +153,38 @@ class StaticMapInlineProcessor(LinkInlineProcessor):
         if track_type is None:
             return None, None, None  # pragma: no cover
 
+        gpx_file = text.replace(" ", "_")
         map_block = eTree.fromstring(
             render_template(
                 "clickable_static_map.html",
                 image_height=self.config["map_height"],
                 book_id=self.config["book_id"],
                 book_url=self.config["book_url"],
-                gpx_file=text.replace(" ", "_"),
+                gpx_file=gpx_file,
                 gpx_title=text,
                 country_code=track_type.group(1),
+                content_hash=self.get_content_hash(gpx_file),
             )
         )
 
         return map_block, m.start(0), index
 
+    def get_content_hash(self, gpx_file: str) -> Optional[str]:
+        """
+        Returns the content hash of the static map of `gpx_file` (WITHOUT
+        extension), None if not generated yet or if the book directory is
+        not configured.
+        """
+        if self.config["book_dir"] is None:
+            return None
+        try:
+            manifest = get_manifest(self.config["book_dir"])
+        except FileNotFoundError:
+            return None
+        return manifest.get_content_hash(
+            [gpx_file + "." + EXPORT_EXTENSIONS["static_map"]]
+        )
+
 
 class StaticMapMarkdownExtension(Extension):
     """ Figure extension. """
@@ -182,6 +203,10 @@ class StaticMapMarkdownExtension(Extension):
                 kwargs.get("book_url", None),
                 "Book URL.",
             ],
+            "book_dir": [
+                kwargs.get("book_dir", None),
+                "Book directory with the static maps.",
+            ],
         }
         super().__init__(**kwargs)
         self.setConfigs(kwargs)
@@ -423,7 +448,9 @@ class BookProcessor:
                 OutlineExtension(),
                 ButtonMarkdownExtension(),
                 CustomFootnoteExtension(),
-                FigureExtension(src_path=self.path_to_book_dir),
+                FigureExtension(
+                    src_path=self.path_to_book_dir, widths=app.config["IMAGE_WIDTHS"]
+                ),
                 StaticMapMarkdownExtension(
                     map_height=(
                         100
@@ -432,6 +459,7 @@ class BookProcessor:
                     ),
                     book_id=book_id,
                     book_url=book_url,
+                    book_dir=self.path_to_book_dir,
                 ),
                 TweetableExtension(
                     twitter_username=app.config["TWITTER_ACCOUNT"]["screen_name"],
@@ -448,11 +476,25 @@ class BookProcessor:
         return {"html": "", "toc": ""}
 
     def is_outdated(self) -> bool:
-        """ Returns true if the HTML and the ToC are older than the Markdown file. """
+        """
+        Returns true if the HTML and the ToC are older than the Markdown file,
+        according to the manifest of the book. The HTML is also outdated if
+        older than a static map, which URL has the content hash of the image.
+        """
+        manifest = get_manifest(self.path_to_book_dir)
+        md_book = manifest.get_file(self.path_to_md_book)
+        html_content = manifest.get_file(str(self.p_html_content))
+        static_map_ext = "." + EXPORT_EXTENSIONS["static_map"]
         return not (
-            self.p_html_content.is_file()
-            and self.p_html_toc.is_file()
-            and self.p_html_content.stat().st_mtime > self.p_md_book.stat().st_mtime
+            md_book is not None
+            and html_content is not None
+            and manifest.get_file(str(self.p_html_toc)) is not None
+            and html_content["mtime_ns"] > md_book["mtime_ns"]
+            and not any(
+                state["mtime_ns"] > html_content["mtime_ns"]
+                for filename, state in manifest.files.items()
+                if filename.endswith(static_map_ext)
+            )
         )
 
     def print_book(self) -> Dict[str, str]:
@@ -467,6 +509,7 @@ class BookProcessor:
                 # pylint: disable=no-member
                 toc = self.markdown.toc  # type: ignore[attr-defined]
                 self.p_html_toc.open("w", encoding="utf-8").write(toc)  # type: ignore[arg-type]
+            refresh_manifest(self.path_to_book_dir)
         else:
             html = self.p_html_content.open("r", encoding="utf-8").read()
             toc = self.p_html_toc.open("r", encoding="utf-8").read()
@@ -116,6 +116,27 @@ class Config:
     PHOTO_M_FILENAME_SIZE: int = 25
     #: Length of the random file name for big photos, '.jpg' excluded.
     PHOTO_L_FILENAME_SIZE: int = 30
+    #: Widths in pixel of the resized images generated on demand for the srcset of the photos and the story figures.
+    IMAGE_WIDTHS: List[int] = [320, 640, 960, 1280, 1920, 2560]
+    #: Compression quality in percent of the resized images (AVIF, WebP or JPEG).
+    IMAGE_QUALITY: int = 80
+    #: Directory of the resized images, safe to remove.
+    IMAGE_CACHE_FOLDER: str = absolute_path("../image_cache")
+    #: Directory of the resumable uploads, on the same file system than the photos and books.
+    UPLOAD_FOLDER: str = absolute_path("../uploads")
+    #: Seconds before an idle resumable upload is removed.
+    UPLOAD_LIFETIME: int = 2 * 24 * 60 * 60
+    #: Maximum size in bytes of a chunk of a resumable upload.
+    UPLOAD_MAX_CHUNK_SIZE: int = 16 * 1024 ** 2
+    #: Let the web server send the files once the access is checked: None (Flask sends them), "x-accel-redirect" (nginx) or "x-sendfile" (Apache mod_xsendfile, lighttpd).
+    FILE_OFFLOAD: Optional[str] = None
+    #: Internal nginx location of each directory for the "x-accel-redirect" offload, the files out of them are sent by Flask.
+    FILE_OFFLOAD_LOCATIONS: Dict[str, str] = {
+        GALLERY_FOLDER: "/internal/photos/",
+        SHELF_FOLDER: "/internal/books/",
+        IMAGE_CACHE_FOLDER: "/internal/image_cache/",
+        absolute_path("../otm_cache"): "/internal/otm_cache/",
+    }
     #: Required access level to be able to read the pictures title and description.
     ACCESS_LEVEL_READ_INFO: int = 64
     #: Required access level to be able to download a .gpx file.
@@ -184,6 +205,33 @@ class Config:
         "username": "UNDISCLOSED",
         "password": r"UNDISCLOSED",
     }
+    #: True to generate the WebTracks and static maps with ``flask export-worker``, False to generate them per-request.
+    EXPORT_QUEUE_ENABLED: bool = True
+    #: SQLite database of the export queue shared by the app and the workers.
+    EXPORT_QUEUE_DATABASE: str = absolute_path("../export_queue.sqlite")
+    #: Seconds suggested to the client (Retry-After) when an export is being generated.
+    EXPORT_RETRY_AFTER: int = 5
+    #: SQLite database of the track statistics shared by the app and the workers.
+    TRACK_INDEX_DATABASE: str = absolute_path("../track_index.sqlite")
+    #: Local cache of the SRTM tiles.
+    SRTM_CACHE_DIR: str = absolute_path("../srtm_cache")
+    #: Disk budget in bytes of the SRTM cache, the least recently used tiles are removed beyond.
+    SRTM_CACHE_MAX_BYTES: int = 2 * 1024 ** 3
+    #: URL of the zipped SRTM tiles, {} being the tile name such as N45E006.
+    SRTM_URL: str = (
+        "https://e4ftl01.cr.usgs.gov/MEASURES/SRTMGL1.003/2000.02.11/{}.SRTMGL1.hgt.zip"
+    )
+    #: Maximum number of simultaneous SRTM downloads.
+    SRTM_DOWNLOAD_JOBS: int = 6
+    #: Number of SRTM tiles kept memory-mapped per elevation engine.
+    SRTM_MAX_OPEN_TILES: int = 16
+    #: Maximum number of points per request to /map/elevation.
+    ELEVATION_MAX_POINTS: int = 100000
+    #: Default and maximum number of points of the profiles sent by /map/profiles.
+    ELEVATION_PROFILE_DEFAULT_WIDTH: int = 1000
+    ELEVATION_PROFILE_MAX_WIDTH: int = 5000
+    #: Highest zoom level of the vector tiles of the tracks (/map/tracks/<z>/<x>/<y>.mvt).
+    TRACK_TILES_MAX_ZOOM: int = 18
     #: Social networks (excluding donation platforms).
     SOCIAL_NETWORKS: List[Tuple[str, str]] = [
         (
@@ -288,6 +336,8 @@ class TestingConfig:
     ACCESS_LEVEL_DOWNLOAD_GPX: int = 200
     #: Path to the DKIM private key.
     DKIM_PATH_PRIVATE_KEY: str = absolute_path("../tests/random_rsa_private_key.txt")
+    #: Generate the exports per-request, the queue is tested separately.
+    EXPORT_QUEUE_ENABLED: bool = False
 
 
 class ProductionConfig(Config):
@@ -36,12 +36,14 @@ Globally used modules.
 
 import base64
 import datetime
+import fcntl
 import functools
 import glob
 import hashlib
 import io
 import json
 import logging
+import mimetypes
 import os
 import pickle
 import random
@@ -51,7 +53,11 @@ import shutil
 import stat
 import string
 import sys
+import tempfile
+import threading
 import xml.etree.ElementTree as eltree
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from fractions import Fraction
 from pathlib import Path
 from time import gmtime
@@ -73,6 +79,7 @@ from flask import Blueprint
 from flask import Flask
 from flask import Markup
 from flask import abort
+from flask import after_this_request
 from flask import current_app
 from flask import flash
 from flask import g
@@ -84,16 +91,21 @@ from flask import request
 from flask import send_file
 from flask import send_from_directory
 from flask import session
+from flask import url_for
 from flask.cli import with_appcontext
 from flask_seasurf import SeaSurf
 from flask_talisman import Talisman
 from flaskext.markdown import Markdown
 from PIL import Image
 from PIL import ImageDraw
+from PIL import ImageFile
 from PIL import ImageFont
 from secure_cookie.cookie import SecureCookie
 from sentry_sdk.integrations.flask import FlaskIntegration
+from werkzeug.datastructures import FileStorage
 from werkzeug.local import LocalProxy
+from werkzeug.routing import BaseConverter
+from werkzeug.utils import safe_join
 from werkzeug.utils import secure_filename
 
 from .mdx_figure import FigureExtension
@@ -0,0 +1,274 @@
+#
+# Copyright 2021 Clement
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Elevation engine reading the SRTM HGT files of the local cache.
+
+An HGT file is a square grid of big-endian signed 16-bit integers covering
+one degree of latitude and longitude, the first row being the northern one.
+The files are memory-mapped and only the requested samples are decoded, so
+looking up a whole track does not load the tiles in Python structures.
+The least recently used tiles are closed when too many are open.
+
+The nearest lookup gives the same result as ``srtm.data.GeoElevationData``
+with ``approximate=False``, which keeps the WebTracks unchanged.
+"""
+
+import math
+import mmap
+import os
+import shutil
+import threading
+import zipfile
+from collections import OrderedDict
+from struct import Struct
+
+from .typing import *
+from .utils import replace_file_atomically
+
+#: HGT sample format: big-endian signed 16-bit integer.
+HGT_SAMPLE: Struct = Struct(">h")
+
+#: Lowest valid elevation in meters, the samples below are voids (as SRTM.py).
+MIN_ELEVATION: int = -1000
+
+#: Highest valid elevation in meters, the samples above are errors (as SRTM.py).
+MAX_ELEVATION: int = 10000
+
+
+def get_tile_name(latitude: float, longitude: float) -> str:
+    """
+    Returns the HGT filename of the tile containing the point, for example
+    'S45E169.hgt' for the tile from -45 to -44 and from 169 to 170 degrees.
+    """
+    return "{}{:02d}{}{:03d}.hgt".format(
+        "N" if latitude >= 0 else "S",
+        abs(math.floor(latitude)),
+        "E" if longitude >= 0 else "W",
+        abs(math.floor(longitude)),
+    )
+
+
+def get_hgt_side(size: int) -> int:
+    """
+    Returns the number of samples per row and per column of an HGT file.
+
+    Args:
+        size (int): Size of the file in bytes.
+
+    Raises:
+        ValueError: The file is not a square grid of samples.
+    """
+    side = math.isqrt(size // 2)
+    if side < 2 or side * side * 2 != size:
+        raise ValueError("Invalid HGT file size: {} bytes".format(size))
+    return side
+
+
+class HgtTile:
+    """ A memory-mapped HGT file. """
+
+    def __init__(self, path: str, latitude: int, longitude: int):
+        """
+        Args:
+            path (str): Path to the HGT file.
+            latitude (int): Latitude of the southern edge.
+            longitude (int): Longitude of the western edge.
+
+        Raises:
+            ValueError: The file is not a square grid of samples.
+        """
+        with open(path, "rb") as hgt_file:
+            #: Raw samples, closed when the tile is garbage collected.
+            self.data = mmap.mmap(hgt_file.fileno(), 0, access=mmap.ACCESS_READ)
+        #: Number of samples per row and per column.
+        self.side = get_hgt_side(len(self.data))
+        self.latitude = latitude
+        self.longitude = longitude
+
+    def get_sample(self, row: int, column: int) -> Optional[int]:
+        """ Returns the elevation at (`row`, `column`) or None if void. """
+        value = HGT_SAMPLE.unpack_from(self.data, 2 * (row * self.side + column))[0]
+        return value if MIN_ELEVATION <= value <= MAX_ELEVATION else None
+
+    def get_nearest(self, latitude: float, longitude: float) -> Optional[int]:
+        """
+        Returns the elevation of the sample at the north-west of the point,
+        exactly as ``srtm.data.GeoElevationFile.get_elevation()``.
+        """
+        row = math.floor((self.latitude + 1 - latitude) * float(self.side - 1))
+        column = math.floor((longitude - self.longitude) * float(self.side - 1))
+        return self.get_sample(row, column)
+
+    def get_bilinear(self, latitude: float, longitude: float) -> Optional[float]:
+        """
+        Returns the elevation interpolated between the four samples around
+        the point. The voids are ignored, None if all the samples are voids.
+        """
+        y = (self.latitude + 1 - latitude) * (self.side - 1)
+        x = (longitude - self.longitude) * (self.side - 1)
+        row = min(int(y), self.side - 2)
+        column = min(int(x), self.side - 2)
+        dy = y - row
+        dx = x - column
+        total_weight = 0.0
+        total = 0.0
+        for sample_row, sample_column, weight in (
+            (row, column, (1 - dy) * (1 - dx)),
+            (row, column + 1, (1 - dy) * dx),
+            (row + 1, column, dy * (1 - dx)),
+            (row + 1, column + 1, dy * dx),
+        ):
+            sample = self.get_sample(sample_row, sample_column)
+            if sample is not None and weight:
+                total += weight * sample
+                total_weight += weight
+        if not total_weight:
+            return None
+        return total / total_weight
+
+
+class SrtmElevationData:
+    """
+    Elevation lookups in the HGT files of `srtm_dir`. Thread-safe.
+    """
+
+    def __init__(
+        self,
+        srtm_dir: str,
+        max_open_tiles: int = 16,
+        fetch_tile: Optional[Callable[[float, float], None]] = None,
+    ):
+        """
+        Args:
+            srtm_dir (str): Directory of the HGT files (optionally zipped).
+            max_open_tiles (int): Number of tiles kept memory-mapped.
+            fetch_tile (Callable): Download into `srtm_dir` the tile containing
+                the point (latitude, longitude), called once per missing tile.
+                The missing tiles are not downloaded if not set.
+        """
+        self.srtm_dir = srtm_dir
+        self.max_open_tiles = max_open_tiles
+        self.fetch_tile = fetch_tile
+        #: Open tiles by (latitude, longitude), the most recently used last.
+        self.tiles: "OrderedDict[Tuple[int, int], HgtTile]" = OrderedDict()
+        #: Tiles not available even after fetching, such as oceans.
+        self.missing_tiles: Set[Tuple[int, int]] = set()
+        self.lock = threading.Lock()
+
+    def get_tile(self, latitude: float, longitude: float) -> Optional[HgtTile]:
+        """ Returns the tile containing the point or None if not available. """
+        key = (math.floor(latitude), math.floor(longitude))
+        with self.lock:
+            tile = self.tiles.get(key)
+            if tile is not None:
+                self.tiles.move_to_end(key)
+                return tile
+            if key in self.missing_tiles:
+                return None
+        path = os.path.join(self.srtm_dir, get_tile_name(latitude, longitude))
+        if not self._find_file(path):
+            if self.fetch_tile is None:
+                return None
+            self.fetch_tile(latitude, longitude)
+            if not self._find_file(path):
+                with self.lock:
+                    self.missing_tiles.add(key)
+                return None
+        tile = HgtTile(path, *key)
+        os.utime(path)  # recently used, refer to SrtmTileManager.evict()
+        with self.lock:
+            self.tiles[key] = tile
+            while len(self.tiles) > self.max_open_tiles:
+                self.tiles.popitem(last=False)  # unmapped once unused
+        return tile
+
+    @staticmethod
+    def _find_file(path: str) -> bool:
+        """
+        Returns true if the HGT file `path` exists, extracting it from the
+        zipped version if needed, refer to replace_file_atomically().
+        """
+        if os.path.isfile(path):
+            return True
+        zip_path = path + ".zip"
+        if not os.path.isfile(zip_path):
+            return False
+        with zipfile.ZipFile(zip_path) as hgt_zip:
+            hgt_names = [name for name in hgt_zip.namelist() if name.endswith(".hgt")]
+            if not hgt_names:
+                return False
+
+            def extract(tmp_path: str) -> None:
+                with hgt_zip.open(hgt_names[0]) as src, open(tmp_path, "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+
+            replace_file_atomically(path, extract)
+        return True
+
+    def get_elevation(
+        self, latitude: float, longitude: float, interpolate: bool = False
+    ) -> Optional[float]:
+        """
+        Returns the elevation in meters of the point or None if unknown.
+
+        Args:
+            latitude (float): Latitude in decimal degrees.
+            longitude (float): Longitude in decimal degrees.
+            interpolate (bool): Bilinear interpolation if true, otherwise
+                the SRTM.py lookup, refer to HgtTile.get_nearest().
+        """
+        return self.get_elevations([latitude], [longitude], interpolate)[0]
+
+    def get_elevations(
+        self,
+        latitudes: Sequence[float],
+        longitudes: Sequence[float],
+        interpolate: bool = False,
+    ) -> List[Optional[float]]:
+        """
+        Batch version of get_elevation(). The tile is looked up only when the
+        point is not in the same tile as the previous point.
+        """
+        elevations: List[Optional[float]] = []
+        tile_key = None
+        tile: Optional[HgtTile] = None
+        for latitude, longitude in zip(latitudes, longitudes):
+            key = (math.floor(latitude), math.floor(longitude))
+            if key != tile_key:
+                tile_key = key
+                tile = self.get_tile(latitude, longitude)
+            if tile is None:
+                elevations.append(None)
+            elif interpolate:
+                elevations.append(tile.get_bilinear(latitude, longitude))
+            else:
+                elevations.append(tile.get_nearest(latitude, longitude))
+        return elevations
@@ -0,0 +1,205 @@
+#
+# Copyright 2021 Clement
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Local job queue of the track exports.
+
+Generating a WebTrack (SRTM download and elevation smoothing) or a static
+map (Mapbox request) can take several seconds. The routes push a job into
+this queue and the ``flask export-worker`` processes build the exports in
+the background. The queue is an SQLite database so that any amount of
+workers and web processes can share it without an extra service.
+"""
+
+import os
+import sqlite3
+from contextlib import contextmanager
+from time import time
+
+from .typing import *
+
+#: Jobs are unique per export path so that a job is never queued twice.
+SCHEMA: str = """CREATE TABLE IF NOT EXISTS export_jobs (
+    export_path TEXT PRIMARY KEY,
+    export_type TEXT NOT NULL,
+    gpx_path TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    queued_at REAL NOT NULL,
+    started_at REAL
+)"""
+
+#: Databases with the schema created by this process.
+_databases_with_schema: Set[str] = set()
+
+
+class ExportJob:
+    """ A job popped from the queue. """
+
+    __slots__ = ("export_path", "export_type", "gpx_path", "attempts")
+
+    def __init__(
+        self, export_path: str, export_type: str, gpx_path: str, attempts: int
+    ):
+        self.export_path = export_path
+        self.export_type = export_type
+        self.gpx_path = gpx_path
+        self.attempts = attempts
+
+
+class ExportQueue:
+    """ SQLite-backed queue of the exports to generate. """
+
+    def __init__(
+        self, database_path: str, max_attempts: int = 3, job_timeout: int = 600
+    ):
+        """
+        Args:
+            database_path (str): Path to the SQLite file, created if not existing.
+            max_attempts (int): A job failing that many times is dropped.
+            job_timeout (int): Seconds before a running job is considered
+                lost (killed worker) and is popped again.
+        """
+        self.database_path = database_path
+        self.max_attempts = max_attempts
+        self.job_timeout = job_timeout
+        if database_path not in _databases_with_schema or not os.path.isfile(
+            database_path
+        ):  # removed in the meantime
+            with self._transaction() as connection:
+                connection.execute(SCHEMA)
+            _databases_with_schema.add(database_path)
+
+    def _connect(self) -> sqlite3.Connection:
+        """ Returns a new connection waiting for locks instead of failing. """
+        return sqlite3.connect(self.database_path, timeout=30)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """ Open a connection, commit (or rollback on error) and close it. """
+        connection = self._connect()
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def push(self, export_type: str, gpx_path: str, export_path: str) -> bool:
+        """
+        Queue the generation of `export_path` from `gpx_path`.
+
+        Args:
+            export_type (str): Refer to map.build_export().
+            gpx_path (str): Secured path to the input file.
+            export_path (str): Secured path to the output file.
+
+        Returns:
+            bool: False if the export is already queued or running.
+        """
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                """INSERT OR IGNORE INTO export_jobs
+                (export_path, export_type, gpx_path, queued_at)
+                VALUES (?, ?, ?, ?)""",
+                (export_path, export_type, gpx_path, time()),
+            )
+            return cursor.rowcount == 1
+
+    def pop(self) -> Optional[ExportJob]:
+        """
+        Mark the oldest pending job as running and return it. The lost jobs
+        are popped again, unless they were tried `max_attempts` times
+        (killing the worker each time) and are dropped.
+
+        Returns:
+            The job or None if the queue is empty.
+        """
+        connection = self._connect()
+        connection.isolation_level = None  # manual transaction
+        try:
+            connection.execute("BEGIN IMMEDIATE")  # one worker at a time
+            now = time()
+            connection.execute(
+                """DELETE FROM export_jobs
+                WHERE status='running' AND started_at<? AND attempts>=?""",
+                (now - self.job_timeout, self.max_attempts),
+            )
+            row = connection.execute(
+                """SELECT export_path, export_type, gpx_path, attempts
+                FROM export_jobs
+                WHERE status='pending' OR started_at<?
+                ORDER BY queued_at
+                LIMIT 1""",
+                (now - self.job_timeout,),
+            ).fetchone()
+            if row is not None:
+                connection.execute(
+                    """UPDATE export_jobs
+                    SET status='running', started_at=?, attempts=attempts+1
+                    WHERE export_path=?""",
+                    (now, row[0]),
+                )
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+        if row is None:
+            return None
+        return ExportJob(row[0], row[1], row[2], row[3] + 1)
+
+    def done(self, job: ExportJob) -> None:
+        """ Remove the successful `job` from the queue. """
+        with self._transaction() as connection:
+            connection.execute(
+                "DELETE FROM export_jobs WHERE export_path=?", (job.export_path,)
+            )
+
+    def failed(self, job: ExportJob) -> bool:
+        """
+        Put the failed `job` back into the queue unless it failed too many times.
+
+        Returns:
+            bool: True if the job will be tried again.
+        """
+        if job.attempts >= self.max_attempts:
+            self.done(job)
+            return False
+        with self._transaction() as connection:
+            connection.execute(
+                """UPDATE export_jobs
+                SET status='pending', started_at=NULL
+                WHERE export_path=?""",
+                (job.export_path,),
+            )
+        return True
+
+    def __len__(self) -> int:
+        """ Returns the amount of pending and running jobs. """
+        with self._transaction() as connection:
+            return connection.execute("SELECT COUNT(*) FROM export_jobs").fetchone()[0]
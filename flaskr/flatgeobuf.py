@@ -0,0 +1,350 @@
+#
+# Copyright 2021 Clement
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Minimal writer of the FlatGeobuf format with a packed Hilbert R-tree index.
+Only the features required by the track exports are implemented:
+MultiLineStrings in WGS84 with string properties.
+
+FlatGeobuf specifications:
+https://github.com/flatgeobuf/flatgeobuf
+"""
+
+import struct
+import sys
+from array import array
+
+from .typing import *
+
+#: Magic bytes and specification version 3.0.0.
+MAGIC_BYTES: bytes = b"fgb\x03fgb\x00"
+
+#: FlatGeobuf GeometryType enum value of MultiLineString.
+MULTI_LINE_STRING: int = 5
+
+#: FlatGeobuf ColumnType enum value of String.
+COLUMN_STRING: int = 11
+
+#: Number of children of each node of the spatial index.
+INDEX_NODE_SIZE: int = 16
+
+#: Largest coordinate of the Hilbert curve used to sort the features.
+HILBERT_MAX: int = (1 << 16) - 1
+
+#: FlatBuffers field value: (kind, value), refer to _FlatBufferBuilder.
+Field = Tuple[str, Any]
+
+#: Coordinates of a line: longitudes and latitudes in decimal degrees.
+Line = Tuple[Sequence[float], Sequence[float]]
+
+
+class _FlatBufferBuilder:
+    """
+    Serialize FlatBuffers tables front to back: a child object is always
+    written after its parent so that all the offsets are positive. Scalars
+    are aligned to their size relatively to the buffer start.
+
+    A field is None (absent) or a tuple (kind, value) where kind is a
+    struct format character for a scalar, 'string', 'vector:<format>' for a
+    vector of scalars, 'table' for a sub-table (a list of fields), or
+    'tables' for a vector of sub-tables.
+    """
+
+    def __init__(self) -> None:
+        self.buf = bytearray()
+
+    def _pad(self, alignment: int, extra: int = 0) -> None:
+        """ Pad the buffer so that the position + `extra` is aligned. """
+        self.buf += bytes(-(len(self.buf) + extra) % alignment)
+
+    def _patch_offset(self, position: int, target: int) -> None:
+        """ Write the unsigned offset from `position` to `target`. """
+        struct.pack_into("<I", self.buf, position, target - position)
+
+    def finish(self, fields: List[Optional[Field]]) -> bytes:
+        """ Returns the buffer with the root table made of `fields`. """
+        self.buf += bytes(4)
+        self._patch_offset(0, self.table(fields))
+        return bytes(self.buf)
+
+    def table(self, fields: List[Optional[Field]]) -> int:
+        """ Write a table and its children, returns the table position. """
+        layout: List[int] = []
+        table_size = 4  # offset to the vtable
+        for field in fields:
+            if field is None:
+                layout.append(0)
+                continue
+            size = struct.calcsize("<" + field[0]) if len(field[0]) == 1 else 4
+            table_size += -table_size % size
+            layout.append(table_size)
+            table_size += size
+
+        self._pad(2)
+        vtable_position = len(self.buf)
+        self.buf += struct.pack(
+            "<{}H".format(2 + len(fields)), 4 + 2 * len(fields), table_size, *layout
+        )
+        self._pad(8)
+        table_position = len(self.buf)
+        self.buf += bytes(table_size)
+        struct.pack_into(
+            "<i", self.buf, table_position, table_position - vtable_position
+        )
+
+        children = []
+        for field, field_offset in zip(fields, layout):
+            if field is None:
+                continue
+            kind, value = field
+            if len(kind) == 1:
+                struct.pack_into(
+                    "<" + kind, self.buf, table_position + field_offset, value
+                )
+            else:
+                children.append((table_position + field_offset, kind, value))
+        for position, kind, value in children:
+            self._patch_offset(position, self._child(kind, value))
+        return table_position
+
+    def _child(self, kind: str, value: Any) -> int:
+        """ Write a non-scalar value, returns its position. """
+        if kind == "table":
+            return self.table(value)
+        if kind == "string":
+            data = value.encode("utf-8")
+            self._pad(4)
+            position = len(self.buf)
+            self.buf += struct.pack("<I", len(data)) + data + b"\0"
+            return position
+        if kind == "tables":
+            self._pad(4)
+            position = len(self.buf)
+            self.buf += struct.pack("<I", len(value)) + bytes(4 * len(value))
+            for i, table_fields in enumerate(value):
+                self._patch_offset(position + 4 * (i + 1), self.table(table_fields))
+            return position
+        if kind.startswith("vector:"):
+            data = array(kind[len("vector:") :], value)
+            if sys.byteorder != "little":
+                data.byteswap()  # pragma: no cover
+            self._pad(max(4, data.itemsize), 4)
+            position = len(self.buf)
+            self.buf += struct.pack("<I", len(data)) + data.tobytes()
+            return position
+        raise KeyError("Unknown field kind: " + kind)  # pragma: no cover; misuse
+
+
+def hilbert(x: int, y: int) -> int:
+    """
+    Returns the distance along the Hilbert curve of side HILBERT_MAX + 1
+    of the cell (`x`, `y`).
+    """
+    d = 0
+    s = (HILBERT_MAX + 1) >> 1
+    while s:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        d += s * s * ((3 * rx) ^ ry)
+        if not ry:
+            if rx:
+                x = HILBERT_MAX - x
+                y = HILBERT_MAX - y
+            x, y = y, x
+        s >>= 1
+    return d
+
+
+def get_level_bounds(items_no: int, node_size: int) -> List[Tuple[int, int]]:
+    """
+    Returns the node ranges (start, end) of each level of the packed R-tree,
+    from the leaves to the root. The root is stored first.
+    """
+    levels_size = [items_no]
+    n = items_no
+    while True:
+        n = (n + node_size - 1) // node_size
+        levels_size.append(n)
+        if n == 1:
+            break
+    nodes_no = sum(levels_size)
+    bounds = []
+    for level_size in levels_size:
+        nodes_no -= level_size
+        bounds.append((nodes_no, nodes_no + level_size))
+    return bounds
+
+
+def get_envelope(lines: List[Line]) -> Tuple[float, float, float, float]:
+    """ Returns the bounding box (min_x, min_y, max_x, max_y) of `lines`. """
+    return (
+        min(min(lons) for lons, _ in lines),
+        min(min(lats) for _, lats in lines),
+        max(max(lons) for lons, _ in lines),
+        max(max(lats) for _, lats in lines),
+    )
+
+
+def write_flatgeobuf(
+    fgb_path: str, features: List[Tuple[str, List[Line]]], title: str = ""
+) -> None:
+    """
+    Write a FlatGeobuf file of MultiLineStrings with a spatial index.
+
+    Args:
+        fgb_path (str): Secured path to the overwritten output file.
+        features (List[Tuple[str, List[Line]]]): For each feature, the 'name'
+            property and the lines. Lines with less than 2 points and
+            features without any line are dropped.
+        title (str): Title of the dataset.
+    """
+    features = [
+        (name, [line for line in lines if len(line[0]) > 1]) for name, lines in features
+    ]
+    features = [(name, lines) for name, lines in features if lines]
+    envelopes = [get_envelope(lines) for _, lines in features]
+    header_fields: List[Optional[Field]] = [
+        None,  # name
+        None,  # envelope
+        ("B", MULTI_LINE_STRING),  # geometry_type
+        None,  # has_z
+        None,  # has_m
+        None,  # has_t
+        None,  # has_tm
+        ("tables", [[("string", "name"), ("B", COLUMN_STRING)]]),  # columns
+        ("Q", len(features)),  # features_count
+        ("H", INDEX_NODE_SIZE if features else 0),  # index_node_size
+        ("table", [("string", "EPSG"), ("i", 4326)]),  # crs
+        ("string", title) if title else None,  # title
+    ]
+    if features:
+        min_x = min(envelope[0] for envelope in envelopes)
+        min_y = min(envelope[1] for envelope in envelopes)
+        max_x = max(envelope[2] for envelope in envelopes)
+        max_y = max(envelope[3] for envelope in envelopes)
+        header_fields[1] = ("vector:d", (min_x, min_y, max_x, max_y))
+
+        # sort along the Hilbert curve so that close features are close in the file:
+        width = max_x - min_x
+        height = max_y - min_y
+
+        def hilbert_key(i: int) -> int:
+            x = y = 0
+            if width:
+                x = int(
+                    HILBERT_MAX
+                    * ((envelopes[i][0] + envelopes[i][2]) / 2 - min_x)
+                    / width
+                )
+            if height:
+                y = int(
+                    HILBERT_MAX
+                    * ((envelopes[i][1] + envelopes[i][3]) / 2 - min_y)
+                    / height
+                )
+            return hilbert(x, y)
+
+        order = sorted(range(len(features)), key=hilbert_key)
+        features = [features[i] for i in order]
+        envelopes = [envelopes[i] for i in order]
+
+    with open(fgb_path, "wb") as fgb_file:
+        fgb_file.write(MAGIC_BYTES)
+        header = _FlatBufferBuilder().finish(header_fields)
+        fgb_file.write(struct.pack("<I", len(header)) + header)
+
+        buffers = []
+        offset = 0
+        offsets = []
+        for name, lines in features:
+            buffer = _feature_to_flatbuffer(name, lines)
+            offsets.append(offset)
+            offset += len(buffer)
+            buffers.append(buffer)
+
+        if features:
+            fgb_file.write(_packed_rtree(envelopes, offsets))
+        for buffer in buffers:
+            fgb_file.write(buffer)
+
+
+def _feature_to_flatbuffer(name: str, lines: List[Line]) -> bytes:
+    """ Returns the size-prefixed feature, refer to write_flatgeobuf(). """
+    xy = array("d")
+    ends = array("I")
+    for lons, lats in lines:
+        for lon, lat in zip(lons, lats):
+            xy.append(lon)
+            xy.append(lat)
+        ends.append(len(xy) // 2)
+    data = name.encode("utf-8")
+    properties = struct.pack("<HI", 0, len(data)) + data
+    geometry: List[Optional[Field]] = [
+        ("vector:I", ends),  # ends
+        ("vector:d", xy),  # xy
+        None,  # z
+        None,  # m
+        None,  # t
+        None,  # tm
+        ("B", MULTI_LINE_STRING),  # type
+    ]
+    buffer = _FlatBufferBuilder().finish(
+        [("table", geometry), ("vector:B", properties)]
+    )
+    return struct.pack("<I", len(buffer)) + buffer
+
+
+def _packed_rtree(
+    envelopes: List[Tuple[float, float, float, float]], offsets: List[int]
+) -> bytes:
+    """
+    Returns the packed Hilbert R-tree of the sorted features: the nodes from
+    the root to the leaves, each one made of a bounding box and the offset of
+    the first child node (or the feature offset for the leaves).
+    """
+    level_bounds = get_level_bounds(len(envelopes), INDEX_NODE_SIZE)
+    nodes: List[Tuple[float, float, float, float, int]] = [
+        (0.0, 0.0, 0.0, 0.0, 0)
+    ] * level_bounds[0][1]
+    leaves_start = level_bounds[0][0]
+    for i, (envelope, offset) in enumerate(zip(envelopes, offsets)):
+        nodes[leaves_start + i] = (*envelope, offset)
+    for (start, end), (parent, _) in zip(level_bounds, level_bounds[1:]):
+        for first_child in range(start, end, INDEX_NODE_SIZE):
+            children = nodes[first_child : min(first_child + INDEX_NODE_SIZE, end)]
+            nodes[parent] = (
+                min(child[0] for child in children),
+                min(child[1] for child in children),
+                max(child[2] for child in children),
+                max(child[3] for child in children),
+                first_child,
+            )
+            parent += 1
+    return b"".join(struct.pack("<4dQ", *node) for node in nodes)
@@ -0,0 +1,485 @@
+#
+# Copyright 2021 Clement
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Streaming GPX reader.
+
+The GPX file is read with an incremental XML parser and every element is
+freed as soon as it has been decoded, so that the memory usage does not
+depend on the size of the file. Track points are stored into compact
+arrays of doubles (24 bytes per point) instead of gpxpy objects.
+
+The arrays are cached next to the GPX file (see `load_gpx()`) so that a GPX
+file is parsed only once for all the exports (WebTrack, GeoJSON, static map).
+
+.. note::
+    Only tracks and waypoints are read. Routes, timestamps, extensions and
+    meta-data are ignored.
+"""
+
+# pylint: disable=invalid-name; allow one letter variables (f.i. a, b, c)
+
+import heapq as mod_heapq
+import json as mod_json
+import math as mod_math
+import os as mod_os
+import sys as mod_sys
+import xml.etree.ElementTree as mod_etree
+from array import array
+
+import gpxpy.geo as mod_geo
+
+from .typing import *
+from .utils import replace_file_atomically
+
+#: Elements freed from the XML tree as soon as they are decoded.
+FREED_ELEMENTS: Tuple[str, ...] = ("trkpt", "rtept", "wpt", "trkseg", "trk", "rte")
+
+#: Extension replacing the GPX one for the cached arrays, WITHOUT ``.``.
+GPX_ARRAYS_EXT: str = "gpx_arrays"
+
+#: Format name and version of the cached arrays, increment to invalidate all caches.
+GPX_ARRAYS_FORMAT: bytes = b"gpx-arrays:0.1.0\n"
+
+
+class GpxSegment:
+    """
+    Track points of a GPX segment. An unknown elevation is set to NaN
+    to keep the arrays compact.
+    """
+
+    def __init__(self) -> None:
+        #: Latitudes in decimal degrees.
+        self.latitudes: array = array("d")
+        #: Longitudes in decimal degrees.
+        self.longitudes: array = array("d")
+        #: Elevations in meters, NaN if unknown.
+        self.elevations: array = array("d")
+
+    def __len__(self) -> int:
+        return len(self.latitudes)
+
+    def append(
+        self, latitude: float, longitude: float, elevation: Optional[float] = None
+    ) -> None:
+        """ Append a point at the end of the segment. """
+        self.latitudes.append(latitude)
+        self.longitudes.append(longitude)
+        self.elevations.append(mod_math.nan if elevation is None else elevation)
+
+    def join(self, segment: "GpxSegment") -> None:
+        """ Append all points of `segment` at the end of this segment. """
+        self.latitudes.extend(segment.latitudes)
+        self.longitudes.extend(segment.longitudes)
+        self.elevations.extend(segment.elevations)
+
+    def get_elevation(self, index: int) -> Optional[float]:
+        """ Returns the elevation of the point `index` or None if unknown. """
+        elevation = self.elevations[index]
+        return None if mod_math.isnan(elevation) else elevation
+
+    def distance_2d(self, index_1: int, index_2: int) -> float:
+        """
+        Returns the distance in meters between the points `index_1`
+        and `index_2` with the same approximation as gpxpy.
+        """
+        return mod_geo.distance(
+            self.latitudes[index_1],
+            self.longitudes[index_1],
+            None,
+            self.latitudes[index_2],
+            self.longitudes[index_2],
+            None,
+        )
+
+    def simplify_indices(self, max_distance: Optional[float] = None) -> List[int]:
+        """
+        Ramer-Douglas-Peucker simplification ported from gpxpy in order to
+        keep the exact same result without building any Location object.
+        The recursion is replaced by a stack to handle very long segments.
+
+        Args:
+            max_distance (float): Tolerance in meters, 10 if not specified.
+
+        Returns:
+            List[int]: The ascending indices of the points to keep.
+        """
+        tolerance = max_distance if max_distance is not None else 10
+        total_points = len(self)
+        if total_points < 3:
+            return list(range(total_points))
+        kept = [0]
+        stack = [(0, total_points - 1)]
+        while stack:
+            begin, end = stack.pop()
+            if end - begin < 2:
+                kept.append(end)
+                continue
+            farthest = self._farthest_point(begin, end)
+            if self._distance_from_line(farthest, begin, end) < tolerance:
+                kept.append(end)
+            else:
+                # the second half is processed after the first one:
+                stack.append((farthest, end))
+                stack.append((begin, farthest))
+        return kept
+
+    def get_importances(self) -> array:
+        """
+        Run the Ramer-Douglas-Peucker simplification without tolerance and
+        returns the importance of each point: the largest tolerance keeping
+        the point. Both ends are infinitely important. So the points kept by
+        `simplify_indices(max_distance)` are the ones with an importance
+        greater than or equal to `max_distance`, and all the simplification
+        levels are computed at once.
+
+        Returns:
+            array: Importance in meters of each point.
+        """
+        return self._get_importances_and_depths()[0]
+
+    def _get_importances_and_depths(self) -> Tuple[array, array]:
+        """
+        Returns the importance of each point, refer to `get_importances()`,
+        and its recursion depth in the simplification (0 for both ends).
+        """
+        total_points = len(self)
+        importances = array("d", [mod_math.inf]) * total_points
+        depths = array("L", [0]) * total_points
+        stack = [(0, total_points - 1, mod_math.inf, 1)]
+        while stack:
+            begin, end, parent_importance, depth = stack.pop()
+            if end - begin < 2:
+                continue
+            farthest = self._farthest_point(begin, end)
+            # a point is kept only if the split points around are kept:
+            importance = min(
+                self._distance_from_line(farthest, begin, end), parent_importance
+            )
+            importances[farthest] = importance
+            depths[farthest] = depth
+            stack.append((farthest, end, importance, depth + 1))
+            stack.append((begin, farthest, importance, depth + 1))
+        return importances, depths
+
+    def top_indices(self, points_no: int) -> List[int]:
+        """
+        Returns the indices of the `points_no` most important points, refer
+        to `get_importances()`. The points are ranked once and taken from a
+        heap, instead of searching for the tolerance giving `points_no`.
+        A point inheriting the importance of its parent split point is
+        ranked after it, so that the result is a valid simplification.
+
+        Args:
+            points_no (int): The number of points to keep.
+
+        Returns:
+            List[int]: The ascending indices of the points to keep.
+        """
+        if points_no >= len(self):
+            return list(range(len(self)))
+        importances, depths = self._get_importances_and_depths()
+        return sorted(
+            mod_heapq.nlargest(
+                points_no,
+                range(len(self)),
+                key=lambda index: (importances[index], -depths[index]),
+            )
+        )
+
+    def simplify(self, max_distance: Optional[float] = None) -> None:
+        """ Simplify the segment in place, see `simplify_indices()`. """
+        self.keep(self.simplify_indices(max_distance))
+
+    def keep(self, indices: List[int]) -> None:
+        """ Keep only the points `indices` of the segment. """
+        self.latitudes = array("d", (self.latitudes[i] for i in indices))
+        self.longitudes = array("d", (self.longitudes[i] for i in indices))
+        self.elevations = array("d", (self.elevations[i] for i in indices))
+
+    def _farthest_point(self, begin: int, end: int) -> int:
+        """
+        Returns the index of the point between `begin` and `end` (excluded)
+        which is the farthest from the line (`begin`, `end`). A cartesian line
+        is used as in gpxpy, it is only used to find out the farthest point.
+        """
+        lats = self.latitudes
+        lons = self.longitudes
+        if lons[begin] == lons[end]:
+            a, b, c = 0.0, 1.0, -lons[begin]
+        else:
+            slope = (lats[begin] - lats[end]) / (lons[begin] - lons[end])
+            a, b, c = 1.0, -slope, -(lats[begin] - lons[begin] * slope)
+        farthest_distance = 0.0
+        farthest = begin + 1
+        for i in range(begin + 1, end):
+            d = abs(a * lats[i] + b * lons[i] + c)
+            if d > farthest_distance:
+                farthest_distance = d
+                farthest = i
+        return farthest
+
+    def _distance_from_line(self, point: int, line_1: int, line_2: int) -> float:
+        """ Distance in meters of `point` from the line (`line_1`, `line_2`). """
+        a = self.distance_2d(line_1, line_2)
+        if not a:
+            return self.distance_2d(line_1, point)
+        b = self.distance_2d(line_1, point)
+        c = self.distance_2d(line_2, point)
+        s = (a + b + c) / 2
+        return 2 * mod_math.sqrt(abs(s * (s - a) * (s - b) * (s - c))) / a
+
+
+class GpxWaypoint:
+    """ A GPX waypoint. """
+
+    __slots__ = ("latitude", "longitude", "elevation", "symbol", "name")
+
+    def __init__(
+        self,
+        latitude: float,
+        longitude: float,
+        elevation: Optional[float],
+        symbol: Optional[str],
+        name: Optional[str],
+    ):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.elevation = elevation
+        self.symbol = symbol
+        self.name = name
+
+
+class StreamedGpx:
+    """ Tracks and waypoints of a GPX file. """
+
+    def __init__(self) -> None:
+        #: Segments of each track.
+        self.tracks: List[List[GpxSegment]] = []
+        #: All waypoints.
+        self.waypoints: List[GpxWaypoint] = []
+
+    def segments(self) -> Iterator[GpxSegment]:
+        """ Walk through all segments of all tracks. """
+        for track in self.tracks:
+            yield from track
+
+    def get_points_no(self) -> int:
+        """ Returns the total amount of track points. """
+        return sum(len(segment) for segment in self.segments())
+
+    def get_bounds(self) -> Optional[Tuple[float, float, float, float]]:
+        """
+        Returns the bounding box of the track points as (west, south, east,
+        north) in decimal degrees, or None if there is no track point.
+        """
+        segments = [segment for segment in self.segments() if len(segment)]
+        if not segments:
+            return None
+        return (
+            min(min(segment.longitudes) for segment in segments),
+            min(min(segment.latitudes) for segment in segments),
+            max(max(segment.longitudes) for segment in segments),
+            max(max(segment.latitudes) for segment in segments),
+        )
+
+    def to_file(self, file_path: str) -> None:
+        """
+        Save the tracks and waypoints into `file_path`: the format information,
+        a one-line JSON header with the segment lengths and the waypoints, and
+        finally the raw little-endian arrays of each segment.
+        """
+        header = {
+            "tracks": [[len(segment) for segment in track] for track in self.tracks],
+            "waypoints": [
+                [w.latitude, w.longitude, w.elevation, w.symbol, w.name]
+                for w in self.waypoints
+            ],
+        }
+        with open(file_path, "wb") as stream:
+            stream.write(GPX_ARRAYS_FORMAT)
+            stream.write(mod_json.dumps(header).encode("utf-8") + b"\n")
+            for segment in self.segments():
+                for column in (
+                    segment.latitudes,
+                    segment.longitudes,
+                    segment.elevations,
+                ):
+                    if mod_sys.byteorder != "little":
+                        column = array("d", column)  # pragma: no cover
+                        column.byteswap()  # pragma: no cover
+                    column.tofile(stream)
+
+    @classmethod
+    def from_file(cls, file_path: str) -> "StreamedGpx":
+        """
+        Load a file saved with `to_file()`.
+
+        Raises:
+            ValueError: Unexpected format.
+            EOFError: Truncated file.
+        """
+        gpx = cls()
+        with open(file_path, "rb") as stream:
+            if stream.readline() != GPX_ARRAYS_FORMAT:
+                raise ValueError("Unexpected format")
+            header = mod_json.loads(stream.readline())
+            for track_lengths in header["tracks"]:
+                track = []
+                for total_points in track_lengths:
+                    segment = GpxSegment()
+                    for column in (
+                        segment.latitudes,
+                        segment.longitudes,
+                        segment.elevations,
+                    ):
+                        column.fromfile(stream, total_points)
+                        if mod_sys.byteorder != "little":
+                            column.byteswap()  # pragma: no cover
+                    track.append(segment)
+                gpx.tracks.append(track)
+            gpx.waypoints = [GpxWaypoint(*w) for w in header["waypoints"]]
+        return gpx
+
+
+def _local_name(tag: str) -> str:
+    """ Remove the namespace of `tag`: GPX 1.0 and 1.1 are handled the same way. """
+    return tag.rsplit("}", 1)[-1]
+
+
+def _child_text(element: mod_etree.Element, name: str) -> Optional[str]:
+    """ Returns the text of the first child `name` of `element`, if any. """
+    for child in element:
+        if _local_name(child.tag) == name:
+            return child.text
+    return None
+
+
+def _child_float(element: mod_etree.Element, name: str) -> Optional[float]:
+    """ Returns the number of the first child `name` of `element`, if any. """
+    text = _child_text(element, name)
+    return None if text is None else float(text.strip())
+
+
+def iter_gpx(gpx_path: str) -> Iterator[Tuple]:
+    """
+    Read the GPX file `gpx_path` one element at a time.
+
+    Yields:
+        * ``("trk",)`` when a new track starts,
+        * ``("trkseg",)`` when a new track segment starts,
+        * ``("trkpt", latitude, longitude, elevation)`` for a track point,
+        * ``("wpt", latitude, longitude, elevation, symbol, name)`` for a waypoint.
+
+        The elevation is None if unknown.
+    """
+    parents: List[mod_etree.Element] = []
+    for event, element in mod_etree.iterparse(gpx_path, events=("start", "end")):
+        tag = _local_name(element.tag)
+        if event == "start":
+            if tag in ("trk", "trkseg"):
+                yield (tag,)
+            parents.append(element)
+            continue
+        parents.pop()
+        if tag == "trkpt":
+            yield (
+                tag,
+                float(element.get("lat", "").strip()),
+                float(element.get("lon", "").strip()),
+                _child_float(element, "ele"),
+            )
+        elif tag == "wpt" and len(parents) == 1:
+            yield (
+                tag,
+                float(element.get("lat", "").strip()),
+                float(element.get("lon", "").strip()),
+                _child_float(element, "ele"),
+                _child_text(element, "sym"),
+                _child_text(element, "name"),
+            )
+        if tag in FREED_ELEMENTS and parents:
+            # the element is always the last child of its parent when closed
+            element.clear()
+            del parents[-1][-1]
+
+
+def read_gpx(gpx_path: str) -> StreamedGpx:
+    """
+    Read the GPX file `gpx_path` into compact arrays.
+
+    Args:
+        gpx_path (str): Secured path to the input file.
+
+    Returns:
+        StreamedGpx: Tracks and waypoints.
+    """
+    gpx = StreamedGpx()
+    segment = GpxSegment()
+    for item in iter_gpx(gpx_path):
+        if item[0] == "trkpt":
+            segment.append(item[1], item[2], item[3])
+        elif item[0] == "trkseg":
+            segment = GpxSegment()
+            gpx.tracks[-1].append(segment)
+        elif item[0] == "trk":
+            gpx.tracks.append([])
+        else:
+            gpx.waypoints.append(GpxWaypoint(*item[1:]))
+    return gpx
+
+
+def get_gpx_arrays_path(gpx_path: str) -> str:
+    """ Returns the path to the cached arrays of `gpx_path`. """
+    root, _ = mod_os.path.splitext(gpx_path)
+    return root + "." + GPX_ARRAYS_EXT
+
+
+def load_gpx(gpx_path: str) -> StreamedGpx:
+    """
+    Read the GPX file `gpx_path` from the cached arrays if up to date,
+    otherwise parse the GPX file and (re-)create the cache, refer to
+    replace_file_atomically().
+
+    Args:
+        gpx_path (str): Secured path to the input file.
+
+    Returns:
+        StreamedGpx: Tracks and waypoints.
+    """
+    cache_path = get_gpx_arrays_path(gpx_path)
+    try:
+        if mod_os.stat(cache_path).st_mtime >= mod_os.stat(gpx_path).st_mtime:
+            return StreamedGpx.from_file(cache_path)
+    except (OSError, ValueError, EOFError):
+        pass  # missing or outdated cache
+    gpx = read_gpx(gpx_path)
+    replace_file_atomically(cache_path, gpx.to_file)
+    return gpx
@@ -35,71 +35,13 @@ Create a map from GPX data.
 from typing import Dict
 from urllib.parse import quote_plus as mod_quote_plus
 
-import gpxpy as mod_gpxpy
 import polyline as mod_polyline
 
-DEFAULT_MARGIN_POINTS_NO: int = 3
-DEFAULT_MAX_ITER: int = 20
+from .gpx_reader import GpxSegment
+from .gpx_reader import StreamedGpx
 
 
-class MyGPXTrackSegment(mod_gpxpy.gpx.GPXTrackSegment):
-    """ Add a custom simplification. """
-
-    def _distance_guesser(
-        self,
-        points_no: int,
-        margin_points_no: int = DEFAULT_MARGIN_POINTS_NO,
-        max_iter: int = DEFAULT_MAX_ITER,
-    ) -> int:
-        """
-        Find out the max distance for the 'simplify' procedure with the number of points as a requirement.
-
-        Args:
-            points_no (int): The number of points to expect.
-            margin_points_no (int): The bound/range around the expected number of points, the lesser the slower.
-            max_iter (int): Limit the number of calls to 'simplify' to avoid infinite loop if the margin is too small.
-
-        Returns:
-            int: The max_distance parameter to give to 'simplify'.
-        """
-        min_distance = 0
-        max_distance = 1000
-        for _ in range(max_iter):
-            dicho = int((max_distance + min_distance) / 2)
-            current_segment = self.clone()
-            current_segment.simplify(dicho)
-            current_points_no = current_segment.get_points_no()
-            if current_points_no > (points_no + margin_points_no):
-                min_distance = dicho
-            elif current_points_no < (points_no - margin_points_no):
-                max_distance = dicho
-            else:
-                break
-        return dicho
-
-    def simplify_with_distance_guesser(
-        self,
-        points_no: int,
-        margin_points_no: int = DEFAULT_MARGIN_POINTS_NO,
-        max_iter: int = DEFAULT_MAX_ITER,
-    ) -> None:
-        """
-        Simplify the segment to about `points_no` more or less `margin_points_no`.
-
-        Args:
-            points_no (int): The number of points to expect.
-            margin_points_no (int): The bound around the expected number of points, the lesser the slower.
-            max_iter (int): Limit the number of calls to 'simplify' to avoid infinite loop if the margin is too small.
-        """
-        self.simplify(self._distance_guesser(points_no, margin_points_no, max_iter - 1))
-
-
-def gpx_to_src(
-    gpx: mod_gpxpy.gpx.GPX,
-    conf: Dict,
-    margin_points_no: int = DEFAULT_MARGIN_POINTS_NO,
-    max_iter: int = DEFAULT_MAX_ITER,
-) -> str:
+def gpx_to_src(gpx: StreamedGpx, conf: Dict) -> str:
     """
     Returns a url to a static JPG image that fit the track in the GPX file.
 
@@ -107,23 +49,17 @@ def gpx_to_src(
     * Mapbox doc: https://docs.mapbox.com/api/maps/#static-images
 
     Args:
-        gpx: GPX data.
-        conf (Dict): Mapbox username, style_id, image width/height, access token, logo visibility.
-        margin_points_no (int): The bound around the expected number of points, the lesser the slower.
-        max_iter (int): Limit the number of calls to 'simplify' to avoid infinite loop if the margin is too small.
+        gpx: GPX data read by gpx_reader.read_gpx().
+        conf (Dict): Mapbox username, style_id, image width/height, access token,
+            logo visibility, and the exact number of points of the path.
     """
     # merge all track segments to ease the simplification process and fill gaps between tracks
-    merged_segments = MyGPXTrackSegment()
-    for track in gpx.tracks:
-        for segment in track.segments:
-            merged_segments.join(segment)
+    merged_segments = GpxSegment()
+    for segment in gpx.segments():
+        merged_segments.join(segment)
 
-    merged_segments.simplify_with_distance_guesser(
-        conf["points"], margin_points_no, max_iter
-    )
-    coordinates = []
-    for point in merged_segments.points:
-        coordinates.append((point.latitude, point.longitude))
+    merged_segments.keep(merged_segments.top_indices(conf["points"]))
+    coordinates = list(zip(merged_segments.latitudes, merged_segments.longitudes))
 
     point_fmt = "{}-{}+{}({:.7},{:.7})"
     path_fmt = "path-{}+{}-{}({})"
@@ -35,18 +35,67 @@ For the complete mapproxy, refer to vts_proxy.py
 
 # pylint: disable=invalid-name; allow one letter variables (f.i. x, y, z)
 
-import gpxpy
-import gpxpy.gpx
-import srtm
-
+import math
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+from time import perf_counter
+from time import sleep
+
+import gpxpy.geo
+
+from .book_manifest import BookManifest
+from .book_manifest import get_manifest
+from .book_manifest import refresh_manifest
+from .cache import cache
 from .db import get_db
+from .elevation import SrtmElevationData
+from .export_queue import ExportQueue
+from .flatgeobuf import Line
+from .flatgeobuf import write_flatgeobuf
+from .gpx_reader import GpxSegment
+from .gpx_reader import StreamedGpx
+from .gpx_reader import load_gpx
 from .gpx_to_img import gpx_to_src
+from .mvt import BUFFER
+from .mvt import encode_tile
+from .mvt import get_tile_bounds
+from .mvt import get_tile_lines
+from .srtm_cache import SrtmTileManager
+from .srtm_cache import get_tile_keys
+from .track_index import TrackIndex
+from .track_index import TrackStats
+from .track_index import get_track_index
+from .track_index import get_track_key
 from .utils import *
+from .webtrack import FORMAT_VERSIONS as WEBTRACK_FORMAT_VERSIONS
 from .webtrack import WebTrack
 
 map_app = Blueprint("map_app", __name__)
 mysql = LocalProxy(get_db)
 
+#: Export types and the extension replacing the GPX extension of the exported files.
+EXPORT_EXTENSIONS: Dict[str, str] = {
+    "webtrack": "webtrack",
+    "geojson": "geojson",
+    "static_map": "gpx_static_map.jpg",
+    "flatgeobuf": "fgb",
+}
+
+#: Elevation engines of this process by SRTM directory, amount of open tiles
+#: and download of the missing tiles, refer to get_elevation_data().
+_elevation_data: Dict[Tuple[str, int, bool], SrtmElevationData] = {}
+
+#: Name WITHOUT extension of the exports gathering all the tracks of a book.
+#: The leading dot avoids any conflict with the export of a GPX file.
+BOOK_EXPORT_NAME: str = ".book_tracks"
+
+#: Simplification tolerances in meters of the GeoJSON levels of detail, the
+#: first one is the full detail level. Refer to get_geojson_lod().
+GEOJSON_LOD_MAX_DISTANCES: Tuple[float, ...] = (10.0, 40.0, 160.0, 640.0, 2560.0)
+
+#: Meters per pixel at the equator on a 512px-tile map at zoom 0 (Mapbox GL JS).
+EQUATOR_METERS_PER_PIXEL: float = 78271.517
+
 
 def track_path_to_header(
     book_id: int, book_url: str, book_title: str, gpx_name: str
@@ -143,6 +192,10 @@ def map_viewer(book_id: int, book_url: str, gpx_name: str, country: str) -> Any:
         gpx_download_path=gpx_download_path,
         thumbnail_networks=request.url_root + get_thumbnail_path(book_id, gpx_name),
         total_subscribers=total_subscribers(mysql.cursor()),
+        track_stats=get_track_index().get(*get_track_key(gpx_exporter.get_gpx_path())),
+        webtrack_hash=get_export_hash(
+            gpx_exporter.manifest, "webtrack", gpx_exporter.get_gpx_path()
+        ),
     )
 
 
@@ -166,15 +219,44 @@ def create_static_map(
     Returns:
         Nothing, the image is saved into the disk.
     """
-    with open(gpx_path, "r") as gpx_file:
-        gpx = gpxpy.parse(gpx_file)
-    url = gpx_to_src(gpx, static_image_settings)
+    url = gpx_to_src(load_gpx(gpx_path), static_image_settings)
     r = requests.get(url)
     r.raise_for_status()
     with open(static_map_path, "wb") as static_image:
         static_image.write(r.content)
 
 
+def find_book(book_id: int, book_name: Optional[str] = None) -> Tuple[str, str]:
+    """
+    Returns the directory and the title of the book `book_id` if accessible
+    based on the user access level.
+
+    Args:
+        book_id (int): Book ID based on the 'shelf' database table.
+        book_name (str): Book name based on the 'shelf' database table.
+
+    Raises:
+        LookupError: `book_id` not in the database
+        PermissionError: Access denied
+    """
+    cursor = mysql.cursor()
+    query = f"""SELECT access_level, url, title
+            FROM shelf
+            WHERE book_id={book_id}"""
+    if book_name is not None:
+        query += f""" AND url='{book_name}'"""
+    cursor.execute(query)
+    data = cursor.fetchone()
+    if cursor.rowcount == 0:
+        raise LookupError("Book not found in the database")
+    if actual_access_level() < data[0]:
+        raise PermissionError("Access denied")
+    book_dir = os.path.join(
+        current_app.config["SHELF_FOLDER"], secure_filename(data[1])
+    )
+    return book_dir, data[2]
+
+
 class GpxExporter:
     """ Handle a GPX file and the export. """
 
@@ -208,27 +290,19 @@ class GpxExporter:
             else None
         )
 
-        cursor = mysql.cursor()
-        query = f"""SELECT access_level, url, title
-                FROM shelf
-                WHERE book_id={book_id}"""
-        if "book_name" in kwargs:
-            query += f""" AND url='{kwargs["book_name"]}'"""
-        cursor.execute(query)
-        data = cursor.fetchone()
-        if cursor.rowcount == 0:
-            raise LookupError("Book not found in the database")
-        if actual_access_level() < data[0]:
-            raise PermissionError("Access denied")
-
-        self.gpx_dir = os.path.join(
-            current_app.config["SHELF_FOLDER"], secure_filename(data[1])
-        )
+        self.gpx_dir, self.book_title = find_book(book_id, kwargs.get("book_name"))
         self.gpx_path = os.path.join(self.gpx_dir, self.gpx_filename)
 
-        if not os.path.isfile(self.gpx_path):
+        #: State of the files of the book, refer to get_manifest().
+        self.manifest = get_manifest(self.gpx_dir)
+        gpx_state = self.manifest.get_file(self.gpx_path)
+        if gpx_state is None and os.path.isfile(self.gpx_path):
+            # added since the last refresh:
+            self.manifest = refresh_manifest(self.gpx_dir)
+            gpx_state = self.manifest.get_file(self.gpx_path)
+        if gpx_state is None:
             raise FileNotFoundError("GPX file not in the shelf")
-        if os.stat(self.gpx_path).st_size == 0:
+        if gpx_state["size"] == 0:
             raise EOFError("GPX file is empty")
 
         self.export_path = (
@@ -237,7 +311,6 @@ class GpxExporter:
             else None
         )
         self.book_id = book_id
-        self.book_title = data[2]
 
     def get_book_title(self) -> str:
         """ Returns the book title. """
@@ -267,11 +340,23 @@ class GpxExporter:
         """
         if self.export_path is None:
             raise ValueError("Undefined export path")  # pragma: no cover; misuse
-        return (
-            not os.path.isfile(self.export_path)
-            or os.stat(self.export_path).st_size == 0
-            or os.stat(self.export_path).st_mtime < os.stat(self.gpx_path).st_mtime
-        )
+        return self.manifest.is_outdated(self.gpx_path, self.export_path)
+
+    def has_export(self, format_version: Optional[bytes] = None) -> bool:
+        """
+        Returns true if an export file exists, even if outdated.
+
+        Args:
+            format_version (bytes): Expected format version of the WebTrack.
+
+        Raises:
+            ValueError: if the export path is not set.
+        """
+        if self.export_path is None:
+            raise ValueError("Undefined export path")  # pragma: no cover; misuse
+        if format_version is not None:
+            return self.manifest.has_format_version(self.export_path, format_version)
+        return self.manifest.has_file(self.export_path)
 
     def get_gpx_download_path(self) -> str:
         """
@@ -294,22 +379,512 @@ class GpxExporter:
         """
         if self.export_file is None:
             raise ValueError("Undefined export file")  # pragma: no cover; misuse
-        return send_from_directory(
+        return send_offloaded_file(
             self.gpx_dir,
             self.export_file,
             mimetype=export_mimetype,
         )
 
 
+def export_is_outdated(gpx_path: str, export_path: str) -> bool:
+    """
+    Returns true if the export file `export_path` is missing, empty, or older
+    than the GPX file `gpx_path`.
+    """
+    return (
+        not os.path.isfile(export_path)
+        or os.stat(export_path).st_size == 0
+        or os.stat(export_path).st_mtime < os.stat(gpx_path).st_mtime
+    )
+
+
+def should_build_export(
+    export_type: str,
+    gpx_path: str,
+    export_path: str,
+    manifest: Optional[BookManifest] = None,
+) -> bool:
+    """
+    Returns true if the export file `export_path` is outdated, refer to
+    export_is_outdated(), or if the WebTrack format is not the expected one.
+
+    The files are checked in the manifest of the book if `manifest` is
+    specified, otherwise in the filesystem.
+    """
+    is_outdated: Callable[[str, str], bool]
+    has_format_version: Callable[[str, bytes], bool]
+    if manifest is None:
+        is_outdated = export_is_outdated
+        has_format_version = good_webtrack_version
+    else:
+        is_outdated = manifest.is_outdated
+        has_format_version = manifest.has_format_version
+    if export_type == "geojson":
+        return any(
+            is_outdated(gpx_path, get_geojson_lod_path(export_path, lod))
+            for lod in range(len(GEOJSON_LOD_MAX_DISTANCES))
+        )
+    if export_type == "webtrack":
+        return any(
+            is_outdated(gpx_path, get_webtrack_path(export_path, version))
+            or not has_format_version(get_webtrack_path(export_path, version), version)
+            for version in WEBTRACK_FORMAT_VERSIONS
+        )
+    return is_outdated(gpx_path, export_path)
+
+
+def get_export_settings() -> Dict:
+    """
+    Returns the part of the app configuration used by build_export(), so that
+    the exports can be generated out of the app context.
+    """
+    return {
+        "NASA_EARTHDATA": current_app.config["NASA_EARTHDATA"],
+        "MAPBOX_STATIC_IMAGES": current_app.config["MAPBOX_STATIC_IMAGES"],
+        "SRTM": get_srtm_settings(),
+        "TRACK_INDEX_DATABASE": current_app.config["TRACK_INDEX_DATABASE"],
+    }
+
+
+def build_export(
+    export_type: str,
+    gpx_path: str,
+    export_path: str,
+    settings: Optional[Dict] = None,
+) -> bool:
+    """
+    Generate the export file `export_path` from `gpx_path`.
+
+    The generation is protected by a lock shared by all processes so that
+    concurrent requests do not generate the same export: the waiting ones
+    reuse the freshly generated file. The export is written into a temporary
+    file and then renamed, so a partially written file is never served.
+
+    The statistics of the track are saved into the track index once its
+    WebTrack is generated.
+
+    Args:
+        export_type (str): "webtrack", "geojson", "static_map", or "flatgeobuf".
+        gpx_path (str): Secured path to the input file.
+        export_path (str): Secured path to the overwritten output file.
+        settings (Dict): Refer to get_export_settings(), which is the default.
+
+    Returns:
+        bool: False if the export was already up to date.
+
+    Raises:
+        KeyError: Unknown export type.
+    """
+    if settings is None:
+        settings = get_export_settings()
+    if export_type == "webtrack":
+        write = functools.partial(
+            gpx_to_webtrack_with_elevation,
+            gpx_path,
+            credentials=settings["NASA_EARTHDATA"],
+            srtm_settings=settings["SRTM"],
+        )
+    elif export_type == "geojson":
+        write = functools.partial(gpx_to_geojson_lods, gpx_path)
+    elif export_type == "static_map":
+        write = functools.partial(
+            create_static_map,
+            gpx_path,
+            static_image_settings=settings["MAPBOX_STATIC_IMAGES"],
+        )
+    elif export_type == "flatgeobuf":
+        write = functools.partial(gpx_to_flatgeobuf, [gpx_path])
+    else:
+        raise KeyError("Unknown export type: " + export_type)
+    with file_lock(export_path + ".lock"):
+        # False if generated by an other process in the meantime:
+        built = should_build_export(export_type, gpx_path, export_path)
+        if built:
+            if export_type in ("geojson", "webtrack"):
+                write(export_path)  # one atomic replacement per level/version
+            else:
+                replace_file_atomically(export_path, write)
+            if export_type == "webtrack":
+                TrackIndex(settings["TRACK_INDEX_DATABASE"]).index(
+                    gpx_path, export_path
+                )
+    # even if not built, the caller having read an outdated manifest:
+    refresh_manifest(os.path.dirname(export_path))
+    return built
+
+
+def timed_build_export(
+    export_type: str, gpx_path: str, export_path: str, settings: Dict
+) -> Tuple[bool, float]:
+    """
+    Run build_export() and measure the duration. This function is picklable
+    in order to be run by a process pool.
+
+    Returns:
+        Tuple[bool, float]: The output of build_export() and the seconds spent.
+    """
+    start = perf_counter()
+    built = build_export(export_type, gpx_path, export_path, settings)
+    return built, perf_counter() - start
+
+
+def get_book_gpx_paths(book_dir: str) -> List[str]:
+    """ Returns the sorted paths of the non-empty GPX files in `book_dir`. """
+    return [
+        gpx_path
+        for gpx_path in sorted(glob.glob(os.path.join(book_dir, "*.gpx")))
+        if os.stat(gpx_path).st_size > 0
+    ]
+
+
+def build_book_export(
+    export_type: str,
+    book_dir: str,
+    title: str,
+    format_version: bytes = WEBTRACK_FORMAT_VERSIONS[0],
+) -> str:
+    """
+    Generate if outdated the export gathering all the tracks of a book,
+    with the same lock and atomic replacement as build_export(). The export
+    is first checked in the manifest of the book, refer to get_manifest().
+
+    The WebTrack is merged from the WebTracks of the tracks which have to
+    be up to date, refer to WebTrack.merge_files(). The other exports are
+    generated from the GPX files.
+
+    .. note::
+        The export is outdated if older than any GPX file (or WebTrack) of
+        the book, so touch a GPX file or remove the export after deleting a
+        GPX file.
+
+    Args:
+        export_type (str): "flatgeobuf", "geojson" or "webtrack".
+        book_dir (str): Secured path to the book directory.
+        title (str): Book title saved in the export (FlatGeobuf only).
+        format_version (bytes): Format version of the WebTrack.
+
+    Returns:
+        str: Path to the export file.
+
+    Raises:
+        KeyError: Unknown export type.
+        FileNotFoundError: No GPX file in the book.
+        OverflowError: Too many segments or waypoints to merge the WebTracks.
+    """
+    if export_type in ("flatgeobuf", "geojson"):
+        export_ext = EXPORT_EXTENSIONS[export_type]
+    elif export_type == "webtrack":
+        export_ext = get_webtrack_ext(format_version)
+    else:
+        raise KeyError("Unknown book export type: " + export_type)
+    export_path = os.path.join(book_dir, BOOK_EXPORT_NAME + "." + export_ext)
+
+    def get_sources(gpx_paths: List[str]) -> List[str]:
+        if not gpx_paths:
+            raise FileNotFoundError("No GPX file in the book")
+        if export_type == "webtrack":
+            return [get_webtrack_path(path, format_version) for path in gpx_paths]
+        return gpx_paths
+
+    manifest = get_manifest(book_dir)
+    if not any(
+        manifest.is_outdated(source, export_path)
+        for source in get_sources(manifest.list_files("gpx"))
+    ):
+        return export_path
+    with file_lock(export_path + ".lock"):
+        gpx_paths = get_book_gpx_paths(book_dir)  # the manifest may be outdated
+        sources = get_sources(gpx_paths)
+        if any(export_is_outdated(source, export_path) for source in sources):
+            if export_type == "flatgeobuf":
+                write = functools.partial(gpx_to_flatgeobuf, gpx_paths, title=title)
+            elif export_type == "geojson":
+                write = functools.partial(gpx_to_book_geojson, gpx_paths)
+            else:
+                write = functools.partial(
+                    WebTrack(format_version=format_version).merge_files, sources
+                )
+            replace_file_atomically(export_path, write)
+    refresh_manifest(book_dir)
+    return export_path
+
+
+def get_export_queue() -> ExportQueue:
+    """ Returns the queue of the exports to generate in background. """
+    return ExportQueue(current_app.config["EXPORT_QUEUE_DATABASE"])
+
+
+def update_export(
+    gpx_exporter: "GpxExporter", export_type: str, export_path: Optional[str] = None
+) -> bool:
+    """
+    Generate the export right now if the queue is disabled, otherwise queue
+    the generation so that the request never waits for SRTM or Mapbox.
+
+    Args:
+        gpx_exporter (GpxExporter): The track with the export to update.
+        export_type (str): Refer to build_export().
+        export_path (str): Path given to build_export(), the export path of
+            `gpx_exporter` by default.
+
+    Returns:
+        bool: True if the export is up to date, False if queued.
+    """
+    if export_path is None:
+        export_path = gpx_exporter.get_export_path()
+    return request_export(export_type, gpx_exporter.get_gpx_path(), export_path)
+
+
+def request_export(export_type: str, gpx_path: str, export_path: str) -> bool:
+    """
+    Refer to update_export(), without any GpxExporter for the callers that
+    already checked the access to the book.
+
+    Returns:
+        bool: True if the export is up to date, False if queued.
+    """
+    if not current_app.config["EXPORT_QUEUE_ENABLED"]:
+        build_export(export_type, gpx_path, export_path)
+        return True
+    get_export_queue().push(export_type, gpx_path, export_path)
+    return False
+
+
+def export_not_ready(export_mimetype: str) -> FlaskResponse:
+    """
+    Reply 202 Accepted with a Retry-After header when the export is being
+    generated and no previous version is available. An image placeholder is
+    sent for the images so that the page layout is kept.
+
+    Args:
+        export_mimetype (str): MIME type of the export file.
+    """
+    if export_mimetype.startswith("image/"):
+        response = make_response(tile_not_found(export_mimetype))
+    else:
+        response = make_response("")
+    response.status_code = 202
+    response.headers["Retry-After"] = str(current_app.config["EXPORT_RETRY_AFTER"])
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+def get_export_paths(export_type: str, gpx_path: str) -> List[str]:
+    """
+    Returns the paths of all the files of the export of `gpx_path`: the levels
+    of detail of the GeoJSON, the format versions of the WebTrack, or the
+    export file of the other types.
+    """
+    if export_type == "geojson":
+        return [
+            get_geojson_lod_path(gpx_path, lod)
+            for lod in range(len(GEOJSON_LOD_MAX_DISTANCES))
+        ]
+    if export_type == "webtrack":
+        return [
+            get_webtrack_path(gpx_path, format_version)
+            for format_version in WEBTRACK_FORMAT_VERSIONS
+        ]
+    return [replace_extension(gpx_path, EXPORT_EXTENSIONS[export_type])]
+
+
+def get_export_hash(
+    manifest: BookManifest, export_type: str, gpx_path: str
+) -> Optional[str]:
+    """
+    Returns the content hash of all the files of the export of `gpx_path`,
+    refer to get_export_paths(), so that one hash fits all the levels of
+    detail and format versions. None if the export is not generated yet.
+    """
+    return manifest.get_content_hash(get_export_paths(export_type, gpx_path))
+
+
+def send_hashed_export(
+    gpx_exporter: GpxExporter,
+    export_type: str,
+    content_hash: Optional[str],
+    send: Callable[[], FlaskResponse],
+) -> FlaskResponse:
+    """
+    Send the export and cache it forever if requested with its current
+    content hash, refer to get_export_hash(), because the content behind
+    such URL never changes. An outdated hash is redirected to the current
+    URL, with the current hash if any.
+
+    Args:
+        gpx_exporter (GpxExporter): Exporter of the requested track.
+        export_type (str): Refer to EXPORT_EXTENSIONS.
+        content_hash (str): Content hash of the URL, None if not hashed.
+        send (Callable): Returns the response with the export file.
+    """
+    if content_hash is None:
+        return send()
+    current_hash = get_export_hash(
+        get_manifest(gpx_exporter.gpx_dir), export_type, gpx_exporter.get_gpx_path()
+    )
+    if current_hash != content_hash:
+        # the view arguments override the query arguments of the same name:
+        url_args = {
+            **request.args.to_dict(),
+            **(request.view_args or {}),
+            "content_hash": current_hash,
+        }
+        response = make_response(redirect(url_for(str(request.endpoint), **url_args)))
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+    response = make_response(send())
+    response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+@click.command("export-worker")
+@click.option("--once", is_flag=True, help="Exit when the queue is empty.")
+@click.option("--poll", default=2.0, help="Seconds between two checks of the queue.")
+@with_appcontext
+def export_worker_command(once: bool, poll: float) -> None:
+    """
+    Generate the queued exports. Run as many workers as needed, each one in
+    its own process.
+    """
+    queue = get_export_queue()
+    while True:
+        job = queue.pop()
+        if job is None:
+            if once:
+                break
+            sleep(poll)
+            continue
+        try:
+            build_export(job.export_type, job.gpx_path, job.export_path)
+            queue.done(job)
+            click.echo("Exported: " + job.export_path)
+        except Exception as err:  # pylint: disable=broad-except; keep working
+            retried = queue.failed(job)
+            click.secho(
+                "Failed to export {} ({}): {}".format(
+                    job.export_path, "retry later" if retried else "dropped", err
+                ),
+                fg="red",
+            )
+            sentry_sdk.capture_exception(err)
+
+
+def list_track_assets(export_types: Iterable[str]) -> List[Tuple[str, str, str]]:
+    """
+    List the exports of every GPX file of every book in the shelf,
+    whatever the access level.
+
+    Args:
+        export_types (Iterable[str]): Refer to EXPORT_EXTENSIONS.
+
+    Returns:
+        List[Tuple[str, str, str]]: Export type, GPX path, and export path.
+    """
+    cursor = mysql.cursor()
+    cursor.execute("SELECT url FROM shelf ORDER BY book_id")
+    assets = []
+    for (book_url,) in cursor.fetchall():
+        gpx_dir = os.path.join(
+            current_app.config["SHELF_FOLDER"], secure_filename(book_url)
+        )
+        for gpx_path in sorted(glob.glob(os.path.join(gpx_dir, "*.gpx"))):
+            if os.stat(gpx_path).st_size == 0:
+                continue  # refer to GpxExporter
+            for export_type in export_types:
+                export_path = replace_extension(
+                    gpx_path, EXPORT_EXTENSIONS[export_type]
+                )
+                assets.append((export_type, gpx_path, export_path))
+    return assets
+
+
+@click.command("build-track-assets")
+@click.option(
+    "--jobs",
+    "-j",
+    default=os.cpu_count() or 1,
+    help="Number of processes generating the exports.",
+)
+@click.option(
+    "--export-type",
+    "-t",
+    "export_types",
+    multiple=True,
+    type=click.Choice(list(EXPORT_EXTENSIONS)),
+    help="Export to build, all by default. Can be repeated.",
+)
+@with_appcontext
+def build_track_assets_command(jobs: int, export_types: Tuple[str, ...]) -> None:
+    """
+    Generate the outdated exports of all the GPX files in the shelf, so that
+    no visitor waits for the generation. Run it on deploy and after changing
+    the WebTrack format. The tracks with an up to date WebTrack missing from
+    the track index are then indexed, and the tracks removed from the shelf
+    are removed from the index.
+    """
+    assets = list_track_assets(export_types or EXPORT_EXTENSIONS)
+    outdated = [asset for asset in assets if should_build_export(*asset)]
+    click.echo(
+        "{} up to date, {} to build.".format(len(assets) - len(outdated), len(outdated))
+    )
+    settings = get_export_settings()
+    failures = 0
+    start = perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(timed_build_export, *asset, settings): asset
+            for asset in outdated
+        }
+        for future in as_completed(futures):
+            export_path = futures[future][2]
+            try:
+                built, duration = future.result()
+            except Exception as err:  # pylint: disable=broad-except; build others
+                failures += 1
+                click.secho(
+                    "Failed to export {}: {}".format(export_path, err), fg="red"
+                )
+                sentry_sdk.capture_exception(err)
+                continue
+            if built:
+                click.echo("Exported in {:.2f}s: {}".format(duration, export_path))
+            else:
+                click.echo("Up to date: " + export_path)
+    click.echo("Done in {:.2f}s.".format(perf_counter() - start))
+    track_index = get_track_index()
+    indexed = 0
+    for export_type, gpx_path, export_path in assets:
+        if export_type == "webtrack" and not should_build_export(
+            export_type, gpx_path, export_path
+        ):
+            indexed += track_index.index(gpx_path, export_path)
+    if indexed:
+        click.echo("{} track(s) indexed.".format(indexed))
+    removed = track_index.remove_missing(
+        {get_track_key(gpx_path) for _, gpx_path, _ in assets}
+    )
+    if removed:
+        click.echo("{} removed track(s) unindexed.".format(removed))
+    if failures:
+        raise click.ClickException("{} export(s) failed.".format(failures))
+
+
 @map_app.route("/static_map/<int:book_id>/<string:gpx_name>.jpg")
-def static_map(book_id: int, gpx_name: str) -> FlaskResponse:
+@map_app.route(
+    "/static_map/<int:book_id>/<string:gpx_name>.<content_hash:content_hash>.jpg"
+)
+def static_map(
+    book_id: int, gpx_name: str, content_hash: Optional[str] = None
+) -> FlaskResponse:
     """
     Print a static map and create it if not already existing or not up to date.
+    Refer to update_export() for the background generation.
     Keep this route open to external requests since it's used as thumbnail for the social platforms.
 
     Args:
         book_id (int): Book ID based on the 'shelf' database table.
         gpx_name (str): Name of the GPX file WITHOUT file extension.
+        content_hash (str): Optional content hash, refer to send_hashed_export().
 
     Returns:
         JPG image or a 404/500 HTTP error.
@@ -318,122 +893,837 @@ def static_map(book_id: int, gpx_name: str) -> FlaskResponse:
         404: Permission error or GPX file not found.
     """
     try:
-        gpx_exporter = GpxExporter(book_id, gpx_name, export_ext="gpx_static_map.jpg")
+        gpx_exporter = GpxExporter(
+            book_id, gpx_name, export_ext=EXPORT_EXTENSIONS["static_map"]
+        )
     except (LookupError, PermissionError, FileNotFoundError):
         abort(404)
     if gpx_exporter.should_update_export():
-        create_static_map(
-            gpx_exporter.get_gpx_path(),
-            gpx_exporter.get_export_path(),
-            current_app.config["MAPBOX_STATIC_IMAGES"],
-        )
-    return gpx_exporter.export("image/jpeg")
+        if not update_export(gpx_exporter, "static_map"):
+            if not gpx_exporter.has_export():
+                return export_not_ready("image/jpeg")
+    return send_hashed_export(
+        gpx_exporter,
+        "static_map",
+        content_hash,
+        functools.partial(gpx_exporter.export, "image/jpeg"),
+    )
 
 
 @map_app.route("/geojsons/<int:book_id>/<string:gpx_name>.geojson")
+@map_app.route(
+    "/geojsons/<int:book_id>/<string:gpx_name>.<content_hash:content_hash>.geojson"
+)
 @same_site
-def simplified_geojson(book_id: int, gpx_name: str) -> FlaskResponse:
+def simplified_geojson(
+    book_id: int, gpx_name: str, content_hash: Optional[str] = None
+) -> FlaskResponse:
     """
     Simplify a GPX file, convert to GeoJSON and send it.
     The generated GeoJSON is cached.
 
+    The level of detail can be reduced with one of these optional arguments
+    in the query string, refer to get_geojson_lod():
+
+    * ``zoom``: Zoom level of the map displaying the track.
+    * ``tolerance``: Simplification tolerance in meters.
+
     Args:
         book_id (int): Book ID based on the 'shelf' database table.
         gpx_name (str): Name of the GPX file WITHOUT file extension.
+        content_hash (str): Optional content hash, refer to send_hashed_export().
 
     Returns:
         JSON file containing the profile and statistics or a 404/500 HTTP error.
 
+    Raises:
+        404: Permission error or GPX file not found.
+    """
+    zoom = request.args.get("zoom", type=float)
+    tolerance = request.args.get("tolerance", type=float)
+    if zoom is not None:
+        tolerance = EQUATOR_METERS_PER_PIXEL / 2 ** max(0.0, min(zoom, 24.0))
+    lod = get_geojson_lod(tolerance)
+    try:
+        gpx_exporter = GpxExporter(
+            book_id,
+            gpx_name,
+            export_ext=get_geojson_lod_ext(lod),
+        )
+    except (LookupError, PermissionError, FileNotFoundError):
+        abort(404)
+    if gpx_exporter.should_update_export():
+        # fast enough to be generated per-request, no SRTM nor Mapbox involved
+        build_export(
+            "geojson",
+            gpx_exporter.get_gpx_path(),
+            get_geojson_lod_path(gpx_exporter.get_gpx_path(), 0),
+        )
+    return send_hashed_export(
+        gpx_exporter,
+        "geojson",
+        content_hash,
+        functools.partial(gpx_exporter.export, "application/geo+json"),
+    )
+
+
+@map_app.route("/flatgeobufs/<int:book_id>/<string:gpx_name>.fgb")
+@same_site
+def flatgeobuf_file(book_id: int, gpx_name: str) -> FlaskResponse:
+    """
+    Send a FlatGeobuf file and create it if not already existing or not up to
+    date. Range requests are supported. Refer to gpx_to_flatgeobuf().
+
+    Args:
+        book_id (int): Book ID based on the 'shelf' database table.
+        gpx_name (str): Name of the GPX file WITHOUT file extension.
+
+    Returns:
+        The FlatGeobuf file or a 404/500 HTTP error.
+
     Raises:
         404: Permission error or GPX file not found.
     """
     try:
-        gpx_exporter = GpxExporter(book_id, gpx_name, export_ext="geojson")
+        gpx_exporter = GpxExporter(
+            book_id, gpx_name, export_ext=EXPORT_EXTENSIONS["flatgeobuf"]
+        )
     except (LookupError, PermissionError, FileNotFoundError):
         abort(404)
     if gpx_exporter.should_update_export():
-        with open(gpx_exporter.get_export_path(), "w") as geojson_file:
-            geojson_file.write(gpx_to_simplified_geojson(gpx_exporter.get_gpx_path()))
-    return gpx_exporter.export("application/geo+json")
+        # fast enough to be generated per-request, no SRTM nor Mapbox involved
+        build_export(
+            "flatgeobuf", gpx_exporter.get_gpx_path(), gpx_exporter.get_export_path()
+        )
+    return gpx_exporter.export("application/flatgeobuf")
+
+
+@map_app.route("/books/<int:book_id>/tracks.fgb")
+@same_site
+def book_flatgeobuf_file(book_id: int) -> FlaskResponse:
+    """
+    Send the FlatGeobuf file of all the tracks of a book and create it if not
+    already existing or not up to date. Range requests are supported.
+    Refer to build_book_export().
+
+    Args:
+        book_id (int): Book ID based on the 'shelf' database table.
+
+    Returns:
+        The FlatGeobuf file or a 404/500 HTTP error.
+
+    Raises:
+        404: Permission error, book not found, or no GPX file in the book.
+    """
+    try:
+        book_dir, book_title = find_book(book_id)
+        export_path = build_book_export("flatgeobuf", book_dir, book_title)
+    except (LookupError, PermissionError, FileNotFoundError):
+        abort(404)
+    return send_offloaded_file(
+        book_dir, os.path.basename(export_path), mimetype="application/flatgeobuf"
+    )
+
+
+@map_app.route("/books/<int:book_id>/tracks.geojson")
+@same_site
+def book_geojson_file(book_id: int) -> FlaskResponse:
+    """
+    Send the GeoJSON of all the tracks of a book and create it if not
+    already existing or not up to date, so that a map of a story loads
+    all the tracks in one request. Refer to gpx_to_book_geojson().
+
+    Args:
+        book_id (int): Book ID based on the 'shelf' database table.
+
+    Returns:
+        The GeoJSON file or a 404/500 HTTP error.
+
+    Raises:
+        404: Permission error, book not found, or no GPX file in the book.
+    """
+    try:
+        book_dir, book_title = find_book(book_id)
+        export_path = build_book_export("geojson", book_dir, book_title)
+    except (LookupError, PermissionError, FileNotFoundError):
+        abort(404)
+    return send_offloaded_file(
+        book_dir, os.path.basename(export_path), mimetype="application/geo+json"
+    )
+
+
+@map_app.route("/books/<int:book_id>/tracks.webtrack")
+@same_site
+def book_webtrack_file(book_id: int) -> FlaskResponse:
+    """
+    Send the WebTrack of all the tracks of a book, one segment per GPX
+    segment in the order of the GPX filenames, so that a map of a story
+    loads all the tracks in one request. The query string and the headers
+    are the same as webtrack_file().
+
+    The WebTracks of the tracks are first (re-)generated if needed, refer
+    to update_export(), and then merged. The previous bundle is sent while
+    a WebTrack is being generated.
+
+    Args:
+        book_id (int): Book ID based on the 'shelf' database table.
+
+    Returns:
+        The WebTrack file or a 404/413/500 HTTP error.
+
+    Raises:
+        404: Permission error, book not found, no GPX file in the book or
+        unknown format version.
+        413: Too many segments or waypoints in the book for a WebTrack, the
+        WebTracks of the tracks have to be requested one by one.
+    """
+    format_version = get_requested_webtrack_version()
+    try:
+        book_dir, book_title = find_book(book_id)
+        manifest = get_manifest(book_dir)
+    except (LookupError, PermissionError, FileNotFoundError):
+        abort(404)
+    gpx_paths = manifest.list_files("gpx")
+    if not gpx_paths:
+        abort(404)
+    are_ready = [
+        request_export(
+            "webtrack",
+            gpx_path,
+            get_webtrack_path(gpx_path, WEBTRACK_FORMAT_VERSIONS[0]),
+        )
+        for gpx_path in gpx_paths
+        if should_build_export(
+            "webtrack",
+            gpx_path,
+            get_webtrack_path(gpx_path, WEBTRACK_FORMAT_VERSIONS[0]),
+            manifest,
+        )
+    ]
+    export_path = os.path.join(
+        book_dir, BOOK_EXPORT_NAME + "." + get_webtrack_ext(format_version)
+    )
+    if all(are_ready):
+        try:
+            export_path = build_book_export(
+                "webtrack", book_dir, book_title, format_version
+            )
+        except OverflowError:
+            abort(413)
+    elif not manifest.has_format_version(export_path, format_version):
+        return export_not_ready("application/prs.webtrack")
+    return send_webtrack(book_dir, os.path.basename(export_path))
 
 
 @map_app.route("/webtracks/<int:book_id>/<string:gpx_name>.webtrack")
+@map_app.route(
+    "/webtracks/<int:book_id>/<string:gpx_name>.<content_hash:content_hash>.webtrack"
+)
 @same_site
-def webtrack_file(book_id: int, gpx_name: str) -> FlaskResponse:
+def webtrack_file(
+    book_id: int, gpx_name: str, content_hash: Optional[str] = None
+) -> FlaskResponse:
     """
     Send a WebTrack file and create it if not already existing or not up to date.
+    Refer to update_export() for the background generation.
+
+    All the format versions are generated together and the client selects
+    one with the ``version`` argument of the query string, the oldest one
+    (0.1.0) by default for the clients not aware of the newer formats.
+
+    Range requests are supported so that a track is loaded progressively:
+    the ``WebTrack-Segment-Offsets`` header lists the byte offset of each
+    segment followed by the offset of the waypoints, refer to
+    WebTrack.get_segment_index().
 
     Args:
         book_id (int): Book ID based on the 'shelf' database table.
         gpx_name (str): Name of the GPX file in the /tracks directory WITHOUT file extension.
+        content_hash (str): Optional content hash, refer to send_hashed_export().
 
     Returns:
         The WebTrack file or a 404/500 HTTP error.
 
     Raises:
-        404: Permission error or GPX file not found.
+        404: Permission error, GPX file not found or unknown format version.
     """
+    format_version = get_requested_webtrack_version()
     try:
-        gpx_exporter = GpxExporter(book_id, gpx_name, export_ext="webtrack")
+        gpx_exporter = GpxExporter(
+            book_id, gpx_name, export_ext=get_webtrack_ext(format_version)
+        )
     except (LookupError, PermissionError, FileNotFoundError):
         abort(404)
-    if gpx_exporter.should_update_export() or not good_webtrack_version(
-        gpx_exporter.get_export_path()
-    ):
-        gpx_to_webtrack_with_elevation(
-            gpx_exporter.get_gpx_path(),
-            gpx_exporter.get_export_path(),
-            current_app.config["NASA_EARTHDATA"],
+    if not update_webtrack(gpx_exporter, format_version):
+        return export_not_ready("application/prs.webtrack")
+    return send_hashed_export(
+        gpx_exporter,
+        "webtrack",
+        content_hash,
+        functools.partial(
+            send_webtrack, *os.path.split(gpx_exporter.get_export_path())
+        ),
+    )
+
+
+def get_requested_webtrack_version() -> bytes:
+    """
+    Returns the WebTrack format version requested with the ``version``
+    argument of the query string, the default format if not specified.
+
+    Raises:
+        404: Unknown format version.
+    """
+    format_version = request.args.get(
+        "version", WEBTRACK_FORMAT_VERSIONS[0].decode()
+    ).encode()
+    if format_version not in WEBTRACK_FORMAT_VERSIONS:
+        abort(404)
+    return format_version
+
+
+def send_webtrack(directory: str, filename: str) -> FlaskResponse:
+    """
+    Send a WebTrack file with the byte offsets of the segments and of the
+    waypoints in the ``WebTrack-Segment-Offsets`` header, refer to
+    WebTrack.get_segment_index().
+
+    Args:
+        directory (str): Secured path to the directory of the file.
+        filename (str): Secured WebTrack filename.
+    """
+    response = make_response(
+        send_offloaded_file(directory, filename, mimetype="application/prs.webtrack")
+    )
+    response.headers["WebTrack-Segment-Offsets"] = ", ".join(
+        str(offset)
+        for offset in WebTrack().get_segment_index(os.path.join(directory, filename))
+    )
+    return response
+
+
+def update_webtrack(
+    gpx_exporter: GpxExporter, format_version: bytes = WEBTRACK_FORMAT_VERSIONS[0]
+) -> bool:
+    """
+    Request the (re-)generation of the WebTrack if missing, outdated or in an
+    older format. Refer to update_export().
+
+    Args:
+        gpx_exporter (GpxExporter): Exporter with the WebTrack extension of
+            `format_version`, refer to get_webtrack_ext().
+        format_version (bytes): Format version of the WebTrack.
+
+    Returns:
+        bool: True if a WebTrack can be read, False if not generated yet.
+    """
+    # an older format cannot be served as a stale version:
+    has_good_export = gpx_exporter.has_export(format_version)
+    if not has_good_export or gpx_exporter.should_update_export():
+        webtrack_path = get_webtrack_path(
+            gpx_exporter.get_gpx_path(), WEBTRACK_FORMAT_VERSIONS[0]
         )
-    return gpx_exporter.export("application/prs.webtrack")
+        if not update_export(gpx_exporter, "webtrack", webtrack_path):
+            return has_good_export
+    return True
+
+
+@map_app.route(
+    "/profiles/<int:book_id>/<string:gpx_name>.json",
+    methods=("GET",),
+)
+@same_site
+def elevation_profile(book_id: int, gpx_name: str) -> FlaskResponse:
+    """
+    Send the elevation profile of a track downsampled to `width` points
+    (query parameter) with the Largest-Triangle-Three-Buckets algorithm so
+    that a chart can be drawn without downloading the whole track.
+    The profile is read from the WebTrack (elevations corrected with SRTM)
+    and cached per WebTrack version and width.
+
+    Args:
+        book_id (int): Book ID based on the 'shelf' database table.
+        gpx_name (str): Name of the GPX file in the /tracks directory WITHOUT file extension.
 
+    Returns:
+        JSON with the profile as a list of [distance, elevation] in meters,
+        or a 202 reply if the WebTrack is being generated.
 
-def good_webtrack_version(file_path: str) -> bool:
+    Raises:
+        404: Permission error or GPX file not found.
+    """
+    width = request.args.get(
+        "width", current_app.config["ELEVATION_PROFILE_DEFAULT_WIDTH"], type=int
+    )
+    if not 3 <= width <= current_app.config["ELEVATION_PROFILE_MAX_WIDTH"]:
+        return basic_json(False, "Bad request, width out of range!")
+    try:
+        gpx_exporter = GpxExporter(
+            book_id, gpx_name, export_ext=EXPORT_EXTENSIONS["webtrack"]
+        )
+    except (LookupError, PermissionError, FileNotFoundError):
+        abort(404)
+    if not update_webtrack(gpx_exporter):
+        return export_not_ready("application/json")
+    webtrack_path = gpx_exporter.get_export_path()
+    try:
+        webtrack_mtime = os.stat(webtrack_path).st_mtime_ns
+    except FileNotFoundError:  # removed in the meantime
+        abort(404)
+    cache_key = "elevation_profile/{}/{}/{}".format(
+        webtrack_path, webtrack_mtime, width
+    )
+    profile = cache.get(cache_key)
+    if profile is None:
+        distances, elevations = WebTrack().get_elevation_profile(webtrack_path)
+        profile = [  # type: ignore[assignment]
+            [distances[index], elevations[index]]
+            for index in downsample_lttb(distances, elevations, width)
+        ]
+        cache.set(cache_key, profile)
+    return basic_json(True, "Elevation profile.", {"profile": profile})
+
+
+def good_webtrack_version(
+    file_path: str, format_version: bytes = WEBTRACK_FORMAT_VERSIONS[0]
+) -> bool:
     """
-    Check that the WebTrack format version of `file_path` can
-    be handled by the WebTrack module. Only the file header is
-    checked in order to speed up the verification process.
+    Check that the WebTrack format version of `file_path` is
+    `format_version`. Only the file header is checked in order
+    to speed up the verification process.
     A partially corrupted file may pass the test.
 
     Args:
         file_path (str): Path the the WebTrack file.
+        format_version (bytes): Expected format version.
 
     Returns:
-        False if the WebTrack module cannot handle the file.
+        False if the file is not in the expected format.
         True otherwise.
     """
-    webtrack = WebTrack()
-    current_format = webtrack.get_format_information()
+    webtrack = WebTrack(format_version=format_version)
+    expected_format = webtrack.get_format_information()
     file_format = webtrack.get_format_information(file_path)
-    return current_format == file_format
+    return expected_format == file_format
+
+
+def get_webtrack_ext(format_version: bytes) -> str:
+    """
+    Returns the extension WITHOUT ``.`` of the WebTrack files in the format
+    `format_version`, for example 'v0_2_0.webtrack'. The default format
+    keeps the usual extension.
+    """
+    if format_version == WEBTRACK_FORMAT_VERSIONS[0]:
+        return EXPORT_EXTENSIONS["webtrack"]
+    return "v{}.{}".format(
+        format_version.decode().replace(".", "_"), EXPORT_EXTENSIONS["webtrack"]
+    )
+
+
+def get_webtrack_path(path: str, format_version: bytes) -> str:
+    """
+    Returns the path of the WebTrack in the format `format_version` of
+    `path`, which is the GPX file or the WebTrack in the default format.
+    """
+    return replace_extension(path, get_webtrack_ext(format_version))
+
+
+def get_srtm_settings() -> Dict:
+    """
+    Returns the part of the app configuration used by the SRTM cache, so that
+    the WebTracks can be generated out of the app context.
+    """
+    return {
+        key: current_app.config[key]
+        for key in (
+            "SRTM_CACHE_DIR",
+            "SRTM_CACHE_MAX_BYTES",
+            "SRTM_URL",
+            "SRTM_DOWNLOAD_JOBS",
+            "SRTM_MAX_OPEN_TILES",
+        )
+    }
+
+
+def get_srtm_tile_manager(
+    credentials: Optional[Dict[str, str]], srtm_settings: Dict
+) -> SrtmTileManager:
+    """
+    Returns the manager of the SRTM cache, which is created if not existing.
+
+    Args:
+        credentials (Dict[str, str]): NASA Earthdata credentials.
+        srtm_settings (Dict): Refer to get_srtm_settings().
+    """
+    os.makedirs(srtm_settings["SRTM_CACHE_DIR"], exist_ok=True)
+    return SrtmTileManager(
+        srtm_settings["SRTM_CACHE_DIR"],
+        srtm_settings["SRTM_URL"],
+        credentials,
+        srtm_settings["SRTM_CACHE_MAX_BYTES"],
+        srtm_settings["SRTM_DOWNLOAD_JOBS"],
+    )
+
+
+def get_elevation_data(
+    srtm_settings: Optional[Dict] = None,
+    fetch_tile: Optional[Callable[[float, float], None]] = None,
+) -> SrtmElevationData:
+    """
+    Returns the elevation engine reading the SRTM cache, created once per
+    process so that the open tiles are kept between the requests. The
+    missing tiles are not downloaded unless `fetch_tile` is set, refer to
+    gpx_to_webtrack_with_elevation(): the first callback is then kept.
+
+    Args:
+        srtm_settings (Dict): Refer to get_srtm_settings(), which is the default.
+        fetch_tile (Callable): Refer to SrtmElevationData.
+    """
+    if srtm_settings is None:
+        srtm_settings = get_srtm_settings()
+    key = (
+        srtm_settings["SRTM_CACHE_DIR"],
+        srtm_settings["SRTM_MAX_OPEN_TILES"],
+        fetch_tile is not None,
+    )
+    elevation_data = _elevation_data.get(key)
+    if elevation_data is None:
+        elevation_data = _elevation_data.setdefault(
+            key, SrtmElevationData(key[0], key[1], fetch_tile)
+        )
+    return elevation_data
 
 
-class CustomFileHandler(srtm.data.FileHandler):
+def interval_elevations(
+    elevation_data: SrtmElevationData,
+    segment: GpxSegment,
+    min_interval_length: int,
+) -> List[Optional[float]]:
     """
-    The custom file handler to choose the cache directory.
-    https://github.com/ExploreWilder/srtm.py/blob/EarthDataLogin/srtm/data.py
+    Fetch the SRTM elevation every `min_interval_length` meters and linearly
+    interpolate the elevation of the points in between, the same way
+    ``srtm.data.GeoElevationData._add_interval_elevations()`` does on a gpxpy
+    segment. All the SRTM lookups are done at once.
+
+    Args:
+        elevation_data (SrtmElevationData): SRTM data handler.
+        segment (GpxSegment): The track points.
+        min_interval_length (int): Distance in meters between two SRTM lookups.
+
+    Returns:
+        The elevation of each point, None if unknown.
+    """
+    sampled: List[int] = []
+    last_interval_changed = 0
+    length = 0.0
+    last_point = len(segment) - 1
+    for i in range(len(segment)):
+        if i:
+            length += segment.distance_2d(i, i - 1)
+        if i in (0, last_point) or length > last_interval_changed:
+            last_interval_changed += min_interval_length
+            sampled.append(i)
+    elevations: List[Optional[float]] = [None] * len(segment)
+    for i, elevation in zip(
+        sampled,
+        elevation_data.get_elevations(
+            [segment.latitudes[i] for i in sampled],
+            [segment.longitudes[i] for i in sampled],
+        ),
+    ):
+        elevations[i] = elevation
+
+    # points without elevation between two points with elevation:
+    interval: List[int] = []
+    start: Optional[int] = None
+    for i, elevation in enumerate(elevations):
+        if elevation is None and i:
+            if start is None:
+                start = i - 1
+            interval.append(i)
+            continue
+        if interval and start is not None:
+            start_ele = elevations[start]
+            if start_ele is not None and elevation is not None:
+                distances = []
+                distance_from_start = 0.0
+                previous = start
+                for point in interval:
+                    distance_from_start += segment.distance_2d(point, previous)
+                    distances.append(distance_from_start)
+                    previous = point
+                dist = segment.distance_2d(interval[-1], i)
+                from_start_to_end = distances[-1] + dist if dist else None
+                for point, distance in zip(interval, distances):
+                    ratio = distance / from_start_to_end if from_start_to_end else 0
+                    elevations[point] = start_ele + ratio * (elevation - start_ele)
+            start = None
+            interval = []
+    return elevations
+
+
+def add_sampled_elevations(elevation_data: SrtmElevationData, gpx: StreamedGpx) -> None:
+    """
+    Replace the elevation of all track points by the average of three
+    interpolations with random-ish intervals. Same result as
+    ``elevation_data.add_elevations(gpx, smooth=True)`` on a gpxpy object.
+    An elevation stays unknown if one of the interpolation failed.
+
+    Args:
+        elevation_data (SrtmElevationData): SRTM data handler.
+        gpx (StreamedGpx): Tracks updated in place.
+    """
+    for segment in gpx.segments():
+        elevations_1 = interval_elevations(elevation_data, segment, 35)
+        elevations_2 = interval_elevations(elevation_data, segment, 141)
+        elevations_3 = interval_elevations(elevation_data, segment, 241)
+        for i, (ele_1, ele_2, ele_3) in enumerate(
+            zip(elevations_1, elevations_2, elevations_3)
+        ):
+            if ele_1 is not None and ele_2 is not None and ele_3 is not None:
+                segment.elevations[i] = (ele_1 + ele_2 + ele_3) / 3.0
+            else:
+                segment.elevations[i] = math.nan
+
+
+def get_accessible_books() -> Dict[str, Tuple[int, str]]:
+    """
+    Returns the ID and the title of the books accessible based on the user
+    access level, by book directory name as in the track index.
+    """
+    cursor = mysql.cursor()
+    cursor.execute(
+        """SELECT url, book_id, title
+        FROM shelf
+        WHERE access_level<={access_level}""".format(
+            access_level=actual_access_level()
+        )
+    )
+    return {
+        secure_filename(book_url): (book_id, title)
+        for book_url, book_id, title in cursor.fetchall()
+    }
+
+
+def track_stats_to_json(
+    stats: TrackStats, books: Dict[str, Tuple[int, str]]
+) -> Dict[str, Any]:
     """
+    Returns the JSON-serializable statistics of a track.
 
-    def get_srtm_dir(self) -> str:
-        """ The default path to store files. """
-        # Local cache path:
-        result = absolute_path("../srtm_cache")
+    Args:
+        stats (TrackStats): The track from the track index.
+        books (Dict): Refer to get_accessible_books().
+    """
+    book_id, book_title = books[stats.book_url]
+    return {
+        "bookId": book_id,
+        "bookUrl": stats.book_url,
+        "bookTitle": book_title,
+        "gpxName": stats.gpx_name,
+        "bbox": stats.get_bounds(),
+        "points": stats.points,
+        "length": stats.length,
+        "minimumAltitude": stats.minimum_altitude,
+        "maximumAltitude": stats.maximum_altitude,
+        "elevationGain": stats.elevation_gain,
+        "elevationLoss": stats.elevation_loss,
+    }
+
+
+@map_app.route("/tracks")
+@same_site
+def tracks_in_area() -> FlaskResponse:
+    """
+    XHR request. Find the tracks in an area thanks to the spatial index of
+    the track index, the tracks of the books not accessible based on the
+    user access level are excluded. A map of all tracks is one request with
+    ``bbox=-180,-90,180,90``.
 
-        if not os.path.exists(result):
-            os.makedirs(result)  # pragma: no cover
+    The query string is ``bbox=west,south,east,north`` in decimal degrees.
 
-        return result
+    Returns:
+        JSON with the ``tracks`` sorted by book and GPX name,
+        refer to track_stats_to_json().
+    """
+    try:
+        west, south, east, north = (
+            float(coordinate) for coordinate in request.args["bbox"].split(",")
+        )
+        if not (-180 <= west <= east <= 180 and -90 <= south <= north <= 90):
+            raise ValueError("Invalid area")
+    except (KeyError, ValueError):
+        return basic_json(False, "Bad request, expected bbox=west,south,east,north!")
+    books = get_accessible_books()
+    tracks = get_track_index().find((west, south, east, north), books)
+    return basic_json(
+        True,
+        "{} track(s) found.".format(len(tracks)),
+        {"tracks": [track_stats_to_json(track, books) for track in tracks]},
+    )
+
+
+@map_app.route("/tracks/nearest")
+@same_site
+def nearest_track() -> FlaskResponse:
+    """
+    XHR request. Find the track nearest to a point thanks to the spatial
+    index of the track index, the tracks of the books not accessible based
+    on the user access level are excluded.
+
+    The query string is ``lon=...&lat=...`` in decimal degrees.
+
+    Returns:
+        JSON with the ``track`` (refer to track_stats_to_json()) and the
+        approximate ``distance`` in meters, both null if there is no track.
+    """
+    longitude = request.args.get("lon", type=float)
+    latitude = request.args.get("lat", type=float)
+    if (
+        longitude is None
+        or latitude is None
+        or not (-180 <= longitude <= 180 and -90 <= latitude <= 90)
+    ):
+        return basic_json(False, "Bad request, expected lon and lat!")
+    books = get_accessible_books()
+    nearest = get_track_index().nearest(longitude, latitude, books)
+    if nearest is None:
+        return basic_json(True, "No track found.", {"track": None, "distance": None})
+    return basic_json(
+        True,
+        "Track found.",
+        {"track": track_stats_to_json(nearest[0], books), "distance": nearest[1]},
+    )
+
+
+@map_app.route("/tracks/<int:z>/<int:x>/<int:y>.mvt")
+@same_site
+def track_tile(z: int, x: int, y: int) -> FlaskResponse:
+    """
+    Send a Mapbox Vector Tile of all the tracks accessible based on the user
+    access level, so that a map of all the tracks is rendered without
+    downloading every track. The pieces of tracks are read from the spatial
+    index of the track index, clipped to the tile and simplified based on
+    the zoom level. The layer is ``tracks`` and the feature properties are
+    ``bookId``, ``gpxName`` and ``length`` in meters.
+
+    The tiles are cached per access level. The cache key also depends on the
+    accessible books and on the track index revision, so that a modified
+    track or book access level is never served from an outdated tile.
+
+    Args:
+        z (int): Zoom level.
+        x (int): Column of the tile.
+        y (int): Row of the tile.
+
+    Returns:
+        The tile, empty if there is no track in the tile.
+
+    Raises:
+        404: Tile out of range.
+    """
+    if z > current_app.config["TRACK_TILES_MAX_ZOOM"] or max(x, y) >= 2 ** z:
+        abort(404)
+    books = get_accessible_books()
+    track_index = get_track_index()
+    cache_key = "track_tiles/{}/{}/{}/{}/{}".format(
+        actual_access_level(),
+        hashlib.sha1(
+            repr((track_index.get_revision(), sorted(books))).encode()
+        ).hexdigest(),
+        z,
+        x,
+        y,
+    )
+    tile = cache.get(cache_key)
+    if tile is None:
+        pieces = track_index.get_pieces(get_tile_bounds(z, x, y, BUFFER), books)
+        tracks: Dict[Tuple[str, str, float], List[Sequence[float]]] = {}
+        for book_url, gpx_name, length, coordinates in pieces:
+            tracks.setdefault((book_url, gpx_name, length), []).append(coordinates)
+        tile = encode_tile(  # type: ignore[assignment]
+            "tracks",
+            (
+                (
+                    get_tile_lines(track_pieces, z, x, y),
+                    {
+                        "bookId": books[book_url][0],
+                        "gpxName": gpx_name,
+                        "length": int(round(length)),
+                    },
+                )
+                for (book_url, gpx_name, length), track_pieces in tracks.items()
+            ),
+        )
+        cache.set(cache_key, tile)
+    response = make_response(tile)
+    response.mimetype = "application/vnd.mapbox-vector-tile"
+    return response
+
+
+@map_app.route("/elevation", methods=("POST",))
+@same_site
+def elevation() -> FlaskResponse:
+    """
+    XHR request. Bilinear interpolation of the SRTM elevation of a list of
+    points. Only the tiles already in the SRTM cache are used, the elevation
+    is unknown elsewhere.
+
+    The request body is a JSON object: ``{"points": [[lon, lat], ...]}``
+    with at most ELEVATION_MAX_POINTS points in decimal degrees.
+
+    Returns:
+        JSON with the ``elevations`` in meters (null if unknown) in the
+        same order as the points.
+    """
+    data = request.get_json(silent=True)
+    points = data.get("points") if isinstance(data, dict) else None
+    try:
+        if not isinstance(points, list) or not points:
+            raise ValueError("Expected a list of points")
+        if len(points) > current_app.config["ELEVATION_MAX_POINTS"]:
+            raise ValueError("Too many points")
+        if not all(
+            isinstance(point, list)
+            and len(point) == 2
+            and all(
+                isinstance(value, (int, float)) and not isinstance(value, bool)
+                for value in point
+            )
+            for point in points
+        ):
+            raise ValueError("Expected two numbers per point")
+        longitudes = [float(lon) for lon, _ in points]
+        latitudes = [float(lat) for _, lat in points]
+        if not all(-90 <= lat < 90 for lat in latitudes) or not all(
+            -180 <= lon < 180 for lon in longitudes
+        ):
+            raise ValueError("Coordinates out of range")
+    except (TypeError, ValueError):
+        return basic_json(False, "Bad request, expected points as [lon, lat]!")
+    elevations = get_elevation_data().get_elevations(
+        latitudes, longitudes, interpolate=True
+    )
+    return basic_json(True, "Elevations found.", {"elevations": elevations})
 
 
 def gpx_to_webtrack_with_elevation(
-    gpx_path: str, webtrack_path: str, credentials: Dict[str, str]
+    gpx_path: str,
+    webtrack_path: str,
+    credentials: Dict[str, str],
+    srtm_settings: Optional[Dict] = None,
 ) -> None:
     """
     Find out the elevation profile of ``gpx_path`` thanks to SRTM data
     version 3.0 with 1-arc-second for the whole world and save the result
-    into ``webtrack_path`` which is overwritten if already existing.
+    into ``webtrack_path`` which is overwritten if already existing. The
+    WebTrack is written in all the format versions, each file is atomically
+    replaced, refer to get_webtrack_path() for the names.
 
-    SRTM data are stored in the folder specified in CustomFileHandler().get_srtm_dir()
+    SRTM data are stored in the SRTM_CACHE_DIR folder. The missing tiles of the
+    track are downloaded in parallel beforehand and the least recently used
+    tiles are then evicted if the cache exceeds SRTM_CACHE_MAX_BYTES, see
+    srtm_cache.SrtmTileManager.
 
     * Data source: https://e4ftl01.cr.usgs.gov/MEASURES/SRTMGL1.003/
     * Also: https://lpdaac.usgs.gov/products/srtmgl1v003/
@@ -450,111 +1740,104 @@ def gpx_to_webtrack_with_elevation(
         GPX tracks and segments are merged and only one WebTrack segment is created
         because the GPX track is a *one go* tramping trip.
 
-    How to use gpxpy: https://github.com/tkrajina/gpxpy
-
-    How to use SRTM.py: https://github.com/nawagers/srtm.py/tree/EarthDataLogin
+    The GPX file is parsed once and cached into compact arrays, see gpx_reader.load_gpx().
 
     Args:
         gpx_path (str): Secured path to the input file.
-        webtrack_path (str): Secured path to the overwritten output file.
+        webtrack_path (str): Secured path to the WebTrack in the default format.
         credentials (Dict[str, str]): NASA credentials.
+        srtm_settings (Dict): Refer to get_srtm_settings(), which is the default.
 
     Returns:
         The result is saved into a file, nothing is returned.
     """
-    elevation_data = srtm.data.GeoElevationData(
-        version="v3.1a",
-        EDuser=credentials["username"],
-        EDpass=credentials["password"],
-        file_handler=CustomFileHandler(),
+    if srtm_settings is None:
+        srtm_settings = get_srtm_settings()
+    tile_manager = get_srtm_tile_manager(credentials, srtm_settings)
+    gpx = load_gpx(gpx_path)
+    tiles = get_tile_keys(
+        [waypoint.latitude for waypoint in gpx.waypoints],
+        [waypoint.longitude for waypoint in gpx.waypoints],
     )
-    with open(gpx_path, "r") as input_gpx_file:
-        gpx = gpxpy.parse(input_gpx_file)
-        elevation_data.add_elevations(gpx, smooth=True)
-        elevation_profile = []
-        elevation_min = 10000
-        elevation_max = -elevation_min
-        elevation_total_gain = 0
-        elevation_total_loss = 0
-        current_length = 0
-        delta_h = None
-        for track in gpx.tracks:
-            for segment in track.segments:
-                for gps_curr_point in segment.points:
-                    # add point to segment:
-                    if delta_h is not None:
-                        current_length += gpxpy.geo.haversine_distance(
-                            gps_curr_point.latitude,
-                            gps_curr_point.longitude,
-                            gps_prev_point.latitude,
-                            gps_prev_point.longitude,
-                        )
-                    elevation_profile.append(
-                        [
-                            gps_curr_point.longitude,
-                            gps_curr_point.latitude,
-                            current_length,
-                            gps_curr_point.elevation,
-                        ]
-                    )
-
-                    # statistics:
-                    if gps_curr_point.elevation is None:
-                        raise ValueError("Expected elevation to be known.")
-                    if elevation_min > gps_curr_point.elevation:  # type: ignore[operator]
-                        elevation_min = gps_curr_point.elevation  # type: ignore[assignment]
-                    if elevation_max < gps_curr_point.elevation:  # type: ignore[operator]
-                        elevation_max = gps_curr_point.elevation  # type: ignore[assignment]
-                    if delta_h is None:
-                        delta_h = gps_curr_point.elevation
-                    else:
-                        delta_h = gps_curr_point.elevation - gps_prev_point.elevation
-                        if delta_h > 0:
-                            elevation_total_gain += delta_h
-                        else:
-                            elevation_total_loss -= (
-                                delta_h  # keep loss positive/unsigned
-                            )
-
-                    gps_prev_point = gpxpy.geo.Location(
-                        gps_curr_point.latitude,
-                        gps_curr_point.longitude,
-                        gps_curr_point.elevation,
-                    )
-
-        waypoints = []
-        for waypoint in gpx.waypoints:
-            point_ele = elevation_data.get_elevation(
-                waypoint.latitude, waypoint.longitude, approximate=False
-            )
-            waypoints.append(
-                [
-                    waypoint.longitude,
-                    waypoint.latitude,
-                    True,  # with elevation
-                    point_ele,
-                    waypoint.symbol,
-                    waypoint.name,
-                ]
-            )
+    for segment in gpx.segments():
+        tiles |= get_tile_keys(segment.latitudes, segment.longitudes)
+    tile_manager.prefetch(tiles)
+    elevation_data = get_elevation_data(srtm_settings, tile_manager.fetch_tile)
+    add_sampled_elevations(elevation_data, gpx)
+    elevation_profile = []
+    elevation_min = 10000
+    elevation_max = -elevation_min
+    elevation_total_gain = 0.0
+    elevation_total_loss = 0.0
+    current_length = 0.0
+    delta_h = None
+    for segment in gpx.segments():
+        for i in range(len(segment)):
+            curr_lat = segment.latitudes[i]
+            curr_lon = segment.longitudes[i]
+            curr_ele = segment.get_elevation(i)
+
+            # add point to segment:
+            if delta_h is not None:
+                current_length += gpxpy.geo.haversine_distance(
+                    curr_lat, curr_lon, prev_lat, prev_lon
+                )
+            elevation_profile.append([curr_lon, curr_lat, current_length, curr_ele])
+
+            # statistics:
+            if curr_ele is None:
+                raise ValueError("Expected elevation to be known.")
+            if elevation_min > curr_ele:
+                elevation_min = curr_ele  # type: ignore[assignment]
+            if elevation_max < curr_ele:
+                elevation_max = curr_ele  # type: ignore[assignment]
+            if delta_h is None:
+                delta_h = curr_ele
+            else:
+                delta_h = curr_ele - prev_ele
+                if delta_h > 0:
+                    elevation_total_gain += delta_h
+                else:
+                    elevation_total_loss -= delta_h  # keep loss positive/unsigned
+
+            prev_lat, prev_lon, prev_ele = curr_lat, curr_lon, curr_ele
+
+    waypoints = []
+    for waypoint in gpx.waypoints:
+        point_ele = elevation_data.get_elevation(waypoint.latitude, waypoint.longitude)
+        waypoints.append(
+            [
+                waypoint.longitude,
+                waypoint.latitude,
+                True,  # with elevation
+                point_ele,
+                waypoint.symbol,
+                waypoint.name,
+            ]
+        )
 
-        full_profile = {
-            "segments": [{"withEle": True, "points": elevation_profile}],
-            "waypoints": waypoints,
-            "trackInformation": {
-                "length": current_length,
-                "minimumAltitude": elevation_min,
-                "maximumAltitude": elevation_max,
-                "elevationGain": elevation_total_gain,
-                "elevationLoss": elevation_total_loss,
-            },
-        }
+    full_profile = {
+        "segments": [{"withEle": True, "points": elevation_profile}],
+        "waypoints": waypoints,
+        "trackInformation": {
+            "length": current_length,
+            "minimumAltitude": elevation_min,
+            "maximumAltitude": elevation_max,
+            "elevationGain": elevation_total_gain,
+            "elevationLoss": elevation_total_loss,
+        },
+    }
 
-        webtrack = WebTrack()
-        webtrack.to_file(webtrack_path, full_profile)
+    for format_version in WEBTRACK_FORMAT_VERSIONS:
+        webtrack = WebTrack(format_version=format_version)
+        replace_file_atomically(
+            get_webtrack_path(webtrack_path, format_version),
+            functools.partial(webtrack.to_file, data=full_profile),
+        )
+    tile_manager.evict(keep=tiles)
 
 
-def gpx_to_simplified_geojson(gpx_path: str) -> str:
+def gpx_to_simplified_geojson(gpx_path: str, lod: int = 0) -> str:
     """
     Create a GeoJSON string based on the GPX file ``gpx_path``.
     A GPX trk with multiple trkseg is converted into a GeoJSON
@@ -573,36 +1856,229 @@ def gpx_to_simplified_geojson(gpx_path: str) -> str:
         * Track names and and similar meta-data are excluded.
         * Timestamps are excluded.
         * Floating points are reduced to 4 digits (handheld GPS accuracy, 11m at equator).
-        * Tracks are simplified with the Ramer-Douglas-Peucker algorithm.
+        * Tracks are simplified with the Ramer-Douglas-Peucker algorithm,
+          refer to GEOJSON_LOD_MAX_DISTANCES for the tolerance.
 
     Args:
         gpx_path (str): Secured path to the input file.
+        lod (int): Level of detail, refer to get_geojson_lod().
 
     Returns:
         str: A GeoJSON string ready to be saved into a file and/or sent.
+        Refer to iter_geojson() to stream the GeoJSON instead.
     """
-    with open(gpx_path, "r") as input_gpx_file:
-        gpx = gpxpy.parse(input_gpx_file)
-    gpx.simplify()
-    str_geo = '{"type":"FeatureCollection","features":['
-    for track in gpx.tracks:
-        is_multiline = len(track.segments) > 1
-        str_geo += '{"type":"Feature","properties":{},"geometry":{"type":'
-        str_geo += '"MultiLineString"' if is_multiline else '"LineString"'
-        str_geo += ',"coordinates":'
-        if is_multiline:
-            str_geo += "["
-        for segment in track.segments:
-            str_geo += "["
-            for gps_point in segment.points:
-                lon = str(round(gps_point.longitude, 4))
-                lat = str(round(gps_point.latitude, 4))
-                str_geo += "[" + lon + "," + lat + "],"
-            str_geo = str_geo[:-1] + "],"  # remove the last ,
+    gpx = load_gpx(gpx_path)
+    max_distance = GEOJSON_LOD_MAX_DISTANCES[lod]
+    return "".join(
+        iter_geojson(
+            gpx,
+            [
+                [segment.simplify_indices(max_distance) for segment in track]
+                for track in gpx.tracks
+            ],
+        )
+    )
+
+
+def gpx_to_geojson_lods(gpx_path: str, geojson_path: str) -> None:
+    """
+    Create all the GeoJSON levels of detail of the GPX file ``gpx_path``.
+    The GPX file is read and the points are ranked only once. Each file
+    is atomically replaced, refer to get_geojson_lod_path() for the names.
+
+    Args:
+        gpx_path (str): Secured path to the input file.
+        geojson_path (str): Secured path to the full detail GeoJSON file.
+    """
+    gpx = load_gpx(gpx_path)
+    importances = [
+        [segment.get_importances() for segment in track] for track in gpx.tracks
+    ]
+    for lod, max_distance in enumerate(GEOJSON_LOD_MAX_DISTANCES):
+        indices = [
+            [
+                [
+                    i
+                    for i, importance in enumerate(segment)
+                    if importance >= max_distance
+                ]
+                for segment in track
+            ]
+            for track in importances
+        ]
+
+        def write(tmp_path: str) -> None:
+            with open(tmp_path, "w") as geojson_file:
+                geojson_file.writelines(iter_geojson(gpx, indices))
+
+        replace_file_atomically(get_geojson_lod_path(geojson_path, lod), write)
+
+
+def iter_geojson(gpx: StreamedGpx, indices: List[List[List[int]]]) -> Iterator[str]:
+    """
+    Generate a GeoJSON string chunk by chunk, one chunk per segment, refer to
+    gpx_to_simplified_geojson(). The chunks can be written into a file or
+    streamed in a response without building the whole string.
+
+    Args:
+        gpx (StreamedGpx): Tracks to convert.
+        indices (List[List[List[int]]]): Indices of the points to keep for
+            each segment of each track.
+
+    Yields:
+        str: Consecutive parts of the GeoJSON string.
+    """
+    yield '{"type":"FeatureCollection","features":['
+    yield from iter_geojson_features(gpx, indices)
+    yield "]}"
+
+
+def iter_geojson_features(
+    gpx: StreamedGpx, indices: List[List[List[int]]], name: Optional[str] = None
+) -> Iterator[str]:
+    """
+    Generate the comma-separated GeoJSON features of the tracks, one per
+    GPX trk, refer to iter_geojson().
+
+    Args:
+        gpx (StreamedGpx): Tracks to convert.
+        indices (List[List[List[int]]]): Indices of the points to keep for
+            each segment of each track.
+        name (str): Optional 'name' property of the features.
+
+    Yields:
+        str: Consecutive parts of the GeoJSON string.
+    """
+    properties = "{}" if name is None else json.dumps({"name": name})
+    for track_no, (track, track_indices) in enumerate(zip(gpx.tracks, indices)):
+        is_multiline = len(track) > 1
+        if track_no:
+            yield ","
+        yield '{"type":"Feature","properties":' + properties + ',"geometry":{"type":'
         if is_multiline:
-            str_geo = str_geo[:-1] + "],"
-        str_geo = str_geo[:-1] + "}},"
-    return str_geo[:-1] + "]}"
+            yield '"MultiLineString","coordinates":['
+        else:
+            yield '"LineString","coordinates":'
+        for segment_no, (segment, segment_indices) in enumerate(
+            zip(track, track_indices)
+        ):
+            if segment_no:
+                yield ","
+            # rounded per segment, Python floats are printed like str():
+            coordinates = map(
+                "[{!r},{!r}]".format,
+                (round(segment.longitudes[i], 4) for i in segment_indices),
+                (round(segment.latitudes[i], 4) for i in segment_indices),
+            )
+            yield "[" + ",".join(coordinates) + "]"
+        yield "]}}" if is_multiline else "}}"
+
+
+def gpx_to_book_geojson(gpx_paths: List[str], geojson_path: str) -> None:
+    """
+    Create the GeoJSON gathering the tracks of the GPX files ``gpx_paths``,
+    simplified as the full detail GeoJSON of each file. Each GPX trk is a
+    feature with the GPX filename (WITHOUT extension) as 'name' property.
+
+    Args:
+        gpx_paths (List[str]): Secured paths to the input files.
+        geojson_path (str): Secured path to the overwritten output file.
+    """
+    with open(geojson_path, "w") as geojson_file:
+        geojson_file.write('{"type":"FeatureCollection","features":[')
+        has_features = False
+        for gpx_path in gpx_paths:
+            gpx = load_gpx(gpx_path)
+            if not gpx.tracks:
+                continue
+            if has_features:
+                geojson_file.write(",")
+            geojson_file.writelines(
+                iter_geojson_features(
+                    gpx,
+                    [
+                        [
+                            segment.simplify_indices(GEOJSON_LOD_MAX_DISTANCES[0])
+                            for segment in track
+                        ]
+                        for track in gpx.tracks
+                    ],
+                    os.path.splitext(os.path.basename(gpx_path))[0],
+                )
+            )
+            has_features = True
+        geojson_file.write("]}")
+
+
+def gpx_to_flatgeobuf(gpx_paths: List[str], fgb_path: str, title: str = "") -> None:
+    """
+    Create a FlatGeobuf file based on the GPX files ``gpx_paths``, with
+    a spatial index so that a client can fetch with HTTP range requests
+    only the tracks in the viewport. Each GPX trk is a MultiLineString
+    feature with the GPX filename (WITHOUT extension) as 'name' property.
+    The tracks are simplified as the full detail GeoJSON but the
+    coordinates are not rounded.
+
+    Args:
+        gpx_paths (List[str]): Secured paths to the input files.
+        fgb_path (str): Secured path to the overwritten output file.
+        title (str): Title of the dataset.
+    """
+    features: List[Tuple[str, List[Line]]] = []
+    for gpx_path in gpx_paths:
+        name = os.path.splitext(os.path.basename(gpx_path))[0]
+        for track in load_gpx(gpx_path).tracks:
+            lines: List[Line] = []
+            for segment in track:
+                indices = segment.simplify_indices(GEOJSON_LOD_MAX_DISTANCES[0])
+                lines.append(
+                    (
+                        [segment.longitudes[i] for i in indices],
+                        [segment.latitudes[i] for i in indices],
+                    )
+                )
+            features.append((name, lines))
+    write_flatgeobuf(fgb_path, features, title)
+
+
+def get_geojson_lod(max_distance: Optional[float]) -> int:
+    """
+    Returns the coarsest level of detail with a tolerance not above
+    `max_distance`, so that the track looks the same. The full detail
+    level is returned if `max_distance` is not set.
+
+    Args:
+        max_distance (float): Acceptable simplification tolerance in meters,
+            typically the size of a pixel.
+
+    Returns:
+        int: Index in GEOJSON_LOD_MAX_DISTANCES.
+    """
+    lod = 0
+    if max_distance is not None:
+        for i, lod_max_distance in enumerate(GEOJSON_LOD_MAX_DISTANCES):
+            if lod_max_distance <= max_distance:
+                lod = i
+    return lod
+
+
+def get_geojson_lod_ext(lod: int) -> str:
+    """
+    Returns the extension WITHOUT ``.`` of the level of detail `lod` of the
+    GeoJSON files, for example 'lod2.geojson'. The full detail level keeps
+    the usual extension.
+    """
+    if lod == 0:
+        return EXPORT_EXTENSIONS["geojson"]
+    return "lod{}.{}".format(lod, EXPORT_EXTENSIONS["geojson"])
+
+
+def get_geojson_lod_path(path: str, lod: int) -> str:
+    """
+    Returns the path of the level of detail `lod` of the GeoJSON export of
+    `path`, which is the GPX file or any level of detail of its export.
+    """
+    return replace_extension(path, get_geojson_lod_ext(lod))
 
 
 @map_app.route(
@@ -39,6 +39,10 @@ Examples:
 * ``![Alt](image.jpg "Caption" class="can-zoom-in")``
 * ``![Alt](image.jpg "Caption" class="can-zoom-in" config="no-resize")``
 
+If widths are given, the resized figures (neither ``no-resize`` nor
+``can-zoom-in``) of a local JPEG or PNG image get a ``srcset`` of the image
+resized to these widths, served by ``<width>/<image>`` next to the image.
+
 .. note::
     The existing figure processors are under the GPL version, incompatible with the BSD.
 
@@ -103,6 +107,21 @@ class FigureProcessor(BlockProcessor):
         img.set("data-height", str(height))
         return img
 
+    def srcset(self, src: str, width: int) -> Optional[str]:
+        """
+        Returns the srcset of the image resized to the configured widths
+        smaller than its own width (and to its own width if not larger than
+        all of them), or none if the image cannot be resized.
+        """
+        if not self.config["widths"] or not re.fullmatch(
+            r"[^/:?#]+\.(jpe?g|png)", src, re.IGNORECASE
+        ):
+            return None
+        widths = [w for w in sorted(self.config["widths"]) if w < width]
+        if width <= max(self.config["widths"]):
+            widths.append(width)
+        return ", ".join("{0}/{1} {0}w".format(w, src) for w in widths)
+
     def image_size(self, src: str) -> Optional[Tuple[int, int]]:
         """ Open the image and returns its size or none. """
         img_path = (
@@ -148,6 +167,15 @@ class FigureProcessor(BlockProcessor):
         else:
             rel_height = str(round(100 * size[1] / size[0], 2)) + "%"
             img.set("style", "position:absolute; top:0; left:0; max-width:100%;")
+            srcset = (
+                self.srcset(src, size[0])
+                if not (class_attr and "can-zoom-in" in class_attr)
+                else None  # the zoom loads the original image
+            )
+            if srcset:
+                img.set("srcset", srcset)
+                img.set("sizes", self.config["sizes"])
+                img.set("width", str(size[0]))  # not the width of the srcset
             div.set(
                 "style",
                 "position:relative; width:100%; height:0; padding-top:" + rel_height,
@@ -168,6 +196,14 @@ class FigureExtension(Extension):
                 kwargs.get("src_path", None),
                 "Path to the image directory.",
             ],
+            "widths": [
+                kwargs.get("widths", []),
+                "Widths in pixel of the srcset, empty to disable.",
+            ],
+            "sizes": [
+                kwargs.get("sizes", "(min-width: 1200px) 1140px, 100vw"),
+                "Display width of the figures, the container width by default.",
+            ],
         }
         super().__init__(**kwargs)
         self.setConfigs(kwargs)
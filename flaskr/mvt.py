@@ -0,0 +1,351 @@
+#
+# Copyright 2021 Clement
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Minimal writer of Mapbox Vector Tiles. Only the features required by the
+track tiles are implemented: one layer of lines with scalar properties.
+The lines are projected, clipped and simplified in tile units so that the
+level of detail follows the zoom level.
+
+Mapbox Vector Tile specifications 2.1:
+https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+"""
+
+import math
+import struct
+
+from .typing import *
+
+#: Size of a tile in tile units, default of the specifications.
+EXTENT: int = 4096
+
+#: Margin in tile units around the tile in which the lines are kept, so
+#: that the line caps are not visible at the tile edges.
+BUFFER: int = 64
+
+#: Tolerance in tile units of the line simplification, half a pixel of a
+#: 512-pixel tile.
+SIMPLIFY_TOLERANCE: float = 4.0
+
+#: Largest latitude of the Web Mercator projection.
+MAX_LATITUDE: float = 85.0511287798066
+
+#: GeomType enum value of LineString.
+LINE_STRING: int = 2
+
+#: Command IDs of the geometry encoding.
+MOVE_TO: int = 1
+LINE_TO: int = 2
+
+#: Point in tile units.
+Point = Tuple[float, float]
+
+#: Property value of a feature.
+Value = Union[str, int, float, bool]
+
+#: Feature of a layer: the lines in tile units and the properties.
+Feature = Tuple[List[List[Point]], Dict[str, Value]]
+
+
+def get_tile_bounds(
+    z: int, x: int, y: int, buffer: int = 0
+) -> Tuple[float, float, float, float]:
+    """
+    Returns the west, south, east and north in decimal degrees of the tile
+    `z`/`x`/`y` enlarged by `buffer` tile units.
+    """
+    tiles_no = 2 ** z
+    margin = buffer / EXTENT
+
+    def longitude(tile_x: float) -> float:
+        return tile_x / tiles_no * 360.0 - 180.0
+
+    def latitude(tile_y: float) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / tiles_no))))
+
+    return (
+        longitude(x - margin),
+        latitude(y + 1 + margin),
+        longitude(x + 1 + margin),
+        latitude(y - margin),
+    )
+
+
+def project(coordinates: Sequence[float], z: int, x: int, y: int) -> List[Point]:
+    """
+    Project the interleaved longitudes and latitudes `coordinates` in tile
+    units of the tile `z`/`x`/`y` (Web Mercator, y pointing south).
+    """
+    scale = 2 ** z * EXTENT
+    points = []
+    for i in range(0, len(coordinates), 2):
+        sin_latitude = math.sin(
+            math.radians(min(max(coordinates[i + 1], -MAX_LATITUDE), MAX_LATITUDE))
+        )
+        points.append(
+            (
+                (coordinates[i] + 180.0) / 360.0 * scale - x * EXTENT,
+                (
+                    0.5
+                    - math.log((1 + sin_latitude) / (1 - sin_latitude)) / (4 * math.pi)
+                )
+                * scale
+                - y * EXTENT,
+            )
+        )
+    return points
+
+
+def _clip_segment(
+    begin: Point, end: Point, low: float, high: float
+) -> Optional[Tuple[Point, Point]]:
+    """
+    Liang-Barsky clipping of a segment to the square [`low`, `high`]².
+
+    Returns:
+        The ends of the segment inside the square, or None if outside.
+    """
+    d_x = end[0] - begin[0]
+    d_y = end[1] - begin[1]
+    t_begin, t_end = 0.0, 1.0
+    for direction, distance in (
+        (-d_x, begin[0] - low),
+        (d_x, high - begin[0]),
+        (-d_y, begin[1] - low),
+        (d_y, high - begin[1]),
+    ):
+        if direction == 0:
+            if distance < 0:
+                return None  # parallel and outside
+        elif direction < 0:
+            t_begin = max(t_begin, distance / direction)
+        else:
+            t_end = min(t_end, distance / direction)
+        if t_begin > t_end:
+            return None
+    return (
+        begin if t_begin == 0 else (begin[0] + t_begin * d_x, begin[1] + t_begin * d_y),
+        end if t_end == 1 else (begin[0] + t_end * d_x, begin[1] + t_end * d_y),
+    )
+
+
+def clip_line(points: List[Point], low: float, high: float) -> List[List[Point]]:
+    """
+    Clip a line to the square [`low`, `high`]².
+
+    Returns:
+        The parts of the line inside the square.
+    """
+    parts = []
+    part: List[Point] = []
+    for begin, end in zip(points, points[1:]):
+        clipped = _clip_segment(begin, end, low, high)
+        if clipped is None:
+            continue
+        if not part:
+            part.append(clipped[0])
+        part.append(clipped[1])
+        if clipped[1] != end:  # the line leaves the square
+            parts.append(part)
+            part = []
+    if part:
+        parts.append(part)
+    return parts
+
+
+def simplify_line(points: List[Point], tolerance: float) -> List[Point]:
+    """
+    Ramer-Douglas-Peucker simplification of a line in tile units.
+    The recursion is replaced by a stack to handle very long lines.
+    """
+    if len(points) < 3:
+        return points
+    kept = [points[0]]
+    stack = [(0, len(points) - 1)]
+    while stack:
+        begin, end = stack.pop()
+        (x_1, y_1), (x_2, y_2) = points[begin], points[end]
+        d_x, d_y = x_2 - x_1, y_2 - y_1
+        length = math.hypot(d_x, d_y)
+        farthest, max_distance = end, -1.0
+        for index in range(begin + 1, end):
+            x_0, y_0 = points[index]
+            if length:
+                distance = abs(d_y * (x_0 - x_1) - d_x * (y_0 - y_1)) / length
+            else:
+                distance = math.hypot(x_0 - x_1, y_0 - y_1)
+            if distance > max_distance:
+                farthest, max_distance = index, distance
+        if max_distance < tolerance:
+            kept.append(points[end])
+        else:
+            # the second half is processed after the first one:
+            stack.append((farthest, end))
+            stack.append((begin, farthest))
+    return kept
+
+
+def get_tile_lines(
+    pieces: Iterable[Sequence[float]], z: int, x: int, y: int
+) -> List[List[Point]]:
+    """
+    Returns the lines of a track in tile units of the tile `z`/`x`/`y`,
+    clipped to the tile and its buffer, and simplified.
+
+    Args:
+        pieces (Iterable[Sequence[float]]): Interleaved longitudes and
+            latitudes of the pieces of the track in order. Two consecutive
+            pieces sharing an end are joined.
+    """
+    lines: List[List[Point]] = []
+    for coordinates in pieces:
+        points = project(coordinates, z, x, y)
+        if lines and lines[-1][-1] == points[0]:
+            lines[-1].extend(points[1:])
+        else:
+            lines.append(points)
+    return [
+        simplify_line(part, SIMPLIFY_TOLERANCE)
+        for line in lines
+        for part in clip_line(line, -BUFFER, EXTENT + BUFFER)
+    ]
+
+
+def _zigzag(n: int) -> int:
+    """ Encode a signed integer so that small absolute values are small. """
+    return n << 1 if n >= 0 else (-n << 1) - 1
+
+
+def _varint(n: int) -> bytes:
+    """ Encode an unsigned integer as a Protocol Buffers varint. """
+    data = bytearray()
+    while n > 0x7F:
+        data.append((n & 0x7F) | 0x80)
+        n >>= 7
+    data.append(n)
+    return bytes(data)
+
+
+def _varint_field(number: int, n: int) -> bytes:
+    """ Encode a varint field. """
+    return _varint(number << 3) + _varint(n)
+
+
+def _bytes_field(number: int, data: bytes) -> bytes:
+    """ Encode a length-delimited field. """
+    return _varint(number << 3 | 2) + _varint(len(data)) + data
+
+
+def _packed_field(number: int, values: Iterable[int]) -> bytes:
+    """ Encode a packed repeated field of varints. """
+    return _bytes_field(number, b"".join(_varint(n) for n in values))
+
+
+def _encode_value(value: Value) -> bytes:
+    """ Encode a Value message. """
+    if isinstance(value, str):
+        return _bytes_field(1, value.encode("utf-8"))
+    if isinstance(value, bool):
+        return _varint_field(7, int(value))
+    if isinstance(value, int):
+        return (
+            _varint_field(5, value) if value >= 0 else _varint_field(6, _zigzag(value))
+        )
+    return _varint(3 << 3 | 1) + struct.pack("<d", value)  # double
+
+
+def encode_geometry(lines: Iterable[List[Point]]) -> List[int]:
+    """
+    Encode lines with the geometry commands, the points are rounded to the
+    tile grid. The lines shorter than one tile unit are dropped.
+    """
+    geometry: List[int] = []
+    cursor = (0, 0)
+    for line in lines:
+        points: List[Tuple[int, int]] = []
+        for point_x, point_y in line:
+            point = (int(round(point_x)), int(round(point_y)))
+            if not points or points[-1] != point:
+                points.append(point)
+        if len(points) < 2:
+            continue
+        for index, point in enumerate(points):
+            if index == 0:
+                geometry.append(MOVE_TO | 1 << 3)
+            elif index == 1:
+                geometry.append(LINE_TO | (len(points) - 1) << 3)
+            geometry.append(_zigzag(point[0] - cursor[0]))
+            geometry.append(_zigzag(point[1] - cursor[1]))
+            cursor = point
+    return geometry
+
+
+def encode_tile(layer_name: str, features: Iterable[Feature]) -> bytes:
+    """
+    Encode a tile of one layer of lines.
+
+    Args:
+        layer_name (str): Name of the layer.
+        features (Iterable[Feature]): Lines in tile units and properties.
+
+    Returns:
+        bytes: The tile, empty if there is no visible feature.
+    """
+    keys: Dict[str, int] = {}
+    # the type is part of the key since True == 1 == 1.0:
+    values: Dict[Tuple[type, Value], int] = {}
+    encoded_features = []
+    for lines, properties in features:
+        geometry = encode_geometry(lines)
+        if not geometry:
+            continue
+        tags = []
+        for key, value in properties.items():
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault((type(value), value), len(values)))
+        encoded_features.append(
+            _bytes_field(
+                2,
+                _packed_field(2, tags)
+                + _varint_field(3, LINE_STRING)
+                + _packed_field(4, geometry),
+            )
+        )
+    if not encoded_features:
+        return b""
+    layer = (
+        _varint_field(15, 2)  # version
+        + _bytes_field(1, layer_name.encode("utf-8"))
+        + b"".join(encoded_features)
+        + b"".join(_bytes_field(3, key.encode("utf-8")) for key in keys)
+        + b"".join(_bytes_field(4, _encode_value(value)) for _, value in values)
+        + _varint_field(5, EXTENT)
+    )
+    return _bytes_field(3, layer)
@@ -0,0 +1,173 @@
+#
+# Copyright 2021 Clement
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Resized images generated on demand for the ``srcset`` of the gallery photos and
+the story figures, so that small screens do not download the large pictures.
+
+A requested width is rounded up to the next width of ``IMAGE_WIDTHS`` so that
+only a few sizes of each image are generated, never larger than the original.
+The image is encoded in AVIF or WebP if the browser accepts it and if Pillow
+supports it, in JPEG otherwise. The resized images are saved into
+``IMAGE_CACHE_FOLDER`` on the first request and generated again when the
+original image is newer.
+"""
+
+from PIL import features
+
+from .utils import *
+
+#: MIME type, Pillow format and file extension of the resized images, by
+#: order of preference. The last one is sent to the browsers accepting none.
+IMAGE_FORMATS: Tuple[Tuple[str, str, str], ...] = (
+    ("image/avif", "AVIF", "avif"),
+    ("image/webp", "WEBP", "webp"),
+    ("image/jpeg", "JPEG", "jpg"),
+)
+
+#: Extensions of the images which can be resized.
+RESIZABLE_EXTENSIONS: Tuple[str, ...] = ("jpg", "jpeg", "png")
+
+
+@functools.lru_cache(maxsize=None)
+def is_format_supported(pil_format: str) -> bool:
+    """ Returns true if Pillow is built with the encoder of `pil_format`. """
+    if pil_format == "JPEG":
+        return True
+    try:
+        return bool(features.check(pil_format.lower()))
+    except ValueError:  # feature unknown by this version of Pillow
+        return False
+
+
+def negotiate_format(accepted_mimetypes: Iterable[str]) -> Tuple[str, str, str]:
+    """
+    Returns the preferred item of IMAGE_FORMATS explicitly accepted by the
+    browser, a wildcard like ``*/*`` does not count.
+
+    Args:
+        accepted_mimetypes: MIME types of the ``Accept`` header with a
+            quality greater than zero.
+    """
+    accepted = set(accepted_mimetypes)
+    for image_format in IMAGE_FORMATS[:-1]:
+        if image_format[0] in accepted and is_format_supported(image_format[1]):
+            return image_format
+    return IMAGE_FORMATS[-1]
+
+
+def get_bucket_width(width: int, widths: Sequence[int]) -> int:
+    """
+    Returns the smallest width of `widths` larger than or equal to `width`,
+    or the largest one.
+    """
+    return min((bucket for bucket in widths if bucket >= width), default=max(widths))
+
+
+def create_resized_image(
+    source_path: str, path: str, width: int, pil_format: str, quality: int
+) -> None:
+    """
+    Resize the image `source_path` to `width` pixels, the aspect ratio being
+    kept and the image never enlarged, and save it atomically into `path`.
+    JPEG images are decoded at the lowest scale larger than the new size.
+
+    Args:
+        source_path (str): Path to the original image.
+        path (str): Path to the resized image.
+        width (int): Maximum width in pixel.
+        pil_format (str): Pillow format of the resized image.
+        quality (int): Image quality in percent.
+    """
+    with Image.open(source_path) as image:
+        size = fit_size(image.size, (width, image.size[1]))
+        image.draft("RGB", size)  # no-op with other formats than JPEG
+        has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+        resized_image = image.convert(
+            "RGBA" if has_alpha and pil_format != "JPEG" else "RGB"
+        ).resize(size, LANCZOS_FILTER, reducing_gap=3.0)
+    replace_file_atomically(
+        path, lambda tmp_path: resized_image.save(tmp_path, pil_format, quality=quality)
+    )
+
+
+def send_resized_image(source_path: str, cache_dir: str, width: int) -> FlaskResponse:
+    """
+    Send the image `source_path` resized to the width bucket of `width` in the
+    format negotiated with the ``Accept`` header of the request. The resized
+    image is generated if missing or older than the original.
+
+    Args:
+        source_path (str): Path to the original image.
+        cache_dir (str): Directory of the resized images of `source_path`.
+        width (int): Width in pixel requested by the browser.
+
+    Raises:
+        404: if the original image does not exist or cannot be read.
+    """
+    try:
+        source_mtime = os.stat(source_path).st_mtime_ns
+    except FileNotFoundError:
+        abort(404)
+    bucket = get_bucket_width(width, current_app.config["IMAGE_WIDTHS"])
+    mimetype, pil_format, ext = negotiate_format(
+        mimetype
+        for mimetype, quality in request.accept_mimetypes
+        if quality > 0  # ignore the explicitly refused types
+    )
+    path = os.path.join(
+        cache_dir, "{}.{}w.{}".format(os.path.basename(source_path), bucket, ext)
+    )
+
+    def is_outdated() -> bool:
+        try:
+            return os.stat(path).st_mtime_ns < source_mtime
+        except FileNotFoundError:
+            return True
+
+    if is_outdated():
+        os.makedirs(cache_dir, exist_ok=True)
+        with file_lock(path + ".lock"):
+            if is_outdated():  # not generated by a concurrent request
+                try:
+                    create_resized_image(
+                        source_path,
+                        path,
+                        bucket,
+                        pil_format,
+                        current_app.config["IMAGE_QUALITY"],
+                    )
+                except OSError:
+                    abort(404)
+    response = make_response(
+        send_offloaded_file(cache_dir, os.path.basename(path), mimetype=mimetype)
+    )
+    response.vary.add("Accept")
+    return response
@@ -0,0 +1,264 @@
+#
+# Copyright 2021 Clement
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Manager of the local SRTM cache shared by the elevation engines.
+
+The tiles needed by a track are downloaded all at once in parallel before
+looking up the elevations, checked (HTTP size, ZIP checksum, HGT size), and
+extracted into the cache. The least recently used tiles are removed when the
+cache exceeds its disk budget. Refer to elevation.SrtmElevationData for the
+lookups, which refreshes the modification time of the tiles it opens.
+
+A tile missing from the server (such as an ocean) is recorded as an empty
+'.missing' file so that it is not requested again.
+"""
+
+import math
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from .elevation import get_hgt_side
+from .elevation import get_tile_name
+from .utils import *
+
+#: Key of a tile: latitude and longitude in degrees of the south-west corner.
+TileKey = Tuple[int, int]
+
+#: Size in bytes of the chunks read from the server.
+DOWNLOAD_CHUNK_SIZE: int = 1024 * 1024
+
+
+def get_tile_keys(
+    latitudes: Iterable[float], longitudes: Iterable[float]
+) -> Set[TileKey]:
+    """ Returns the tiles containing at least one of the points. """
+    return {
+        (math.floor(latitude), math.floor(longitude))
+        for latitude, longitude in zip(latitudes, longitudes)
+    }
+
+
+class EarthdataSession(requests.Session):
+    """
+    Session keeping the credentials when redirected to or from the NASA
+    Earthdata Login, and only then. Refer to:
+    https://urs.earthdata.nasa.gov/documentation/for_users/data_access/python
+    """
+
+    #: Host of the NASA Earthdata Login.
+    AUTH_HOST: str = "urs.earthdata.nasa.gov"
+
+    def rebuild_auth(self, prepared_request, response):
+        """ Overrides requests.Session.rebuild_auth(). """
+        headers = prepared_request.headers
+        if "Authorization" in headers:
+            original_host = requests.utils.urlparse(response.request.url).hostname
+            redirect_host = requests.utils.urlparse(prepared_request.url).hostname
+            if (
+                original_host != redirect_host
+                and redirect_host != self.AUTH_HOST
+                and original_host != self.AUTH_HOST
+            ):
+                del headers["Authorization"]
+
+
+class SrtmTileManager:
+    """
+    Download, check and evict the HGT files of `srtm_dir`. Thread-safe and
+    shared by all processes thanks to one lock file per tile.
+    """
+
+    def __init__(
+        self,
+        srtm_dir: str,
+        url: str,
+        credentials: Optional[Dict[str, str]] = None,
+        max_bytes: int = 2 * 1024 ** 3,
+        jobs: int = 6,
+        timeout: int = 60,
+    ):
+        """
+        Args:
+            srtm_dir (str): Directory of the HGT files.
+            url (str): URL of the zipped tiles where {} is the tile name
+                without extension, for example 'N45E006'.
+            credentials (Dict[str, str]): NASA Earthdata username and password.
+            max_bytes (int): Disk budget of the HGT files in bytes.
+            jobs (int): Maximum number of simultaneous downloads.
+            timeout (int): Seconds waiting for the server.
+        """
+        self.srtm_dir = srtm_dir
+        self.url = url
+        self.credentials = credentials
+        self.max_bytes = max_bytes
+        self.jobs = jobs
+        self.timeout = timeout
+
+    def get_path(self, key: TileKey) -> str:
+        """ Returns the path to the HGT file of the tile. """
+        return os.path.join(self.srtm_dir, get_tile_name(*key))
+
+    def is_cached(self, key: TileKey) -> bool:
+        """ Returns true if the tile is in the cache or known as missing. """
+        path = self.get_path(key)
+        return any(os.path.isfile(path + ext) for ext in ("", ".zip", ".missing"))
+
+    def prefetch(self, keys: Iterable[TileKey]) -> List[TileKey]:
+        """
+        Download in parallel the tiles not in the cache yet.
+
+        Returns:
+            List[TileKey]: The tiles downloaded.
+
+        Raises:
+            requests.exceptions.RequestException: Connection or HTTP error.
+            ValueError: Corrupted tile.
+        """
+        keys = sorted(key for key in set(keys) if not self.is_cached(key))
+        if not keys:
+            return []
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            downloaded = list(executor.map(self.download, keys))
+        return [key for key, done in zip(keys, downloaded) if done]
+
+    def fetch_tile(self, latitude: float, longitude: float) -> None:
+        """
+        Download the tile containing the point if not in the cache yet.
+        Refer to elevation.SrtmElevationData for this callback.
+        """
+        key = (math.floor(latitude), math.floor(longitude))
+        if not self.is_cached(key):
+            self.download(key)
+
+    def download(self, key: TileKey) -> bool:
+        """
+        Download, check and extract the tile into the cache. Only one process
+        downloads a tile, the other ones wait and reuse it.
+
+        Returns:
+            bool: False if the tile is missing from the server or was
+            downloaded by an other process in the meantime.
+
+        Raises:
+            requests.exceptions.RequestException: Connection or HTTP error.
+            ValueError: Corrupted tile.
+        """
+        path = self.get_path(key)
+        with file_lock(path + ".lock"):
+            if self.is_cached(key):
+                return False
+            url = self.url.format(os.path.splitext(os.path.basename(path))[0])
+            with EarthdataSession() as session, tempfile.TemporaryFile() as zip_file:
+                if self.credentials is not None:
+                    session.auth = (
+                        self.credentials["username"],
+                        self.credentials["password"],
+                    )
+                with session.get(url, timeout=self.timeout, stream=True) as response:
+                    if response.status_code == 404:
+                        open(path + ".missing", "w").close()
+                        return False
+                    response.raise_for_status()
+                    size = 0
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        zip_file.write(chunk)
+                        size += len(chunk)
+                expected_size = response.headers.get("Content-Length")
+                if expected_size is not None and int(expected_size) != size:
+                    raise ValueError("Truncated SRTM tile: " + url)
+                replace_file_atomically(
+                    path, functools.partial(self._extract, zip_file, url)
+                )
+        return True
+
+    @staticmethod
+    def _extract(zip_file: BinaryIO, url: str, hgt_path: str) -> None:
+        """
+        Check the ZIP file and extract the HGT file into `hgt_path`.
+
+        Raises:
+            ValueError: Corrupted tile.
+        """
+        try:
+            with zipfile.ZipFile(zip_file) as hgt_zip:
+                if hgt_zip.testzip() is not None:
+                    raise ValueError("Bad checksum")
+                hgt_infos = [
+                    info
+                    for info in hgt_zip.infolist()
+                    if info.filename.endswith(".hgt")
+                ]
+                if len(hgt_infos) != 1:
+                    raise ValueError("Expected one HGT file")
+                get_hgt_side(hgt_infos[0].file_size)
+                with hgt_zip.open(hgt_infos[0]) as src, open(hgt_path, "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+        except (zipfile.BadZipFile, ValueError) as error:
+            raise ValueError("Corrupted SRTM tile {}: {}".format(url, error)) from error
+
+    def evict(self, keep: Iterable[TileKey] = ()) -> List[str]:
+        """
+        Remove the least recently used HGT files (plain or zipped) until the
+        cache fits into the disk budget. The tiles in use by other processes
+        stay readable until closed.
+
+        Args:
+            keep (Iterable[TileKey]): Tiles never removed, such as the tiles
+                of the track being processed.
+
+        Returns:
+            List[str]: The filenames removed.
+        """
+        kept_names = {get_tile_name(*key) for key in keep}
+        files = []
+        total_size = 0
+        with os.scandir(self.srtm_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith((".hgt", ".hgt.zip")) and entry.is_file():
+                    stat_result = entry.stat()
+                    files.append(
+                        (stat_result.st_mtime, entry.name, stat_result.st_size)
+                    )
+                    total_size += stat_result.st_size
+        removed = []
+        for _, filename, size in sorted(files):
+            if total_size <= self.max_bytes:
+                break
+            if filename.split(".")[0] + ".hgt" in kept_names:
+                continue
+            try:
+                os.remove(os.path.join(self.srtm_dir, filename))
+            except FileNotFoundError:  # pragma: no cover
+                pass  # removed by an other process
+            total_size -= size
+            removed.append(filename)
+        return removed
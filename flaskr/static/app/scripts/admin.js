@@ -37,6 +37,18 @@ var url_add_photo = url_prefix + "/photos/add/request";
 /** URL to which the submitted new book and its information are processed. */
 var url_add_book = url_prefix + "/books/add/request";
 
+/** URL to which a resumable upload is started. */
+var url_new_upload = url_prefix + "/uploads/new";
+
+/** Size in bytes of the chunks of the resumable uploads. */
+var upload_chunk_size = 8 * 1024 * 1024;
+
+/** Milliseconds to wait before resuming a failed upload. */
+var upload_retry_delay = 3000;
+
+/** Maximum number of consecutive failures before giving up an upload. */
+var upload_max_retries = 20;
+
 /** URL to which the submitted change of access level is processed. */
 var url_change_access_level = url_prefix + "/members/change_access_level";
 
@@ -281,37 +293,134 @@ var update_progress_bar = function (el, value, text) {
 };
 
 /**
- * Update the progress bar. To be used as xhr in the JQuery ajax context.
- * @see init_admin_add_photo()
+ * Upload the `file` by chunks into a resumable upload. After a failure, the
+ * number of bytes received by the server is requested and the upload resumes
+ * from there.
+ * @param file {File} - File selected in a file input.
+ * @param on_progress {Function} - Called with the number of bytes received.
+ * @return {Object} JQuery promise resolved with the upload identifier.
  */
-var xhr_progress_bar = function () {
-    var xhr = new window.XMLHttpRequest();
-    update_progress_bar($("#photo-progress").show(), 0, "Uploading...");
-
-    xhr.upload.addEventListener(
-        "progress",
-        function (evt) {
-            if (evt.lengthComputable) {
-                var percent_complete = evt.loaded / evt.total;
-                percent_complete = parseInt(percent_complete * 100);
-                update_progress_bar(
-                    $("#photo-progress"),
-                    percent_complete,
-                    "Uploading..."
-                );
+var upload_by_chunks = function (file, on_progress) {
+    var deferred = $.Deferred();
+    var upload_id = null;
+    var retries = 0;
+
+    var retry = function (info) {
+        retries++;
+        if (retries > upload_max_retries) {
+            deferred.reject(info);
+            return;
+        }
+        setTimeout(function () {
+            $.ajax({
+                url: url_prefix + "/uploads/" + upload_id,
+                method: "GET",
+                dataType: "json",
+                success: function (result) {
+                    send_chunk(result.offset);
+                },
+                error: function () {
+                    retry(info);
+                },
+            });
+        }, upload_retry_delay);
+    };
 
-                if (percent_complete === 100) {
-                    update_progress_bar(
-                        $("#photo-progress"),
-                        100,
-                        "Processing..."
-                    );
+    var send_chunk = function (offset) {
+        on_progress(offset);
+        if (offset >= file.size) {
+            deferred.resolve(upload_id);
+            return;
+        }
+        $.ajax({
+            url: url_prefix + "/uploads/" + upload_id + "?offset=" + offset,
+            method: "POST",
+            data: file.slice(offset, offset + upload_chunk_size),
+            processData: false,
+            contentType: "application/octet-stream",
+            dataType: "json",
+            success: function (result) {
+                if (result.success) {
+                    retries = 0;
+                    send_chunk(result.offset);
+                } else {
+                    retry(result.info);
                 }
+            },
+            error: function () {
+                retry("Connection lost!");
+            },
+        });
+    };
+
+    $.ajax({
+        url: url_new_upload,
+        method: "POST",
+        data: { filename: file.name, size: file.size },
+        dataType: "json",
+        success: function (result) {
+            if (result.success) {
+                upload_id = result.upload_id;
+                send_chunk(result.offset);
+            } else {
+                deferred.reject(result.info);
             }
         },
-        false
-    );
-    return xhr;
+        error: function () {
+            deferred.reject("Cannot start the upload!");
+        },
+    });
+    return deferred.promise();
+};
+
+/**
+ * Upload the files of the `form` by chunks and replace them in the returned
+ * form data by the upload identifiers.
+ * @param form {Object} - Form with file inputs.
+ * @param on_progress {Function} - Called with the percent of bytes received.
+ * @return {Object} JQuery promise resolved with the form data.
+ */
+var upload_form_files = function (form, on_progress) {
+    var form_data = new FormData(form);
+    var inputs = $(form)
+        .find("input[type=file]")
+        .filter(function () {
+            return this.files.length > 0;
+        })
+        .toArray();
+    var total_size = inputs.reduce(function (size, input) {
+        return size + input.files[0].size;
+    }, 0);
+    var uploaded_size = 0;
+    var deferred = $.Deferred();
+
+    var upload_next = function () {
+        var input = inputs.shift();
+        if (typeof input === "undefined") {
+            deferred.resolve(form_data);
+            return;
+        }
+        var file = input.files[0];
+        upload_by_chunks(file, function (offset) {
+            on_progress(
+                total_size
+                    ? parseInt(((uploaded_size + offset) / total_size) * 100)
+                    : 100
+            );
+        })
+            .done(function (upload_id) {
+                uploaded_size += file.size;
+                form_data.delete(input.name);
+                form_data.append(input.name + "-upload", upload_id);
+                upload_next();
+            })
+            .fail(function (info) {
+                deferred.reject(info);
+            });
+    };
+
+    upload_next();
+    return deferred.promise();
 };
 
 /**
@@ -527,25 +636,34 @@ var init_admin_add_photo = function () {
     }
     $("#admin-add").submit(function (e) {
         refresh_submit_button(false, 0, "#admin-add");
-        $.ajax({
-            xhr: xhr_progress_bar,
-            url: url_add_photo,
-            async: true,
-            method: "POST",
-            data: new FormData(this),
-            processData: false, // required when transferring FormData
-            contentType: false, // required when transferring FormData
-            dataType: "json",
-            success: function (result) {
-                append_info(result, "#admin-add");
-                refresh_submit_button(true, 0, "#admin-add");
-                update_progress_bar(
-                    $("#photo-progress").hide(),
-                    0,
-                    "Uploading..."
-                );
-            },
-        });
+        update_progress_bar($("#photo-progress").show(), 0, "Uploading...");
+        var done = function (result) {
+            append_info(result, "#admin-add");
+            refresh_submit_button(true, 0, "#admin-add");
+            update_progress_bar($("#photo-progress").hide(), 0, "Uploading...");
+        };
+        upload_form_files(this, function (percent_complete) {
+            update_progress_bar(
+                $("#photo-progress"),
+                percent_complete,
+                percent_complete === 100 ? "Processing..." : "Uploading..."
+            );
+        })
+            .done(function (form_data) {
+                $.ajax({
+                    url: url_add_photo,
+                    async: true,
+                    method: "POST",
+                    data: form_data,
+                    processData: false, // required when transferring FormData
+                    contentType: false, // required when transferring FormData
+                    dataType: "json",
+                    success: done,
+                });
+            })
+            .fail(function (info) {
+                done({ success: false, info: info });
+            });
         e.preventDefault();
     });
     $("#add-photo-file").change(function () {
@@ -564,19 +682,26 @@ var init_admin_add_book = function () {
     }
     $("#admin-add-book").submit(function (e) {
         refresh_submit_button(false, 0, "#admin-add-book");
-        $.ajax({
-            url: url_add_book,
-            async: true,
-            method: "POST",
-            data: new FormData(this),
-            processData: false, // required when transferring FormData
-            contentType: false, // required when transferring FormData
-            dataType: "json",
-            success: function (result) {
-                append_info(result, "#admin-add-book");
-                refresh_submit_button(true, 0, "#admin-add-book");
-            },
-        });
+        var done = function (result) {
+            append_info(result, "#admin-add-book");
+            refresh_submit_button(true, 0, "#admin-add-book");
+        };
+        upload_form_files(this, function () {})
+            .done(function (form_data) {
+                $.ajax({
+                    url: url_add_book,
+                    async: true,
+                    method: "POST",
+                    data: form_data,
+                    processData: false, // required when transferring FormData
+                    contentType: false, // required when transferring FormData
+                    dataType: "json",
+                    success: done,
+                });
+            })
+            .fail(function (info) {
+                done({ success: false, info: info });
+            });
         e.preventDefault();
     });
 };
@@ -203,6 +203,12 @@ const m_size = [1366, 768];
  */
 const l_size = [2560, 1440];
 
+/**
+ * Widths in pixel of the resized photos in the srcset of the big photo.
+ * Default value is [320, 640, 960, 1280, 1920, 2560], according to `IMAGE_WIDTHS`.
+ */
+const photo_widths = [320, 640, 960, 1280, 1920, 2560];
+
 /**
  * True to disable right click on images. False to setup as default.
  * Default value is true, right click enabled.
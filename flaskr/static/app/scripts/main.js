@@ -455,15 +455,14 @@ function display_photo(photo, index) {
     } else {
         // don't change the source
         src_photo = $("#full-screen-photo").attr("src");
-        photo = new Image();
-        photo.src = src_photo;
     }
 
     // hide the navbar on small devices to enlarge the photo
     enable_header($(window).height() > small_devices_height);
 
-    var photo_width = photo.naturalWidth;
-    var photo_height = photo.naturalHeight;
+    // the natural size of an image with a srcset is the displayed size
+    var photo_width = gallery[new_photo ? index : last_loaded_photo].photo_l_w;
+    var photo_height = gallery[new_photo ? index : last_loaded_photo].photo_l_h;
     var ratio = photo_height / photo_width;
     var navbar_height = get_header_height();
     var box_height = $(window).height() - navbar_height - total_gap_photo * 2;
@@ -494,7 +493,9 @@ function display_photo(photo, index) {
     $("#full-screen-photo").css("max-width", photo_width);
 
     if (new_photo) {
-        $("#full-screen-photo").attr("src", src_photo);
+        $("#full-screen-photo")
+            .attr("srcset", $(photo).attr("srcset"))
+            .attr("src", src_photo);
         var info = "";
         if (gallery[index].title != "") {
             info = "<h1>" + gallery[index].title + "</h1>";
@@ -654,6 +655,37 @@ function optimal_photo(photo) {
     }
 }
 
+/**
+ * Returns the srcset of the large photo resized to `photo_widths`, the
+ * browser choosing the size and the format according to the screen.
+ * @see load_photo()
+ * @param photo {Struct} - Element of the gallery.
+ * @return {String} List of the resized photos and their width.
+ */
+function photo_srcset(photo) {
+    var widths = photo_widths.filter(function (width) {
+        return width < photo.photo_l_w;
+    });
+    if (photo.photo_l_w <= photo_widths[photo_widths.length - 1]) {
+        widths.push(photo.photo_l_w);
+    }
+    return widths
+        .map(function (width) {
+            return (
+                dir_photos +
+                photo.id +
+                "/" +
+                width +
+                "/" +
+                photo.photo_l +
+                " " +
+                width +
+                "w"
+            );
+        })
+        .join(", ");
+}
+
 /**
  * Load a photo in the cache. The Image object is only used for caching
  * and a new one will be used by load_photo() with the cached file.
@@ -673,6 +705,8 @@ function preload_photo(index) {
     $(photo).on("error", function () {
         console.log("ERROR: failed to cache image " + photo_name);
     });
+    photo.sizes = $("#full-screen-photo").attr("sizes");
+    photo.srcset = photo_srcset(gallery[index]);
     photo.src = src_photo;
 }
 
@@ -708,7 +742,9 @@ function load_photo(index) {
         load_photo(next_photo);
     });
 
-    // fetch the photo
+    // fetch the photo, same size and format as #full-screen-photo
+    photo.sizes = $("#full-screen-photo").attr("sizes");
+    photo.srcset = photo_srcset(gallery[index]);
     photo.src = src_photo;
 
     return false;
@@ -53,7 +53,8 @@ function number_with_commas(x) {
 }
 
 /**
- * Update statistics displayed in the track info.
+ * Update statistics displayed in the track info, replacing the statistics
+ * printed from the track index if any.
  */
 function track_info(source) {
     var stats = source.statistics;
@@ -79,7 +80,7 @@ function track_info(source) {
         ),
     ];
 
-    ul.append(lis);
+    ul.empty().append(lis);
     create_elevation_chart(source.points);
 }
 
@@ -168,22 +169,41 @@ function create_elevation_chart(profile) {
  * Returns the path of the WebTrack file.
  * @param book_id {Number} - The book ID.
  * @param track_name {String} - The track name (extension removed if existing).
+ * @param content_hash {String} - Optional content hash of the WebTrack,
+ * the file is then cached forever by the browser.
  * @return {String} Local path.
  */
-function get_webtrack_url(book_id, track_name) {
+function get_webtrack_url(book_id, track_name, content_hash) {
     track_name = track_name.replace(/\.[^/.]+$/, "");
+    if (content_hash) {
+        return `/map/webtracks/${book_id}/${track_name}.${content_hash}.webtrack`;
+    }
     return `/map/webtracks/${book_id}/${track_name}.webtrack`;
 }
 
+/**
+ * Returns the delay before retrying a request answered with
+ * a 202 status (export queued on the server side).
+ * @param xhr {XMLHttpRequest} - The completed request.
+ * @return {Number} Delay in milliseconds.
+ */
+function get_retry_delay(xhr) {
+    const seconds = parseInt(xhr.getResponseHeader("Retry-After"), 10);
+    return (isNaN(seconds) ? 5 : seconds) * 1000;
+}
+
 /**
  * Returns the path of the GeoJSON file.
  * @param book_id {Number} - The book ID.
  * @param track_name {String} - The track name (extension removed if existing).
+ * @param zoom {Number} - Optional lowest zoom of the map displaying the track,
+ * a lighter and simplified track is downloaded for low zooms.
  * @return {String} Local path.
  */
-function get_geojson_url(book_id, track_name) {
+function get_geojson_url(book_id, track_name, zoom) {
     track_name = track_name.replace(/\.[^/.]+$/, "");
-    return `/map/geojsons/${book_id}/${track_name}.geojson`;
+    const url = `/map/geojsons/${book_id}/${track_name}.geojson`;
+    return zoom === undefined ? url : `${url}?zoom=${zoom}`;
 }
 
 /**
@@ -548,11 +548,16 @@ function webtrack_to_source(data, source) {
  */
 function fetch_data() {
     var oReq = new XMLHttpRequest();
-    oReq.open("GET", get_webtrack_url(book_id, gpx_name), true);
+    oReq.open("GET", get_webtrack_url(book_id, gpx_name, WEBTRACK_HASH), true);
     // https://developer.mozilla.org/en-US/docs/Web/API/XMLHttpRequest/Sending_and_Receiving_Binary_Data
     oReq.responseType = "arraybuffer";
 
     oReq.onload = function (oEvent) {
+        if (oReq.status == 202) {
+            // the WebTrack is being generated on the server side
+            setTimeout(fetch_data, get_retry_delay(oReq));
+            return;
+        }
         if (oReq.status == 500) {
             // exception raised in map.py:profile_file()
             var response_str = new TextDecoder("utf-8").decode(
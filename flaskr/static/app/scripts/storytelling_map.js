@@ -65,6 +65,9 @@ class StorytellingMap {
         "fill-extrusion": ["fill-extrusion-opacity"],
     };
 
+    /** ID of the Mapbox source gathering all the tracks of the book. */
+    #book_tracks_source = "book-tracks";
+
     /** The non-interactive MapboxGL map object. */
     map;
 
@@ -445,18 +448,35 @@ class StorytellingMap {
     }
 
     /**
-     * Add a GeoJSON property to the map.
+     * Add the GeoJSON of all the tracks of the book to the map, so that
+     * the tracks are loaded in one request whatever the number of layers.
      * The WebTrack format is not the best because Mapbox GL JS
      * can only handle WGS84 coordinates, therefore, GeoJSON is
      * more suitable. The GeoJSON file is simplified and compressed
      * beforehand.
      */
-    add_track_from_config(record, data) {
-        this.map.addSource(record.layer.source, {
+    add_book_tracks_source() {
+        this.map.addSource(this.#book_tracks_source, {
             type: "geojson",
-            data: data ?? get_geojson_url(this.#book_id, record.data),
+            data: `/map/books/${this.#book_id}/tracks.geojson`,
+        });
+    }
+
+    /**
+     * Add a layer displaying the track record.data from the GeoJSON of the
+     * book, refer to add_book_tracks_source(). Each feature of this GeoJSON
+     * is named after the GPX filename without extension.
+     */
+    add_track_from_config(record) {
+        const track_name = record.data.replace(/\.[^/.]+$/, "");
+        const name_filter = ["==", ["get", "name"], track_name];
+        this.map.addLayer({
+            ...record.layer,
+            source: this.#book_tracks_source,
+            filter: record.layer.filter
+                ? ["all", record.layer.filter, name_filter]
+                : name_filter,
         });
-        this.map.addLayer(record.layer);
         var paintProps = this.#layer_types[record.layer.type];
         paintProps.forEach((prop) => {
             this.map.setPaintProperty(record.layer.id, prop, record.opacity);
@@ -470,6 +490,7 @@ class StorytellingMap {
         var scroller = scrollama();
 
         if (this.config.geojsons) {
+            this.add_book_tracks_source();
             this.config.geojsons.forEach((record) => {
                 this.add_track_from_config(record);
             });
@@ -0,0 +1,624 @@
+#
+# Copyright 2021 Clement
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Local index of the track statistics.
+
+The length, altitudes, elevation gain/loss, bounding box and amount of
+points of every GPX file are saved when its WebTrack is generated, so that
+the pages can show, sort and filter the tracks without opening any GPX or
+WebTrack file. The index is an SQLite database shared by the web processes
+and the export workers, like the export queue.
+
+A track is identified by the directory name of its book (``shelf.url``) and
+the GPX filename without extension. The SHA-1 of the GPX file is saved in
+order to skip the tracks already up to date.
+
+An SQLite R*Tree indexes the envelopes of the pieces of ENVELOPE_POINTS
+points of each track (with the coordinates), so that the tracks in an area
+and the nearest track are found without reading all the tracks. The R*Tree
+is updated with the statistics. The bounding box of a track is only saved
+with its statistics: any envelope matching an area is in the bounding box.
+"""
+
+import hashlib
+import math
+import os
+import sqlite3
+from array import array
+from contextlib import contextmanager
+from time import time
+
+from flask import current_app
+
+from .gpx_reader import StreamedGpx
+from .gpx_reader import load_gpx
+from .typing import *
+from .webtrack import WebTrack
+
+SCHEMA: Tuple[str, ...] = (
+    """CREATE TABLE IF NOT EXISTS tracks (
+    book_url TEXT NOT NULL,
+    gpx_name TEXT NOT NULL,
+    source_hash TEXT NOT NULL,
+    points INTEGER NOT NULL,
+    length REAL NOT NULL,
+    minimum_altitude REAL,
+    maximum_altitude REAL,
+    elevation_gain REAL,
+    elevation_loss REAL,
+    west REAL,
+    south REAL,
+    east REAL,
+    north REAL,
+    indexed_at REAL NOT NULL,
+    PRIMARY KEY (book_url, gpx_name)
+)""",
+    # the envelopes are enough to find the tracks, refer to TrackIndex.find():
+    "DROP TABLE IF EXISTS track_bounds",
+    # envelope of the pieces of tracks with the interleaved (lon, lat):
+    """CREATE VIRTUAL TABLE IF NOT EXISTS envelope_bounds USING rtree(
+    id, west, east, south, north, +track_id INTEGER, +coordinates BLOB
+)""",
+    # revision of the index incremented on every change, one row:
+    """CREATE TABLE IF NOT EXISTS revision (
+    id INTEGER PRIMARY KEY CHECK (id=0),
+    number INTEGER NOT NULL
+)""",
+)
+
+#: Amount of track points per envelope, the last point of an envelope is
+#: also the first point of the next one so that no line is missing.
+ENVELOPE_POINTS: int = 64
+
+#: Meters per degree of latitude, and of longitude on the equator.
+METERS_PER_DEGREE: float = 111195.0
+
+#: Envelope of a piece of track: west, south, east, north and the coordinates.
+Envelope = Tuple[float, float, float, float, array]
+
+#: Databases with the schema created by this process.
+_databases_with_schema: Set[str] = set()
+
+
+class TrackStats:
+    """ Statistics of a track. The elevation fields are None if unknown. """
+
+    #: Columns of the `tracks` table in the order of the attributes.
+    __slots__ = (
+        "book_url",
+        "gpx_name",
+        "source_hash",
+        "points",
+        "length",
+        "minimum_altitude",
+        "maximum_altitude",
+        "elevation_gain",
+        "elevation_loss",
+        "west",
+        "south",
+        "east",
+        "north",
+        "indexed_at",
+    )
+
+    book_url: str
+    gpx_name: str
+    source_hash: str
+    points: int
+    #: Length in meters.
+    length: float
+    #: Altitudes, elevation gain and loss in meters.
+    minimum_altitude: Optional[float]
+    maximum_altitude: Optional[float]
+    elevation_gain: Optional[float]
+    elevation_loss: Optional[float]
+    #: Bounding box in decimal degrees.
+    west: Optional[float]
+    south: Optional[float]
+    east: Optional[float]
+    north: Optional[float]
+    #: Timestamp of the last update.
+    indexed_at: float
+
+    def __init__(self, *values: Any):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def get_bounds(self) -> Optional[Tuple[float, float, float, float]]:
+        """ Returns (west, south, east, north) or None if no track point. """
+        if (
+            self.west is None
+            or self.south is None
+            or self.east is None
+            or self.north is None
+        ):
+            return None
+        return (self.west, self.south, self.east, self.north)
+
+
+def get_file_hash(path: str) -> str:
+    """ Returns the SHA-1 hex digest of the file `path`, read by chunks. """
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as stream:
+        for chunk in iter(lambda: stream.read(1024 * 1024), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def get_track_key(gpx_path: str) -> Tuple[str, str]:
+    """ Returns the book directory name and the GPX name of `gpx_path`. """
+    book_dir, gpx_filename = os.path.split(gpx_path)
+    return os.path.basename(book_dir), os.path.splitext(gpx_filename)[0]
+
+
+def read_track_stats(
+    gpx_path: str,
+    webtrack_path: str,
+    source_hash: Optional[str] = None,
+    gpx: Optional[StreamedGpx] = None,
+) -> TrackStats:
+    """
+    Returns the statistics of a track from the (cached) GPX arrays and the
+    "Track Information" of its up to date WebTrack.
+
+    Args:
+        gpx_path (str): Secured path to the GPX file.
+        webtrack_path (str): Secured path to the WebTrack generated from it.
+        source_hash (str): SHA-1 of the GPX file, computed if not set.
+        gpx (StreamedGpx): The GPX file already loaded, loaded if not set.
+    """
+    if source_hash is None:
+        source_hash = get_file_hash(gpx_path)
+    if gpx is None:
+        gpx = load_gpx(gpx_path)
+    track_info = WebTrack().get_track_information(webtrack_path)
+    return TrackStats(
+        *get_track_key(gpx_path),
+        source_hash,
+        gpx.get_points_no(),
+        track_info["length"],
+        track_info.get("minimumAltitude"),
+        track_info.get("maximumAltitude"),
+        track_info.get("elevationGain"),
+        track_info.get("elevationLoss"),
+        *(gpx.get_bounds() or (None,) * 4),
+        time(),
+    )
+
+
+def get_envelopes(gpx: StreamedGpx) -> List[Envelope]:
+    """ Returns the envelopes of the pieces of all the segments of `gpx`. """
+    envelopes = []
+    for segment in gpx.segments():
+        for begin in range(0, max(len(segment) - 1, 1), ENVELOPE_POINTS):
+            end = min(begin + ENVELOPE_POINTS, len(segment) - 1) + 1
+            longitudes = segment.longitudes[begin:end]
+            latitudes = segment.latitudes[begin:end]
+            coordinates = array("d")
+            for longitude, latitude in zip(longitudes, latitudes):
+                coordinates.append(longitude)
+                coordinates.append(latitude)
+            envelopes.append(
+                (
+                    min(longitudes),
+                    min(latitudes),
+                    max(longitudes),
+                    max(latitudes),
+                    coordinates,
+                )
+            )
+    return envelopes
+
+
+def distance_to_line(longitude: float, latitude: float, coordinates: array) -> float:
+    """
+    Returns the distance in meters between a point and a line with an
+    equirectangular approximation, accurate enough to compare tracks.
+
+    Args:
+        longitude (float): Longitude of the point in decimal degrees.
+        latitude (float): Latitude of the point in decimal degrees.
+        coordinates (array): Interleaved longitudes and latitudes of the line.
+    """
+    x_scale = math.cos(math.radians(latitude)) * METERS_PER_DEGREE
+    points = [
+        (
+            (coordinates[i] - longitude) * x_scale,
+            (coordinates[i + 1] - latitude) * METERS_PER_DEGREE,
+        )
+        for i in range(0, len(coordinates), 2)
+    ]
+    best = math.hypot(*points[0])
+    for (x_1, y_1), (x_2, y_2) in zip(points, points[1:]):
+        d_x = x_2 - x_1
+        d_y = y_2 - y_1
+        length_2 = d_x * d_x + d_y * d_y
+        ratio = 0.0
+        if length_2:
+            ratio = min(max(-(x_1 * d_x + y_1 * d_y) / length_2, 0.0), 1.0)
+        best = min(best, math.hypot(x_1 + ratio * d_x, y_1 + ratio * d_y))
+    return best
+
+
+def line_intersects_box(
+    coordinates: array, bounds: Tuple[float, float, float, float]
+) -> bool:
+    """
+    Returns true if a point of a line is in an area or if a line segment
+    crosses it (Liang-Barsky clipping).
+
+    Args:
+        coordinates (array): Interleaved longitudes and latitudes of the line.
+        bounds (Tuple[float, float, float, float]): West, south, east and
+            north in decimal degrees.
+    """
+    west, south, east, north = bounds
+    points = list(zip(coordinates[::2], coordinates[1::2]))
+    if any(west <= x <= east and south <= y <= north for x, y in points):
+        return True
+    for (x_1, y_1), (x_2, y_2) in zip(points, points[1:]):
+        t_min, t_max = 0.0, 1.0
+        for direction, gap in (
+            (x_1 - x_2, x_1 - west),
+            (x_2 - x_1, east - x_1),
+            (y_1 - y_2, y_1 - south),
+            (y_2 - y_1, north - y_1),
+        ):
+            if direction == 0:
+                if gap < 0:
+                    break  # parallel to this side and outside
+            elif direction < 0:
+                t_min = max(t_min, gap / direction)
+            else:
+                t_max = min(t_max, gap / direction)
+            if t_min > t_max:
+                break
+        else:
+            return True
+    return False
+
+
+class TrackIndex:
+    """ SQLite-backed index of the track statistics. """
+
+    def __init__(self, database_path: str):
+        """
+        Args:
+            database_path (str): Path to the SQLite file, created if not existing.
+        """
+        self.database_path = database_path
+        if database_path not in _databases_with_schema or not os.path.isfile(
+            database_path
+        ):  # removed in the meantime
+            with self._transaction() as connection:
+                for statement in SCHEMA:
+                    connection.execute(statement)
+            _databases_with_schema.add(database_path)
+
+    def _connect(self) -> sqlite3.Connection:
+        """ Returns a new connection waiting for locks instead of failing. """
+        return sqlite3.connect(self.database_path, timeout=30)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """ Open a connection, commit (or rollback on error) and close it. """
+        connection = self._connect()
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def update(self, stats: TrackStats, envelopes: Iterable[Envelope] = ()) -> None:
+        """
+        Insert or replace the statistics of a track, and its envelopes in
+        the spatial index.
+        """
+        with self._transaction() as connection:
+            self._remove(connection, stats.book_url, stats.gpx_name)
+            track_id = connection.execute(
+                "INSERT INTO tracks VALUES ({})".format(
+                    ", ".join("?" * len(TrackStats.__slots__))
+                ),
+                [getattr(stats, name) for name in TrackStats.__slots__],
+            ).lastrowid
+            connection.executemany(
+                """INSERT INTO envelope_bounds
+                (west, east, south, north, track_id, coordinates)
+                VALUES (?, ?, ?, ?, ?, ?)""",
+                [
+                    (west, east, south, north, track_id, coordinates.tobytes())
+                    for west, south, east, north, coordinates in envelopes
+                ],
+            )
+
+    @staticmethod
+    def _remove(
+        connection: sqlite3.Connection, book_url: str, gpx_name: Optional[str]
+    ) -> int:
+        """ Refer to remove(), within a transaction. """
+        connection.execute(
+            """INSERT INTO revision VALUES (0, 1)
+            ON CONFLICT(id) DO UPDATE SET number=number+1"""
+        )
+        condition = "book_url=?" if gpx_name is None else "book_url=? AND gpx_name=?"
+        args = (book_url,) if gpx_name is None else (book_url, gpx_name)
+        connection.execute(
+            """DELETE FROM envelope_bounds
+            WHERE track_id IN (SELECT rowid FROM tracks WHERE {})""".format(
+                condition
+            ),
+            args,
+        )
+        return connection.execute(
+            "DELETE FROM tracks WHERE " + condition, args
+        ).rowcount
+
+    def index(self, gpx_path: str, webtrack_path: str) -> bool:
+        """
+        Save the statistics of a track unless already up to date.
+
+        Args:
+            gpx_path (str): Secured path to the GPX file.
+            webtrack_path (str): Secured path to the up to date WebTrack.
+
+        Returns:
+            bool: False if the track was already indexed.
+        """
+        source_hash = get_file_hash(gpx_path)
+        stats = self.get(*get_track_key(gpx_path))
+        if stats is not None and stats.source_hash == source_hash:
+            return False
+        gpx = load_gpx(gpx_path)
+        self.update(
+            read_track_stats(gpx_path, webtrack_path, source_hash, gpx),
+            get_envelopes(gpx),
+        )
+        return True
+
+    def get(self, book_url: str, gpx_name: str) -> Optional[TrackStats]:
+        """ Returns the statistics of a track or None if not indexed. """
+        with self._transaction() as connection:
+            row = connection.execute(
+                "SELECT * FROM tracks WHERE book_url=? AND gpx_name=?",
+                (book_url, gpx_name),
+            ).fetchone()
+        return None if row is None else TrackStats(*row)
+
+    def get_book_tracks(self, book_url: str) -> List[TrackStats]:
+        """ Returns the statistics of the tracks of a book ordered by name. """
+        with self._transaction() as connection:
+            rows = connection.execute(
+                "SELECT * FROM tracks WHERE book_url=? ORDER BY gpx_name",
+                (book_url,),
+            ).fetchall()
+        return [TrackStats(*row) for row in rows]
+
+    def remove(self, book_url: str, gpx_name: Optional[str] = None) -> int:
+        """
+        Remove a track, or all the tracks of a book if `gpx_name` is not set.
+
+        Returns:
+            int: The amount of tracks removed.
+        """
+        with self._transaction() as connection:
+            return self._remove(connection, book_url, gpx_name)
+
+    def remove_missing(self, track_keys: Collection[Tuple[str, str]]) -> int:
+        """
+        Remove the tracks which are not in `track_keys` anymore, refer to
+        get_track_key(), e.g. after deleting a GPX file from the shelf.
+
+        Returns:
+            int: The amount of tracks removed.
+        """
+        with self._transaction() as connection:
+            indexed = connection.execute(
+                "SELECT book_url, gpx_name FROM tracks"
+            ).fetchall()
+            return sum(
+                self._remove(connection, book_url, gpx_name)
+                for book_url, gpx_name in indexed
+                if (book_url, gpx_name) not in track_keys
+            )
+
+    def find(
+        self,
+        bounds: Tuple[float, float, float, float],
+        book_urls: Optional[Collection[str]] = None,
+    ) -> List[TrackStats]:
+        """
+        Returns the tracks with at least one point in the area (or one line
+        crossing it), sorted by book and name. The envelopes of the pieces
+        are first matched and then their lines, refer to
+        line_intersects_box().
+
+        Args:
+            bounds (Tuple[float, float, float, float]): West, south, east and
+                north in decimal degrees.
+            book_urls (Collection[str]): Books allowed, all books if not set.
+        """
+        west, south, east, north = bounds
+        query = """SELECT e.track_id, e.coordinates FROM envelope_bounds e
+            JOIN tracks t ON t.rowid=e.track_id
+            WHERE e.west<=:east AND e.east>=:west
+            AND e.south<=:north AND e.north>=:south"""
+        args: Dict[str, Any] = {
+            "west": west,
+            "south": south,
+            "east": east,
+            "north": north,
+        }
+        query += self._book_condition(book_urls, args)
+        with self._transaction() as connection:
+            track_ids = set()
+            for track_id, coordinates in connection.execute(query, args):
+                if track_id not in track_ids and line_intersects_box(
+                    array("d", coordinates), bounds
+                ):
+                    track_ids.add(track_id)
+            ids = sorted(track_ids)
+            rows = []
+            for i in range(0, len(ids), 500):  # below the SQLite variable limit
+                chunk = ids[i : i + 500]
+                rows += connection.execute(
+                    "SELECT * FROM tracks WHERE rowid IN ({})".format(
+                        ", ".join("?" * len(chunk))
+                    ),
+                    chunk,
+                ).fetchall()
+        tracks = [TrackStats(*row) for row in rows]
+        return sorted(tracks, key=lambda track: (track.book_url, track.gpx_name))
+
+    def get_pieces(
+        self,
+        bounds: Tuple[float, float, float, float],
+        book_urls: Optional[Collection[str]] = None,
+    ) -> List[Tuple[str, str, float, array]]:
+        """
+        Returns the pieces of tracks (refer to get_envelopes()) in the area,
+        sorted by book, name and position in the track.
+
+        Args:
+            bounds (Tuple[float, float, float, float]): West, south, east and
+                north in decimal degrees.
+            book_urls (Collection[str]): Books allowed, all books if not set.
+
+        Returns:
+            The book directory name, GPX name and length of the track, and
+            the interleaved longitudes and latitudes of the piece.
+        """
+        west, south, east, north = bounds
+        query = """SELECT t.book_url, t.gpx_name, t.length, e.coordinates
+            FROM envelope_bounds e
+            JOIN tracks t ON t.rowid=e.track_id
+            WHERE e.west<=:east AND e.east>=:west
+            AND e.south<=:north AND e.north>=:south"""
+        args: Dict[str, Any] = {
+            "west": west,
+            "south": south,
+            "east": east,
+            "north": north,
+        }
+        query += self._book_condition(book_urls, args)
+        with self._transaction() as connection:
+            rows = connection.execute(
+                query + " ORDER BY t.book_url, t.gpx_name, e.id", args
+            ).fetchall()
+        return [
+            (book_url, gpx_name, length, array("d", coordinates))
+            for book_url, gpx_name, length, coordinates in rows
+        ]
+
+    def get_revision(self) -> int:
+        """
+        Returns a number incremented whenever a track is indexed or removed,
+        handy to invalidate the data derived from the index.
+        """
+        with self._transaction() as connection:
+            row = connection.execute("SELECT number FROM revision").fetchone()
+        return 0 if row is None else row[0]
+
+    def nearest(
+        self,
+        longitude: float,
+        latitude: float,
+        book_urls: Optional[Collection[str]] = None,
+    ) -> Optional[Tuple[TrackStats, float]]:
+        """
+        Returns the track nearest to a point and the distance in meters, or
+        None if there is no track. The search area is doubled until a track
+        is found, and then enlarged to the distance found in order to check
+        the other tracks possibly closer.
+
+        Args:
+            longitude (float): Longitude in decimal degrees.
+            latitude (float): Latitude in decimal degrees.
+            book_urls (Collection[str]): Books allowed, all books if not set.
+        """
+        query = """SELECT e.track_id, e.coordinates FROM envelope_bounds e
+            JOIN tracks t ON t.rowid=e.track_id
+            WHERE e.west<=:east AND e.east>=:west
+            AND e.south<=:north AND e.north>=:south"""
+        args: Dict[str, Any] = {}
+        query += self._book_condition(book_urls, args)
+        x_scale = max(math.cos(math.radians(latitude)), 1e-6)
+        radius = 0.01  # degrees of latitude
+        best: Optional[Tuple[float, int]] = None
+        with self._transaction() as connection:
+            while True:
+                args.update(
+                    west=longitude - radius / x_scale,
+                    east=longitude + radius / x_scale,
+                    south=latitude - radius,
+                    north=latitude + radius,
+                )
+                for track_id, coordinates in connection.execute(query, args):
+                    distance = distance_to_line(
+                        longitude, latitude, array("d", coordinates)
+                    )
+                    if best is None or distance < best[0]:
+                        best = (distance, track_id)
+                if best is not None and best[0] <= radius * METERS_PER_DEGREE:
+                    break  # any closer piece would be in the search area
+                if radius >= 360:
+                    break
+                if best is None:
+                    radius *= 2
+                else:
+                    radius = best[0] / METERS_PER_DEGREE
+            if best is None:
+                return None
+            row = connection.execute(
+                "SELECT * FROM tracks WHERE rowid=?", (best[1],)
+            ).fetchone()
+        return TrackStats(*row), best[0]
+
+    @staticmethod
+    def _book_condition(
+        book_urls: Optional[Collection[str]], args: Dict[str, Any]
+    ) -> str:
+        """
+        Returns the SQL condition on the books of the tracks `t` and add the
+        named parameters to `args`.
+        """
+        if book_urls is None:
+            return ""
+        names = []
+        for i, book_url in enumerate(book_urls):
+            args["book_{}".format(i)] = book_url
+            names.append(":book_{}".format(i))
+        return " AND t.book_url IN ({})".format(", ".join(names))
+
+
+def get_track_index() -> TrackIndex:
+    """ Returns the index of the track statistics of the app. """
+    return TrackIndex(current_app.config["TRACK_INDEX_DATABASE"])
@@ -4,12 +4,20 @@ Common type definitions.
 
 # pylint: disable=unused-import
 
+from typing import IO
 from typing import Any
+from typing import BinaryIO
+from typing import Callable
+from typing import Collection
 from typing import Dict
+from typing import Iterable
+from typing import Iterator
 from typing import List
+from typing import Literal
 from typing import Match
 from typing import Optional
 from typing import Sequence
+from typing import Set
 from typing import Tuple
 from typing import Union
 
@@ -0,0 +1,203 @@
+#
+# Copyright 2021 Clement
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Resumable uploads by chunks.
+
+A large file is uploaded into an upload session, a directory of the upload
+folder named after a random identifier. The client first creates the session
+with the file name and size, then sends the content by chunks at given
+offsets. After a dropped connection, the client reads the current offset and
+sends the missing chunks only. The chunks are streamed to the disk so that a
+request never holds more than a read buffer in memory. Once complete, the
+identifier is given to the form processing the file instead of the file itself.
+
+The sessions not updated for a while are removed when a new one is created.
+"""
+
+from .utils import *
+
+#: Number of hexadecimal characters of an upload identifier.
+UPLOAD_ID_LENGTH: int = 32
+
+#: Name of the file describing the upload in the session directory.
+UPLOAD_INFO_NAME: str = "info.json"
+
+#: Name of the uploaded content in the session directory.
+UPLOAD_DATA_NAME: str = "data"
+
+
+def get_upload_dir(upload_folder: str, upload_id: str) -> str:
+    """
+    Returns the session directory of `upload_id`.
+
+    Raises:
+        ValueError: If the identifier is malformed.
+        FileNotFoundError: If the session does not exist or expired.
+    """
+    if not re.fullmatch("[0-9a-f]{{{}}}".format(UPLOAD_ID_LENGTH), upload_id):
+        raise ValueError("Invalid upload identifier")
+    upload_dir = os.path.join(upload_folder, upload_id)
+    if not os.path.isdir(upload_dir):
+        raise FileNotFoundError("Upload not found: " + upload_id)
+    return upload_dir
+
+
+def read_upload_info(upload_dir: str) -> Dict[str, Any]:
+    """ Returns the file name and the declared size of the upload. """
+    with open(os.path.join(upload_dir, UPLOAD_INFO_NAME)) as info_file:
+        return json.load(info_file)
+
+
+def remove_expired_uploads(upload_folder: str, lifetime: int) -> None:
+    """ Remove the sessions not updated for `lifetime` seconds. """
+    if not os.path.isdir(upload_folder):
+        return
+    expiry = time() - lifetime
+    for entry in os.scandir(upload_folder):
+        data_path = os.path.join(entry.path, UPLOAD_DATA_NAME)
+        try:
+            if entry.is_dir() and os.path.getmtime(data_path) < expiry:
+                shutil.rmtree(entry.path)
+        except FileNotFoundError:  # removed by an other process
+            pass
+
+
+def create_upload(upload_folder: str, filename: str, size: int, lifetime: int) -> str:
+    """
+    Create a new upload session of the file `filename` of `size` bytes and
+    remove the expired ones.
+
+    Args:
+        upload_folder (str): Directory of all the sessions.
+        filename (str): Name of the uploaded file, kept for the extension checks.
+        size (int): Size in bytes of the whole file.
+        lifetime (int): Seconds before an idle session expires.
+
+    Returns:
+        str: Identifier of the upload.
+
+    Raises:
+        ValueError: If the size is negative.
+    """
+    if size < 0:
+        raise ValueError("Invalid upload size")
+    remove_expired_uploads(upload_folder, lifetime)
+    os.makedirs(upload_folder, exist_ok=True)
+    upload_id = secrets.token_hex(UPLOAD_ID_LENGTH // 2)
+    upload_dir = os.path.join(upload_folder, upload_id)
+    os.mkdir(upload_dir)
+    with open(os.path.join(upload_dir, UPLOAD_INFO_NAME), "w") as info_file:
+        json.dump({"filename": filename, "size": size}, info_file)
+    open(os.path.join(upload_dir, UPLOAD_DATA_NAME), "wb").close()
+    return upload_id
+
+
+def get_upload_offset(upload_folder: str, upload_id: str) -> Tuple[int, int]:
+    """
+    Returns the number of bytes already received and the size of the file.
+    """
+    upload_dir = get_upload_dir(upload_folder, upload_id)
+    size = read_upload_info(upload_dir)["size"]
+    return os.path.getsize(os.path.join(upload_dir, UPLOAD_DATA_NAME)), size
+
+
+def append_upload_chunk(
+    upload_folder: str, upload_id: str, offset: int, stream: IO[bytes]
+) -> int:
+    """
+    Append the content of `stream` to the upload, read and written by chunks.
+    The bytes received before a dropped connection are kept, so that the
+    client can resume from the new offset. Concurrent requests of a same
+    upload are serialised.
+
+    Args:
+        upload_folder (str): Directory of all the sessions.
+        upload_id (str): Identifier of the upload.
+        offset (int): Position of the chunk in the file, must be the number
+            of bytes already received.
+        stream: Content of the chunk.
+
+    Returns:
+        int: The new offset.
+
+    Raises:
+        ValueError: If the offset is not the current one or if the chunk goes
+            beyond the declared size. The upload is left unchanged.
+    """
+    upload_dir = get_upload_dir(upload_folder, upload_id)
+    size = read_upload_info(upload_dir)["size"]
+    data_path = os.path.join(upload_dir, UPLOAD_DATA_NAME)
+    with file_lock(os.path.join(upload_dir, ".lock")):
+        if os.path.getsize(data_path) != offset:
+            raise ValueError("Wrong offset")
+        with open(data_path, "ab") as data_file:
+            for chunk in iter(lambda: stream.read(1024 * 1024), b""):
+                if data_file.tell() + len(chunk) > size:
+                    data_file.truncate(offset)
+                    raise ValueError("Chunk beyond the file size")
+                data_file.write(chunk)
+            return data_file.tell()
+
+
+def get_upload_path(upload_folder: str, upload_id: str) -> str:
+    """
+    Returns the path to the content of a complete upload, so that it can be
+    processed in place and moved instead of copied.
+
+    Raises:
+        ValueError: If the identifier is malformed or the upload is not complete.
+        FileNotFoundError: If the session does not exist or expired.
+    """
+    offset, size = get_upload_offset(upload_folder, upload_id)
+    if offset != size:
+        raise ValueError("Upload not complete")
+    return os.path.join(get_upload_dir(upload_folder, upload_id), UPLOAD_DATA_NAME)
+
+
+def open_upload(upload_folder: str, upload_id: str) -> FileStorage:
+    """
+    Open a complete upload as if the file was sent in a multipart form. The
+    caller closes the returned file.
+
+    Raises:
+        ValueError: If the identifier is malformed or the upload is not complete.
+        FileNotFoundError: If the session does not exist or expired.
+    """
+    upload_path = get_upload_path(upload_folder, upload_id)
+    return FileStorage(
+        stream=open(upload_path, "rb"),
+        filename=read_upload_info(os.path.dirname(upload_path))["filename"],
+    )
+
+
+def remove_upload(upload_folder: str, upload_id: str) -> None:
+    """ Remove the session once its file is processed. """
+    shutil.rmtree(get_upload_dir(upload_folder, upload_id))
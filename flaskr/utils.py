@@ -34,6 +34,24 @@ Common utilities.
 
 from .dependencies import *
 
+#: Amount of hexadecimal characters of the content hashes in the URLs.
+CONTENT_HASH_LENGTH: int = 16
+
+#: Cache-Control header of the files which never change at a given URL, such
+#: as the exports requested with their content hash.
+IMMUTABLE_CACHE_CONTROL: str = "public, max-age=31536000, immutable"
+
+#: Cache-Control header of the immutable files restricted to some users, not
+#: stored by the shared caches.
+PRIVATE_IMMUTABLE_CACHE_CONTROL: str = "private, max-age=31536000, immutable"
+
+#: Lanczos resampling filter of Pillow, moved to Image.Resampling in Pillow 9.1.
+LANCZOS_FILTER = (
+    Image.Resampling.LANCZOS
+    if hasattr(Image, "Resampling")
+    else Image.LANCZOS  # type: ignore[attr-defined]
+)
+
 
 class JSONSecureCookie(SecureCookie):
     """ https://werkzeug.palletsprojects.com/en/0.15.x/contrib/securecookie/#security """
@@ -41,6 +59,15 @@ class JSONSecureCookie(SecureCookie):
     serialization_method = json
 
 
+class ContentHashConverter(BaseConverter):
+    """
+    URL converter of the content hashes, refer to BookManifest.get_content_hash().
+    The strict pattern avoids any conflict with the dots of the filenames.
+    """
+
+    regex = "[0-9a-f]{" + str(CONTENT_HASH_LENGTH) + "}"
+
+
 def get_static_package_config() -> Dict:
     """ Read the package.json file in the static directory and returns a dictionary. """
     with open(absolute_path("static/package.json")) as static_package:
@@ -363,37 +390,111 @@ def params_urlencode(params: Dict[str, Any]) -> str:
     return "&".join([k + "=" + v for k, v in params.items()])
 
 
-def create_and_save(
+def fit_size(size: Tuple[int, int], max_size: Tuple[int, int]) -> Tuple[int, int]:
+    """
+    Get the largest size with the aspect ratio of `size` which fits in
+    `max_size`. Pictures are never enlarged.
+
+    Args:
+        size: (width, height) in pixel.
+        max_size: (max_width, max_height) in pixel.
+
+    Returns:
+        (width, height) in pixel.
+    """
+    scale = min(1.0, max_size[0] / size[0], max_size[1] / size[1])
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+def create_photo_derivatives(
     raw_path: str,
-    max_size: Tuple[int, int],
-    filename_size: int,
+    max_sizes: Sequence[Tuple[int, int]],
+    filename_sizes: Sequence[int],
+    thumbnail_size: int,
+    thumbnail_filename_size: int,
     image_quality: int,
     upload_path: str,
-) -> str:
+) -> Tuple[Tuple[int, int], List[Tuple[str, Tuple[int, int]]], str, Tuple]:
     """
-    Create a smaller picture of `raw_path` which fit in `max_size`. The file
-    name is random with `filename_size` character, extension excluded.
+    Create the smaller pictures of `raw_path` fitting in `max_sizes` and a
+    square thumbnail of `thumbnail_size` pixels. The RAW picture is read once
+    and decoded once, at the lowest JPEG scale still large enough for all the
+    outputs. Each picture is then downscaled from the smallest one already
+    computed, and encoded in a thread while the next one is computed. The file
+    names are random with `filename_sizes` and `thumbnail_filename_size`
+    characters, extension excluded.
 
     Args:
         raw_path (str): Path to the RAW picture.
-        max_size: (max_width, max_height) in pixel.
-        filename_size (int): File name size without the extension '.jpg'.
+        max_sizes: List of (max_width, max_height) in pixel.
+        filename_sizes: File name size without the extension '.jpg' of each
+            picture fitting in `max_sizes`.
+        thumbnail_size (int): Width and height of the thumbnail in pixel.
+        thumbnail_filename_size (int): File name size of the thumbnail without
+            the extension '.jpg'.
         image_quality (int): Image quality in percent.
-        upload_path (str): Directory where the new picture would be saved.
+        upload_path (str): Directory where the new pictures would be saved.
 
     Returns:
-        str: File path to the newly created and saved picture.
-    """
-    image = Image.open(raw_path)
-    image = image.convert("RGB")
-    image.thumbnail(
-        (min(max_size[0], image.size[0]), min(max_size[1], image.size[1])),
-        Image.ANTIALIAS,
-    )
-    photo_filename = random_filename(filename_size)
-    image.save(os.path.join(upload_path, photo_filename), "JPEG", quality=image_quality)
-    image.close()
-    return photo_filename
+        (RAW (width, height), list of (file name, (width, height)) in the
+        order of `max_sizes`, thumbnail file name, EXIF data as returned by
+        :func:`get_image_exif`)
+    """
+    with open(raw_path, "rb") as raw_file:
+        raw_image: ImageFile.ImageFile = Image.open(raw_file)
+        raw_size = raw_image.size
+        target_sizes = [fit_size(raw_size, max_size) for max_size in max_sizes]
+        draft_size = max(target_sizes, key=lambda size: size[0] * size[1])
+        if min(draft_size) < thumbnail_size:  # the thumbnail is cropped
+            scale = min(1.0, thumbnail_size / min(raw_size))
+            draft_size = (int(raw_size[0] * scale) + 1, int(raw_size[1] * scale) + 1)
+        raw_image.draft("RGB", draft_size)  # no-op with other formats than JPEG
+        image = raw_image.convert("RGB")
+        raw_file.seek(0)
+        image_exif = get_file_exif(raw_file)
+    photos: List[Tuple[str, Tuple[int, int]]] = [("", (0, 0))] * len(max_sizes)
+    with ThreadPoolExecutor(max_workers=len(max_sizes) + 1) as executor:
+        futures = []
+        source = thumbnail_source = image
+        for index in sorted(
+            range(len(max_sizes)),
+            key=lambda index: -target_sizes[index][0] * target_sizes[index][1],
+        ):
+            photo = source.resize(target_sizes[index], LANCZOS_FILTER, reducing_gap=3.0)
+            photo_filename = random_filename(filename_sizes[index])
+            photos[index] = (photo_filename, photo.size)
+            futures.append(
+                executor.submit(
+                    photo.save,
+                    os.path.join(upload_path, photo_filename),
+                    "JPEG",
+                    quality=image_quality,
+                )
+            )
+            source = photo
+            if min(photo.size) >= thumbnail_size:
+                thumbnail_source = photo
+        side = min(thumbnail_source.size)
+        offset_x = (thumbnail_source.size[0] - side) / 2.0
+        offset_y = (thumbnail_source.size[1] - side) / 2.0
+        thumbnail = thumbnail_source.resize(
+            (thumbnail_size, thumbnail_size),
+            LANCZOS_FILTER,
+            box=(offset_x, offset_y, offset_x + side, offset_y + side),
+            reducing_gap=3.0,
+        )
+        thumbnail_filename = random_filename(thumbnail_filename_size)
+        futures.append(
+            executor.submit(
+                thumbnail.save,
+                os.path.join(upload_path, thumbnail_filename),
+                "JPEG",
+                quality=image_quality,
+            )
+        )
+        for future in futures:
+            future.result()  # raise the encoding errors
+    return raw_size, photos, thumbnail_filename, image_exif
 
 
 def match_absolute_path(path: str) -> bool:
@@ -468,36 +569,49 @@ def get_image_exif(path: str) -> Tuple:
         float or None if not available, ISO as integer or None if not available)
     """
     with open(path, "rb") as raw_file:
-        tags = exifread.process_file(raw_file)
-        date_taken: Union[datetime.datetime, None]
-        focal_length_35mm: Union[int, None]
-        exposure_time_s: Union[str, None]
-        f_number: Union[float, None]
-        iso: Union[int, None]
-
-        if "EXIF DateTimeOriginal" in tags:
-            date_taken = datetime.datetime.strptime(
-                str(tags["EXIF DateTimeOriginal"]), "%Y:%m:%d %H:%M:%S"
-            )
-        else:
-            date_taken = None
-        if "EXIF FocalLengthIn35mmFilm" in tags:
-            focal_length_35mm = int(float(str(tags["EXIF FocalLengthIn35mmFilm"])))
-        else:
-            focal_length_35mm = None
-        if "EXIF ExposureTime" in tags:
-            exposure_time_s = str(tags["EXIF ExposureTime"])
-        else:
-            exposure_time_s = None
-        if "EXIF FNumber" in tags:
-            f_number = float(Fraction(str(tags["EXIF FNumber"])))
-        else:
-            f_number = None
-        if "EXIF ISOSpeedRatings" in tags:
-            iso = int(str(tags["EXIF ISOSpeedRatings"]))
-        else:
-            iso = None
-        return date_taken, focal_length_35mm, exposure_time_s, f_number, iso
+        return get_file_exif(raw_file)
+
+
+def get_file_exif(raw_file: BinaryIO) -> Tuple:
+    """
+    Get some EXIF data of an opened image with the exifread module.
+
+    Args:
+        raw_file: Image (tiff or jpg) opened in binary mode.
+
+    Returns:
+        See :func:`get_image_exif`.
+    """
+    tags = exifread.process_file(raw_file)
+    date_taken: Union[datetime.datetime, None]
+    focal_length_35mm: Union[int, None]
+    exposure_time_s: Union[str, None]
+    f_number: Union[float, None]
+    iso: Union[int, None]
+
+    if "EXIF DateTimeOriginal" in tags:
+        date_taken = datetime.datetime.strptime(
+            str(tags["EXIF DateTimeOriginal"]), "%Y:%m:%d %H:%M:%S"
+        )
+    else:
+        date_taken = None
+    if "EXIF FocalLengthIn35mmFilm" in tags:
+        focal_length_35mm = int(float(str(tags["EXIF FocalLengthIn35mmFilm"])))
+    else:
+        focal_length_35mm = None
+    if "EXIF ExposureTime" in tags:
+        exposure_time_s = str(tags["EXIF ExposureTime"])
+    else:
+        exposure_time_s = None
+    if "EXIF FNumber" in tags:
+        f_number = float(Fraction(str(tags["EXIF FNumber"])))
+    else:
+        f_number = None
+    if "EXIF ISOSpeedRatings" in tags:
+        iso = int(str(tags["EXIF ISOSpeedRatings"]))
+    else:
+        iso = None
+    return date_taken, focal_length_35mm, exposure_time_s, f_number, iso
 
 
 def friendly_datetime(ugly_datetime: str) -> str:
@@ -610,6 +724,152 @@ def same_site(view: Any) -> Any:
     return wrapped_view
 
 
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """
+    Exclusive lock shared by all processes, blocking until available.
+    The lock file `path` is created if not existing and is never removed
+    because removing it would let two processes lock two different files.
+
+    Args:
+        path (str): Path to the lock file.
+    """
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def replace_file_atomically(path: str, write: Callable[[str], None]) -> None:
+    """
+    Call `write` with a temporary path next to `path` and then rename the
+    temporary file into `path`, so that `path` is never partially written.
+    The temporary file is unique per thread, ends with ``.tmp``, and is
+    removed on error.
+
+    Args:
+        path (str): Path to the overwritten file.
+        write (Callable): Function writing the file given as argument.
+    """
+    tmp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def save_hashed_stream(stream: IO[bytes], directory: str) -> Tuple[str, str]:
+    """
+    Copy `stream` by chunks into a new temporary file of `directory` while
+    its SHA-1 is computed, so that large uploads are never held in memory
+    nor written twice. The temporary file is removed on error, otherwise it
+    is up to the caller to rename or remove it.
+
+    Args:
+        stream: Readable binary stream, e.g. the one of an uploaded file.
+        directory (str): Directory of the temporary file, on the file system
+            of its final destination to allow an atomic rename.
+
+    Returns:
+        (path to the temporary file, SHA-1 hex digest of the content)
+    """
+    sha1 = hashlib.sha1()
+    tmp_fd, tmp_path = tempfile.mkstemp(suffix=".tmp", prefix=".upload-", dir=directory)
+    try:
+        with os.fdopen(tmp_fd, "wb") as tmp_file:
+            for chunk in iter(lambda: stream.read(1024 * 1024), b""):
+                sha1.update(chunk)
+                tmp_file.write(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, sha1.hexdigest()
+
+
+def send_offloaded_file(
+    directory: str,
+    filename: str,
+    mimetype: Optional[str] = None,
+    as_attachment: bool = False,
+) -> Response:
+    """
+    Send the file `filename` of `directory` like send_from_directory(), or
+    let the web server send it according to ``FILE_OFFLOAD``, so that the
+    worker is released as soon as the access is checked:
+
+    * ``"x-accel-redirect"``: nginx sends the file from the internal location
+      of its directory in ``FILE_OFFLOAD_LOCATIONS``. The files out of these
+      directories are sent by Flask.
+    * ``"x-sendfile"``: Apache (mod_xsendfile) or lighttpd send the file
+      from its absolute path.
+
+    Args:
+        directory (str): Directory of the file.
+        filename (str): Untrusted path to the file relative to `directory`.
+        mimetype (str): MIME type, guessed from the extension by default.
+        as_attachment (bool): True to download the file instead of opening it.
+
+    Raises:
+        404: if the file does not exist or is out of `directory`.
+    """
+    offload = current_app.config["FILE_OFFLOAD"]
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    path = os.path.realpath(path)
+    if offload == "x-sendfile":
+        header = ("X-Sendfile", path)
+    elif offload == "x-accel-redirect":
+        locations = [
+            (real_directory, uri)
+            for real_directory, uri in (
+                (os.path.realpath(location_dir), uri)
+                for location_dir, uri in current_app.config[
+                    "FILE_OFFLOAD_LOCATIONS"
+                ].items()
+            )
+            if path.startswith(os.path.join(real_directory, ""))
+        ]
+        if locations:  # the deepest directory if nested
+            real_directory, uri = max(locations, key=lambda item: len(item[0]))
+            location = uri.rstrip("/") + "/" + os.path.relpath(path, real_directory)
+            header = ("X-Accel-Redirect", quote(location))
+        else:
+            offload = None
+    if not offload:
+        return send_from_directory(
+            directory, filename, mimetype=mimetype, as_attachment=as_attachment
+        )
+    response = current_app.response_class(
+        mimetype=mimetype or mimetypes.guess_type(path)[0] or "application/octet-stream"
+    )
+    response.headers[header[0]] = header[1]
+    if as_attachment:
+        response.headers.set(
+            "Content-Disposition", "attachment", filename=os.path.basename(path)
+        )
+    return response
+
+
+def immutable_cache_control(access_level: int) -> str:
+    """
+    Get the Cache-Control header of an immutable file, only stored by the
+    browser of the user if the file is restricted.
+
+    Args:
+        access_level (int): Required access level to get the file.
+    """
+    return (
+        IMMUTABLE_CACHE_CONTROL
+        if access_level == 0
+        else PRIVATE_IMMUTABLE_CACHE_CONTROL
+    )
+
+
 def replace_extension(filename_src: str, new_ext: str) -> str:
     """
     Replace the extension of `filename_src` to `new_ext`.
@@ -634,3 +894,55 @@ def tile_not_found(mimetype: str) -> FlaskResponse:
     """
     ext = mimetype.split("/")[-1]
     return send_from_directory("static/images", "tile404." + ext, mimetype=mimetype)
+
+
+def downsample_lttb(
+    xs: Sequence[float], ys: Sequence[float], threshold: int
+) -> List[int]:
+    """
+    Select `threshold` points of the series (`xs`, `ys`) with the
+    Largest-Triangle-Three-Buckets algorithm, keeping the visual shape of
+    the series drawn as a line chart. The first and last points are kept.
+    Reference: Sveinn Steinarsson, Downsampling Time Series for Visual
+    Representation, 2013.
+
+    Args:
+        xs (Sequence[float]): Sorted abscissas.
+        ys (Sequence[float]): Ordinates, same length as `xs`.
+        threshold (int): Number of points to keep, at least 3.
+
+    Returns:
+        List[int]: Sorted indices of the points kept, all the indices if
+        the series is not longer than `threshold`.
+
+    Raises:
+        ValueError: `threshold` lower than 3.
+    """
+    if threshold < 3:
+        raise ValueError("At least 3 points required")
+    total_points = len(xs)
+    if total_points <= threshold:
+        return list(range(total_points))
+    bucket_size = (total_points - 2) / (threshold - 2)
+    indices = [0]
+    selected = 0
+    for bucket in range(threshold - 2):
+        # the third triangle vertex is the average point of the next bucket:
+        next_start = int((bucket + 1) * bucket_size) + 1
+        next_end = min(int((bucket + 2) * bucket_size) + 1, total_points)
+        next_len = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / next_len
+        avg_y = sum(ys[next_start:next_end]) / next_len
+        prev_x, prev_y = xs[selected], ys[selected]
+        max_area = -1.0
+        for index in range(int(bucket * bucket_size) + 1, next_start):
+            area = abs(
+                (prev_x - avg_x) * (ys[index] - prev_y)
+                - (prev_x - xs[index]) * (avg_y - prev_y)
+            )
+            if area > max_area:
+                max_area = area
+                selected = index
+        indices.append(selected)
+    indices.append(total_points - 1)
+    return indices
@@ -32,11 +32,15 @@
 Main interfaces with the visitor.
 """
 
+from .book_manifest import get_manifest
 from .book_processor import BookProcessor
 from .cache import cache
 from .captcha import Captcha
 from .db import get_db
+from .responsive_images import RESIZABLE_EXTENSIONS
+from .responsive_images import send_resized_image
 from .secure_email import SecureEmail
+from .track_index import get_track_index
 from .utils import *
 
 visitor_app = Blueprint("visitor_app", __name__)
@@ -160,11 +164,12 @@ def photo_dir(photo_id: int, filename: str) -> FlaskResponse:
     * The user is allowed to see the photo,
     * Only the thumbnail is reachable by external requests.
 
+    The resized photos are randomly named, so they are cached as immutable.
     """
     filename = secure_filename(escape(filename))
     cursor = mysql.cursor()
     cursor.execute(
-        """SELECT access_level, thumbnail_src
+        """SELECT access_level, thumbnail_src, raw_src
         FROM gallery
         WHERE photo_id={id} AND (
         thumbnail_src='{filename}'
@@ -183,7 +188,48 @@ def photo_dir(photo_id: int, filename: str) -> FlaskResponse:
         and (not current_app.config["TESTING"])
     ):
         abort(404)  # pragma: no cover
-    return send_from_directory(current_app.config["GALLERY_FOLDER"], filename)
+    response = make_response(
+        send_offloaded_file(current_app.config["GALLERY_FOLDER"], filename)
+    )
+    if data[2] != filename:
+        response.headers["Cache-Control"] = immutable_cache_control(data[0])
+    return response
+
+
+@visitor_app.route("/photos/<int:photo_id>/<int:width>/<string:filename>")
+def resized_photo(photo_id: int, width: int, filename: str) -> FlaskResponse:
+    """
+    Send the large photo resized to `width` pixels for the srcset of the gallery.
+    Check a few things before to send the picture:
+
+    * The photo is in the database,
+    * The user is allowed to see the photo,
+    * The request is not external.
+
+    """
+    filename = secure_filename(escape(filename))
+    cursor = mysql.cursor()
+    cursor.execute(
+        """SELECT access_level
+        FROM gallery
+        WHERE photo_id={id} AND photo_l_src='{filename}'""".format(
+            id=photo_id, filename=filename
+        )
+    )
+    data = cursor.fetchone()
+    if cursor.rowcount == 0 or actual_access_level() < data[0]:
+        abort(404)
+    if not is_same_site() and not current_app.config["TESTING"]:
+        abort(404)  # pragma: no cover
+    response = make_response(
+        send_resized_image(
+            os.path.join(current_app.config["GALLERY_FOLDER"], filename),
+            os.path.join(current_app.config["IMAGE_CACHE_FOLDER"], "gallery"),
+            width,
+        )
+    )
+    response.headers["Cache-Control"] = immutable_cache_control(data[0])
+    return response
 
 
 @visitor_app.route("/stories/locked.jpg")
@@ -192,9 +238,7 @@ def image_of_locked_books() -> FlaskResponse:
     """
     Image of the locked book(s).
     """
-    return send_from_directory(
-        current_app.config["SHELF_FOLDER"], "locked.jpg", as_attachment=False
-    )
+    return send_offloaded_file(current_app.config["SHELF_FOLDER"], "locked.jpg")
 
 
 @visitor_app.route("/stories/<int:book_id>/<string:filename>.<string:ext>")
@@ -225,13 +269,45 @@ def book_dir(book_id: int, filename: str, ext: str) -> FlaskResponse:
         and actual_access_level() < current_app.config["ACCESS_LEVEL_DOWNLOAD_GPX"]
     ):
         abort(404)
-    return send_from_directory(
+    return send_offloaded_file(
         os.path.join(current_app.config["SHELF_FOLDER"], data[1]),
         filename,
         as_attachment=ext in ("gpx", "pdf"),
     )
 
 
+@visitor_app.route("/stories/<int:book_id>/<int:width>/<string:filename>.<string:ext>")
+def resized_book_image(
+    book_id: int, width: int, filename: str, ext: str
+) -> FlaskResponse:
+    """
+    Send an image of a book resized to `width` pixels for the srcset of the
+    story figures. Check a few things before to send the image:
+
+    * The book is in the database,
+    * The user is allowed to access the book.
+    """
+    if ext.lower() not in RESIZABLE_EXTENSIONS:
+        abort(404)
+    filename = secure_filename(escape(filename)) + "." + ext
+    cursor = mysql.cursor()
+    cursor.execute(
+        """SELECT access_level, url
+        FROM shelf
+        WHERE book_id={id}""".format(
+            id=book_id
+        )
+    )
+    data = cursor.fetchone()
+    if cursor.rowcount == 0 or actual_access_level() < data[0]:
+        abort(404)
+    return send_resized_image(
+        os.path.join(current_app.config["SHELF_FOLDER"], data[1], filename),
+        os.path.join(current_app.config["IMAGE_CACHE_FOLDER"], "books", data[1]),
+        width,
+    )
+
+
 @visitor_app.route("/sitemap.xml")
 @cache.cached()
 def sitemap() -> Any:
@@ -307,18 +383,20 @@ def shelf() -> Any:
     for book in data_shelf:  # put the JPEG preview into a blurred SVG
         book_list = list(book)
         try:
-            card_size = get_image_size(
-                os.path.join(current_app.config["SHELF_FOLDER"], book[0], "card.jpg")
-            )
+            card = get_manifest(
+                os.path.join(current_app.config["SHELF_FOLDER"], book[0])
+            ).get_file("card.jpg")
         except FileNotFoundError:
+            card = None
+        if card is None or "width" not in card:
             book_list[9] = ""
         else:
             # trick: https://css-tricks.com/the-blur-up-technique-for-loading-background-images/
             book_list[9] = "data:image/svg+xml;charset=utf-8," + quote(
                 render_template(
                     "preview.svg",
-                    image_width=card_size[0],
-                    image_height=card_size[1],
+                    image_width=card["width"],
+                    image_height=card["height"],
                     data_jpeg=book[9],
                 )
             )
@@ -351,7 +429,8 @@ def story(book_id: int, story_url: str) -> Any:
     cursor = mysql.cursor()
     cursor.execute(
         """SELECT book_id, title, period, status, file_name,
-        description_md, description_html, SUBSTRING_INDEX(file_name,'.',-1) AS file_ext
+        description_md, description_html, SUBSTRING_INDEX(file_name,'.',-1) AS file_ext,
+        url
         FROM shelf
         WHERE access_level <= {access_level} {cond_and_draft}
         AND book_id={id}
@@ -393,6 +472,7 @@ def story(book_id: int, story_url: str) -> Any:
         "ext": book_ext,
         "filename": data[4],
         "content": book_content,
+        "tracks": get_track_index().get_book_tracks(data[8]),
     }
     thumbnail_networks = (
         request.url_root + "books/" + str(book_id) + "/" + story_url + "/card.jpg"
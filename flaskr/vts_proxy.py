@@ -129,7 +129,7 @@ def vts_proxy_world_topo_otm(z: int, x: int, y: int) -> FlaskResponse:
             with open(cache_path, "wb") as tile:
                 tile.write(r.content)
         return Response(r.content, mimetype=mimetype)
-    return send_from_directory(OTM_CACHE, cache_filename, mimetype=mimetype)
+    return send_offloaded_file(OTM_CACHE, cache_filename, mimetype=mimetype)
 
 
 @vts_proxy_app.route(
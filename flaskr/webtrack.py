@@ -32,14 +32,71 @@
 Utility module for the WebTrack format.
 WebTrack specifications:
 https://github.com/ExploreWilder/WebTrack.js/blob/main/SPEC.md
+
+The format 0.2.0 is a compact variant of 0.1.0 differing in the segment
+headers and the segments only:
+
+* Segment header: "E" or "F", uint32 amount of points, uint8 encoding of
+  the segment block (0: plain, 1: raw deflate) and uint32 size in bytes of
+  the segment block as stored.
+* Segment block: for each point, the Web Mercator longitude and latitude in
+  meters, the distance from the start in decameters, and the elevation
+  quantised to the meter if "E". Each value is stored as the difference
+  with the previous point (the first point being relative to 0), as an
+  unsigned varint for the distance and as a zigzag varint otherwise.
+
+Most differences fit in one byte instead of the two bytes of 0.1.0, and the
+block is deflated if smaller.
 """
 
 # pylint: disable=invalid-name; allow one letter variables (f.i. c for character, n for number)
 
+import io
+import struct
+import zlib
+
 import pyproj
 
 from .typing import *
 
+#: Format versions handled by the WebTrack module, the first one being the default.
+FORMAT_VERSIONS: Tuple[bytes, ...] = (b"0.1.0", b"0.2.0")
+
+#: Encodings of the segment blocks of the format 0.2.0.
+PLAIN_BLOCK: int = 0
+DEFLATED_BLOCK: int = 1
+
+
+def _zigzag(n: int) -> int:
+    """ Encode a signed integer so that small absolute values are small. """
+    return n << 1 if n >= 0 else (-n << 1) - 1
+
+
+def _unzigzag(n: int) -> int:
+    """ Decode a zigzag-encoded integer. """
+    return (n >> 1) ^ -(n & 1)
+
+
+def _read_varints(data: bytes) -> List[int]:
+    """
+    Decode all the unsigned varints of `data`.
+
+    Raises:
+        EOFError: Truncated varint.
+    """
+    values = []
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = shift = 0
+    if shift:
+        raise EOFError("Truncated WebTrack")
+    return values
+
 
 class WebTrack:
     """
@@ -49,7 +106,7 @@ class WebTrack:
     """
 
     #: Big-endian order as specified.
-    byteorder: str = "big"
+    byteorder: Literal["little", "big"] = "big"
 
     #: GPS to Web Mercator converter with coordinates in the GIS order: (lon, lat).
     proj = pyproj.Transformer.from_crs("epsg:4326", "epsg:3857", always_xy=True)
@@ -72,10 +129,18 @@ class WebTrack:
     def __init__(
         self,
         format_name: bytes = b"webtrack-bin",
-        format_version: bytes = b"0.1.0",
+        format_version: bytes = FORMAT_VERSIONS[0],
+        compress: bool = True,
     ):
+        """
+        Args:
+            format_name (bytes): Name of the format written.
+            format_version (bytes): Version written, one of FORMAT_VERSIONS.
+            compress (bool): Deflate the segment blocks if smaller (0.2.0 only).
+        """
         self.format_name = format_name
         self.format_version = format_version
+        self.compress = compress
 
     def get_format_information(self, file_path: str = "") -> Dict[str, bytes]:
         """
@@ -94,20 +159,199 @@ class WebTrack:
             "format_version": self.format_version,
         }
 
+    def get_track_information(self, file_path: str) -> Dict[str, int]:
+        """
+        Read the "Track Information" section of the WebTrack file `file_path`
+        without reading the segments.
+
+        Returns:
+            The same fields as the "trackInformation" written by to_file(),
+            rounded as stored. The altitudes, elevation gain and loss are
+            missing if no segment has elevation data.
+        """
+        with open(file_path, "rb") as stream:
+            self.webtrack = stream
+            self._read_format_information()
+            self.total_segments = self._r_int(1)
+            self.total_waypoints = self._r_int(2)
+            self._read_segment_headers()
+            return self._read_track_information()
+
+    def get_elevation_profile(self, file_path: str) -> Tuple[List[int], List[int]]:
+        """
+        Read the elevation profile of the WebTrack file `file_path`, the
+        coordinates are skipped and the segments without elevation ignored.
+
+        Returns:
+            The distances from the start in meters and the elevations in
+            meters of the points, rounded as stored.
+        """
+        distances: List[int] = []
+        elevations: List[int] = []
+        with open(file_path, "rb") as stream:
+            self.webtrack = stream
+            self._read_format_information()
+            self.total_segments = self._r_int(1)
+            self.total_waypoints = self._r_int(2)
+            segment_headers = self._read_segment_headers()
+            self._read_track_information()
+            for with_ele, total_points, encoding, block_size in segment_headers:
+                if self.format_version == b"0.1.0":
+                    points = self._read_segment(with_ele, total_points)
+                else:
+                    points = self._read_segment_block(
+                        with_ele, total_points, encoding, block_size
+                    )
+                if with_ele:
+                    for _, _, distance, elevation in points:
+                        distances.append(distance * 10)
+                        elevations.append(elevation)
+        return distances, elevations
+
+    def get_segment_index(self, file_path: str) -> List[int]:
+        """
+        Read the byte offsets of the segments of the WebTrack file
+        `file_path` from the segment headers, so that a client can download
+        the header and then the segments one by one with range requests.
+
+        Returns:
+            The offset of each segment followed by the offset of the
+            waypoints, which go up to the end of the file.
+        """
+        with open(file_path, "rb") as stream:
+            self.webtrack = stream
+            self._read_format_information()
+            self.total_segments = self._r_int(1)
+            self.total_waypoints = self._r_int(2)
+            segment_headers = self._read_segment_headers()
+            self._read_track_information()
+            offsets = [stream.tell()]
+        for with_ele, total_points, _, block_size in segment_headers:
+            if self.format_version == b"0.1.0":
+                block_size = self._get_segment_size(with_ele, total_points)
+            offsets.append(offsets[-1] + block_size)
+        return offsets
+
     def to_file(self, file_path: str, data: Dict) -> None:
-        """ Open the binary file and write the WebTrack data. """
+        """
+        Open the binary file and write the WebTrack data.
+
+        Raises:
+            ValueError: Format version not handled.
+        """
+        if self.format_version not in FORMAT_VERSIONS:
+            raise ValueError("Unsupported WebTrack format version")
         with open(file_path, "wb") as stream:
-            self.webtrack = stream
             self.data_src = data
             self.total_segments = len(data["segments"]) if "segments" in data else 0
             self.total_waypoints = len(data["waypoints"]) if "waypoints" in data else 0
+            blocks = []
+            if self.format_version != b"0.1.0":
+                for segment in data.get("segments", []):
+                    self.webtrack = io.BytesIO()
+                    self._write_segment_block(segment)
+                    blocks.append(self._pack_block(self.webtrack.getvalue()))
 
+            self.webtrack = stream
             self._write_format_information()
-            self._write_segment_headers()
+            self._write_segment_headers(blocks)
             self._write_track_information()
-            self._write_segments()
+            if blocks:
+                for _, block in blocks:
+                    self.webtrack.write(block)
+            else:
+                self._write_segments()
             self._write_waypoints()
 
+    def merge_files(self, file_paths: List[str], file_path: str) -> None:
+        """
+        Write the WebTrack file `file_path` gathering the segments and the
+        waypoints of the WebTrack files `file_paths`, in order. The segments
+        and the waypoints are copied as is, the track information is merged:
+        the lengths, elevation gains and losses are summed.
+
+        Raises:
+            ValueError: A file is not in the format of this WebTrack.
+            OverflowError: Too many segments or waypoints.
+        """
+        segment_headers = []
+        track_infos = []
+        segments = []
+        waypoints = []
+        total_segments = 0
+        total_waypoints = 0
+        for source_path in file_paths:
+            reader = WebTrack()
+            sections = reader._read_sections(source_path)
+            if (reader.format_name, reader.format_version) != (
+                self.format_name,
+                self.format_version,
+            ):
+                raise ValueError("Cannot merge WebTracks in different formats")
+            segment_headers.append(sections[0])
+            track_infos.append(sections[1])
+            segments.append(sections[2])
+            waypoints.append(sections[3])
+            total_segments += reader.total_segments
+            total_waypoints += reader.total_waypoints
+        if total_segments > 0xFF or total_waypoints > 0xFFFF:
+            raise OverflowError("Too many segments or waypoints to merge")
+
+        track_info = {"length": sum(info["length"] for info in track_infos)}
+        ele_infos = [info for info in track_infos if "minimumAltitude" in info]
+        if ele_infos:
+            track_info["minimumAltitude"] = min(
+                info["minimumAltitude"] for info in ele_infos
+            )
+            track_info["maximumAltitude"] = max(
+                info["maximumAltitude"] for info in ele_infos
+            )
+            track_info["elevationGain"] = sum(
+                info["elevationGain"] for info in ele_infos
+            )
+            track_info["elevationLoss"] = sum(
+                info["elevationLoss"] for info in ele_infos
+            )
+        with open(file_path, "wb") as stream:
+            self.webtrack = stream
+            self.data_src = {"trackInformation": track_info}
+            self.total_segments = total_segments
+            self.total_waypoints = total_waypoints
+            self.has_some_ele = bool(ele_infos)
+            self._write_format_information()
+            self.webtrack.write(b"".join(segment_headers))
+            self._write_track_information()
+            self.webtrack.write(b"".join(segments))
+            self.webtrack.write(b"".join(waypoints))
+
+    def _read_sections(
+        self, file_path: str
+    ) -> Tuple[bytes, Dict[str, int], bytes, bytes]:
+        """
+        Read the WebTrack file `file_path` by section.
+
+        Returns:
+            The raw segment headers, the track information, the raw
+            segments and the raw waypoints.
+        """
+        offsets = self.get_segment_index(file_path)
+        with open(file_path, "rb") as stream:
+            self.webtrack = stream
+            self._read_format_information()
+            self.total_segments = self._r_int(1)
+            self.total_waypoints = self._r_int(2)
+            headers_offset = stream.tell()
+            self._read_segment_headers()
+            segment_headers_size = stream.tell() - headers_offset
+            track_info = self._read_track_information()
+            stream.seek(headers_offset)
+            segment_headers = stream.read(segment_headers_size)
+            stream.seek(offsets[0])
+            segments = stream.read(offsets[-1] - offsets[0])
+            if len(segments) != offsets[-1] - offsets[0]:
+                raise EOFError("Truncated WebTrack")
+            return segment_headers, track_info, segments, stream.read()
+
     def _w_sep(self):
         """ Append a separator to the stream. """
         self.webtrack.write(b":")
@@ -173,6 +417,18 @@ class WebTrack:
         """ Append a string to the stream. The string is UTF-8 encoded. """
         self.webtrack.write(s.encode("utf-8"))
 
+    def _r_int(self, size: int, signed: bool = False) -> int:
+        """
+        Read a `size`-byte integer from the stream.
+
+        Raises:
+            EOFError: Truncated file.
+        """
+        data = self.webtrack.read(size)
+        if len(data) != size:
+            raise EOFError("Truncated WebTrack")
+        return int.from_bytes(data, byteorder=self.byteorder, signed=signed)
+
     def _write_format_information(self) -> None:
         """ Write the "Format Information" section of the WebTrack file. """
         self.webtrack.write(self.format_name)
@@ -203,18 +459,186 @@ class WebTrack:
         self.format_name = self._read_up_to_separator()
         self.format_version = self._read_up_to_separator()
 
-    def _write_segment_headers(self) -> None:
-        """ Write the "Segment Headers" section of the WebTrack file. """
+    def _write_segment_headers(self, blocks: List[Tuple[int, bytes]]) -> None:
+        """
+        Write the "Segment Headers" section of the WebTrack file.
+
+        Args:
+            blocks (List[Tuple[int, bytes]]): Encoding and segment block
+                of each segment, empty for the format 0.1.0.
+        """
         if "segments" not in self.data_src:
             return
         segments = self.data_src["segments"]
-        for segment in segments:
+        for index, segment in enumerate(segments):
             if segment["withEle"]:
                 self.webtrack.write(b"E")
                 self.has_some_ele = True
             else:
                 self.webtrack.write(b"F")
             self._w_uint32(len(segment["points"]))
+            if blocks:
+                encoding, block = blocks[index]
+                self._w_uint8(encoding)
+                self._w_uint32(len(block))
+
+    def _read_segment_headers(self) -> List[Tuple[bool, int, int, int]]:
+        """
+        Read the "Segment Headers" section of the WebTrack file.
+
+        Returns:
+            The elevation flag, the amount of points, the encoding and the
+            size of the segment block of each segment. The encoding and the
+            size are 0 for the format 0.1.0.
+        """
+        self.has_some_ele = False
+        segment_headers = []
+        for _ in range(self.total_segments):
+            with_ele = self.webtrack.read(1) == b"E"
+            if with_ele:
+                self.has_some_ele = True
+            total_points = self._r_int(4)
+            if self.format_version == b"0.1.0":
+                segment_headers.append((with_ele, total_points, 0, 0))
+            else:
+                segment_headers.append(
+                    (with_ele, total_points, self._r_int(1), self._r_int(4))
+                )
+        return segment_headers
+
+    def _read_track_information(self) -> Dict[str, int]:
+        """ Read the "Track Information" section of the WebTrack file. """
+        track_info = {"length": self._r_int(4)}
+        if self.has_some_ele:
+            track_info["minimumAltitude"] = self._r_int(2, signed=True)
+            track_info["maximumAltitude"] = self._r_int(2, signed=True)
+            track_info["elevationGain"] = self._r_int(4)
+            track_info["elevationLoss"] = self._r_int(4)
+        return track_info
+
+    @staticmethod
+    def _get_point_formats(with_ele: bool) -> Tuple[str, str]:
+        """ Returns the struct formats of the first and next points (0.1.0). """
+        if with_ele:
+            return ">iiHh", ">hhHh"
+        return ">iiH", ">hhH"
+
+    def _get_segment_size(self, with_ele: bool, total_points: int) -> int:
+        """ Returns the size in bytes of a segment of the format 0.1.0. """
+        if not total_points:
+            return 0
+        first_format, next_format = self._get_point_formats(with_ele)
+        return struct.calcsize(first_format) + struct.calcsize(next_format) * (
+            total_points - 1
+        )
+
+    def _read_segment(
+        self, with_ele: bool, total_points: int
+    ) -> List[Tuple[int, int, int, int]]:
+        """
+        Read a segment of `total_points` points from the stream.
+
+        Returns:
+            The points as stored: Web Mercator coordinates, distance in
+            decameters and elevation (0 for a segment without elevation).
+
+        Raises:
+            EOFError: Truncated file.
+        """
+        if not total_points:
+            return []
+        first_format, next_format = self._get_point_formats(with_ele)
+        size = self._get_segment_size(with_ele, total_points)
+        data = self.webtrack.read(size)
+        if len(data) != size:
+            raise EOFError("Truncated WebTrack")
+        first_size = struct.calcsize(first_format)
+        raw_points = [struct.unpack(first_format, data[:first_size])]
+        raw_points.extend(struct.iter_unpack(next_format, data[first_size:]))
+        points = []
+        lon, lat = 0, 0
+        for index, raw_point in enumerate(raw_points):
+            if index:
+                lon, lat = lon + raw_point[0], lat + raw_point[1]
+            else:
+                lon, lat = raw_point[0], raw_point[1]
+            points.append((lon, lat, raw_point[2], raw_point[3] if with_ele else 0))
+        return points
+
+    def _read_segment_block(
+        self, with_ele: bool, total_points: int, encoding: int, block_size: int
+    ) -> List[Tuple[int, int, int, int]]:
+        """
+        Read a segment block of the format 0.2.0 from the stream.
+
+        Returns:
+            The points as in _read_segment().
+
+        Raises:
+            EOFError: Truncated file.
+            ValueError: Unknown encoding or corrupted block.
+        """
+        block = self.webtrack.read(block_size)
+        if len(block) != block_size:
+            raise EOFError("Truncated WebTrack")
+        if encoding == DEFLATED_BLOCK:
+            try:
+                block = zlib.decompress(block, -zlib.MAX_WBITS)
+            except zlib.error as error:
+                raise ValueError("Corrupted WebTrack segment") from error
+        elif encoding != PLAIN_BLOCK:
+            raise ValueError("Unknown WebTrack segment encoding")
+        values = _read_varints(block)
+        stride = 4 if with_ele else 3
+        if len(values) != stride * total_points:
+            raise ValueError("Corrupted WebTrack segment")
+        points = []
+        lon = lat = distance = elevation = 0
+        for i in range(0, len(values), stride):
+            lon += _unzigzag(values[i])
+            lat += _unzigzag(values[i + 1])
+            distance += values[i + 2]
+            if with_ele:
+                elevation += _unzigzag(values[i + 3])
+            points.append((lon, lat, distance, elevation))
+        return points
+
+    def _w_varint(self, n: int) -> None:
+        """ Append an unsigned varint to the stream. """
+        data = bytearray()
+        while n > 0x7F:
+            data.append((n & 0x7F) | 0x80)
+            n >>= 7
+        data.append(n)
+        self.webtrack.write(data)
+
+    def _write_segment_block(self, segment: Dict) -> None:
+        """ Write the plain segment block of the format 0.2.0 in the stream. """
+        with_ele = segment["withEle"]
+        previous = (0, 0, 0, 0)
+        for point in segment["points"]:
+            web_point = self.proj.transform(point[0], point[1])  # lon, lat
+            current = (
+                int(round(web_point[0])),
+                int(round(web_point[1])),
+                int(round(point[2] / 10.0)),
+                int(round(point[3])) if with_ele else 0,
+            )
+            self._w_varint(_zigzag(current[0] - previous[0]))
+            self._w_varint(_zigzag(current[1] - previous[1]))
+            self._w_varint(current[2] - previous[2])
+            if with_ele:
+                self._w_varint(_zigzag(current[3] - previous[3]))
+            previous = current
+
+    def _pack_block(self, block: bytes) -> Tuple[int, bytes]:
+        """ Returns the encoding and the segment block, deflated if smaller. """
+        if self.compress:
+            compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+            deflated = compressor.compress(block) + compressor.flush()
+            if len(deflated) < len(block):
+                return DEFLATED_BLOCK, deflated
+        return PLAIN_BLOCK, block
 
     def _write_track_information(self) -> None:
         """
@@ -0,0 +1,119 @@
+#
+# Copyright 2021 Clement
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+import json
+import os
+import shutil
+
+import pytest
+
+from flaskr.book_manifest import MANIFEST_NAME
+from flaskr.book_manifest import get_manifest
+from flaskr.book_manifest import refresh_manifest
+from flaskr.book_manifest import refresh_shelf_manifests
+from flaskr.track_index import get_file_hash
+from flaskr.utils import CONTENT_HASH_LENGTH
+
+
+def test_refresh_manifest(tmp_path):
+    """ Scan a book directory, read only the changed files. """
+    book_dir = str(tmp_path)
+    shutil.copyfile("Gillespie_Circuit.gpx", os.path.join(book_dir, "a.gpx"))
+    shutil.copyfile("Gillespie_Circuit.webtrack", os.path.join(book_dir, "a.webtrack"))
+    open(os.path.join(book_dir, "empty.gpx"), "w").close()
+    open(os.path.join(book_dir, "a.webtrack.lock"), "w").close()
+    os.mkdir(os.path.join(book_dir, "photos"))
+    manifest = refresh_manifest(book_dir)
+    assert sorted(manifest.files) == ["a.gpx", "a.webtrack", "empty.gpx"]
+    assert manifest.get_hash("a.gpx") == get_file_hash("Gillespie_Circuit.gpx")
+    assert manifest.has_format_version("a.webtrack", b"0.1.0")
+    assert not manifest.has_format_version("a.webtrack", b"0.2.0")
+    assert manifest.list_files("gpx") == [os.path.join(book_dir, "a.gpx")]
+    assert not manifest.has_file("empty.gpx")
+    assert manifest.get_file("missing.gpx") is None
+    with open(os.path.join(book_dir, MANIFEST_NAME)) as manifest_file:
+        assert json.load(manifest_file)["files"] == manifest.files
+
+    # the files are checked in memory:
+    os.remove(os.path.join(book_dir, "a.webtrack"))
+    assert get_manifest(book_dir).has_file("a.webtrack")
+    manifest = refresh_manifest(book_dir)
+    assert not manifest.has_file("a.webtrack")
+    assert manifest.is_outdated("a.gpx", "a.webtrack")
+
+    # the unchanged files are not read again:
+    manifest.files["a.gpx"]["sha1"] = "not read"
+    with open(os.path.join(book_dir, MANIFEST_NAME), "w") as manifest_file:
+        json.dump({"files": manifest.files}, manifest_file)
+    assert refresh_manifest(book_dir).get_hash("a.gpx") == "not read"
+    os.utime(os.path.join(book_dir, "a.gpx"), ns=(0, 0))
+    manifest = refresh_manifest(book_dir)
+    assert manifest.get_hash("a.gpx") == get_file_hash("Gillespie_Circuit.gpx")
+
+    with pytest.raises(FileNotFoundError):
+        get_manifest(str(tmp_path / "missing"))
+
+
+def test_is_outdated(tmp_path):
+    """ Compare the modification times saved in the manifest. """
+    book_dir = str(tmp_path)
+    for filename in ("track.gpx", "track.geojson"):
+        with open(os.path.join(book_dir, filename), "w") as test_file:
+            test_file.write("{}")
+    os.utime(os.path.join(book_dir, "track.gpx"), ns=(0, 1000))
+    os.utime(os.path.join(book_dir, "track.geojson"), ns=(0, 2000))
+    manifest = refresh_manifest(book_dir)
+    assert not manifest.is_outdated("track.gpx", "track.geojson")
+    assert manifest.is_outdated("track.geojson", "track.gpx")
+    assert manifest.is_outdated("track.gpx", "track.webtrack")
+
+
+def test_refresh_shelf_manifests(tmp_path):
+    """ Refresh every book of the shelf. """
+    for book_url in ("first_story", "second_story"):
+        os.mkdir(tmp_path / book_url)
+    open(tmp_path / "not_a_book.txt", "w").close()
+    assert refresh_shelf_manifests(str(tmp_path)) == 2
+    assert os.path.isfile(tmp_path / "first_story" / MANIFEST_NAME)
+
+
+def test_get_content_hash(tmp_path):
+    """ Hash of the content of one or several files. """
+    book_dir = str(tmp_path)
+    shutil.copyfile("Gillespie_Circuit.gpx", os.path.join(book_dir, "a.gpx"))
+    shutil.copyfile("Gillespie_Circuit.webtrack", os.path.join(book_dir, "a.webtrack"))
+    manifest = refresh_manifest(book_dir)
+    gpx_hash = manifest.get_content_hash(["a.gpx"])
+    assert gpx_hash == get_file_hash("Gillespie_Circuit.gpx")[:CONTENT_HASH_LENGTH]
+    both_hash = manifest.get_content_hash(["a.gpx", "a.webtrack"])
+    assert len(both_hash) == CONTENT_HASH_LENGTH
+    assert both_hash not in (gpx_hash, manifest.get_content_hash(["a.webtrack"]))
+    assert manifest.get_content_hash(["a.gpx", "missing.webtrack"]) is None
@@ -0,0 +1,117 @@
+#
+# Copyright 2021 Clement
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+import os
+import struct
+import zipfile
+
+import pytest
+
+from flaskr.elevation import HgtTile
+from flaskr.elevation import SrtmElevationData
+from flaskr.elevation import get_tile_name
+
+#: 3x3 samples, the first row being the northern one, -32768 is a void.
+SAMPLES = (100, 200, 300, 400, 500, 600, 700, -32768, 900)
+
+
+def save_tile(path):
+    with open(path, "wb") as hgt_file:
+        hgt_file.write(struct.pack(">9h", *SAMPLES))
+
+
+@pytest.mark.parametrize(
+    "latitude,longitude,tile_name",
+    (
+        (-44.2, 169.3, "S45E169.hgt"),
+        (45.0, 6.0, "N45E006.hgt"),
+        (0.5, -0.5, "N00W001.hgt"),
+        (-0.5, -179.5, "S01W180.hgt"),
+    ),
+)
+def test_get_tile_name(latitude, longitude, tile_name):
+    """ Test the HGT filenames as named by SRTM.py. """
+    assert get_tile_name(latitude, longitude) == tile_name
+
+
+def test_hgt_tile(tmp_path):
+    """ Test the lookups in a memory-mapped tile. """
+    path = str(tmp_path / "S45E169.hgt")
+    save_tile(path)
+    tile = HgtTile(path, -45, 169)
+    assert tile.side == 3
+    assert tile.get_sample(0, 0) == 100
+    assert tile.get_sample(2, 1) is None
+    assert tile.get_nearest(-44.01, 169.01) == 100  # north-west corner
+    assert tile.get_nearest(-44.6, 169.6) == 500
+    assert tile.get_bilinear(-44.0, 169.0) == 100
+    assert tile.get_bilinear(-44.25, 169.25) == pytest.approx(300)
+    assert tile.get_bilinear(-44.5, 169.75) == pytest.approx(550)
+    assert tile.get_bilinear(-44.75, 169.25) == pytest.approx(1600 / 3)  # void ignored
+
+    with open(path, "ab") as hgt_file:
+        hgt_file.write(b"\0\0")
+    with pytest.raises(ValueError, match="Invalid HGT file size"):
+        HgtTile(path, -45, 169)
+
+
+def test_srtm_elevation_data(tmp_path):
+    """ Test the batch lookup, the zipped tiles, the downloads and the LRU. """
+    fetched = []
+
+    def fetch_tile(latitude, longitude):
+        fetched.append(get_tile_name(latitude, longitude))
+        if latitude < 0:
+            save_tile(str(tmp_path / get_tile_name(latitude, longitude)))
+
+    save_tile(str(tmp_path / "N45E006.hgt"))
+    with zipfile.ZipFile(str(tmp_path / "N46E006.hgt.zip"), "w") as hgt_zip:
+        hgt_zip.writestr("N46E006.hgt", struct.pack(">9h", *SAMPLES))
+    elevation_data = SrtmElevationData(str(tmp_path), 2, fetch_tile)
+    latitudes = [45.99, 46.4, 45.4, 10.5, 10.5, -44.4]
+    longitudes = [6.01, 6.6, 6.6, 10.5, 10.6, 169.6]
+    assert elevation_data.get_elevations(latitudes, longitudes) == [
+        100,
+        500,
+        500,
+        None,
+        None,
+        200,
+    ]
+    assert os.path.isfile(str(tmp_path / "N46E006.hgt"))
+    assert not any(name.endswith(".tmp") for name in os.listdir(tmp_path))
+    assert fetched == ["N10E010.hgt", "S45E169.hgt"]
+    assert elevation_data.get_elevation(10.5, 10.5) is None
+    assert fetched == ["N10E010.hgt", "S45E169.hgt"]  # missing tile not fetched again
+    assert list(elevation_data.tiles) == [(45, 6), (-45, 169)]  # LRU
+    assert elevation_data.get_elevation(45.75, 6.25, True) == pytest.approx(300)
+
+    offline = SrtmElevationData(str(tmp_path))
+    assert offline.get_elevation(20.5, 20.5) is None
@@ -0,0 +1,112 @@
+#
+# Copyright 2021 Clement
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+import os
+import sqlite3
+
+from flaskr.export_queue import ExportQueue
+
+
+def test_export_queue(tmp_path):
+    """ Jobs are unique, popped in order, retried, and dropped. """
+    queue = ExportQueue(str(tmp_path / "queue.sqlite"), max_attempts=2)
+    assert len(queue) == 0
+    assert queue.pop() is None
+
+    assert queue.push("webtrack", "a.gpx", "a.webtrack")
+    assert queue.push("static_map", "b.gpx", "b.gpx_static_map.jpg")
+    assert not queue.push("webtrack", "a.gpx", "a.webtrack")  # already queued
+    assert len(queue) == 2
+
+    job = queue.pop()
+    assert job.export_type == "webtrack"
+    assert job.gpx_path == "a.gpx"
+    assert job.export_path == "a.webtrack"
+    assert job.attempts == 1
+    assert not queue.push("webtrack", "a.gpx", "a.webtrack")  # running
+
+    other_job = queue.pop()
+    assert other_job.export_path == "b.gpx_static_map.jpg"
+    assert queue.pop() is None  # both are running
+    queue.done(other_job)
+    assert len(queue) == 1
+
+    assert queue.failed(job)  # first failure, retry later
+    job = queue.pop()
+    assert job.attempts == 2
+    assert not queue.failed(job)  # too many failures, dropped
+    assert len(queue) == 0
+
+
+def test_lost_job(tmp_path):
+    """
+    A job running for too long is popped again (killed worker), unless it
+    was tried too many times.
+    """
+    database = str(tmp_path / "queue.sqlite")
+    queue = ExportQueue(database, max_attempts=2, job_timeout=60)
+
+    def lose_jobs() -> None:
+        connection = sqlite3.connect(database)
+        with connection:
+            connection.execute("UPDATE export_jobs SET started_at=started_at-61")
+        connection.close()
+
+    queue.push("webtrack", "a.gpx", "a.webtrack")
+    assert queue.pop() is not None
+    assert queue.pop() is None
+    lose_jobs()
+    job = queue.pop()
+    assert job is not None
+    assert job.attempts == 2
+    lose_jobs()
+    assert queue.pop() is None  # dropped
+    assert len(queue) == 0
+    assert queue.push("webtrack", "a.gpx", "a.webtrack")  # can be queued again
+
+
+def test_schema_created_once(tmp_path, monkeypatch):
+    """ The schema is created by the first queue of the process only. """
+    database = str(tmp_path / "queue.sqlite")
+    connections = []
+    connect = ExportQueue._connect
+    monkeypatch.setattr(
+        ExportQueue,
+        "_connect",
+        lambda self: connections.append(self) or connect(self),
+    )
+    ExportQueue(database)
+    assert len(connections) == 1
+    ExportQueue(database)
+    assert len(connections) == 1
+    os.remove(database)
+    queue = ExportQueue(database)  # created again
+    assert len(connections) == 2
+    assert len(queue) == 0
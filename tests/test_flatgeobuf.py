@@ -0,0 +1,91 @@
+#
+# Copyright 2021 Clement
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+import struct
+
+import pytest
+
+from flaskr import flatgeobuf
+
+
+@pytest.mark.parametrize(
+    "items_no,expected_bounds",
+    (
+        (1, [(1, 2), (0, 1)]),
+        (16, [(1, 17), (0, 1)]),
+        (17, [(3, 20), (1, 3), (0, 1)]),
+        (300, [(22, 322), (3, 22), (1, 3), (0, 1)]),
+    ),
+)
+def test_get_level_bounds(items_no, expected_bounds):
+    """ Test the packed R-tree layout, the root first. """
+    assert flatgeobuf.get_level_bounds(items_no, 16) == expected_bounds
+
+
+def test_hilbert():
+    """ Test the Hilbert curve, starting and ending at the bottom corners. """
+    assert flatgeobuf.hilbert(0, 0) == 0
+    assert flatgeobuf.hilbert(flatgeobuf.HILBERT_MAX, 0) == (1 << 32) - 1
+    cells = [
+        (x, y) for x in range(0, 1 << 16, 1 << 14) for y in range(0, 1 << 16, 1 << 14)
+    ]
+    assert len(set(flatgeobuf.hilbert(x, y) for x, y in cells)) == len(cells)
+
+
+def test_write_flatgeobuf(tmp_path):
+    """ Test the file layout: header, spatial index, and features. """
+    fgb_path = str(tmp_path / "tracks.fgb")
+    features = [
+        ("east", [([170.0, 171.0, 172.0], [-44.0, -43.0, -44.0])]),
+        ("empty", [([1.0], [2.0])]),
+        ("west", [([5.0, 6.0], [5.0, 6.0]), ([7.0, 8.0], [7.0, 8.0])]),
+    ]
+    flatgeobuf.write_flatgeobuf(fgb_path, features, "My Book")
+    with open(fgb_path, "rb") as fgb_file:
+        data = fgb_file.read()
+    assert data.startswith(flatgeobuf.MAGIC_BYTES)
+    (header_size,) = struct.unpack_from("<I", data, 8)
+    assert b"My Book" in data[12 : 12 + header_size]
+
+    # two features (the one without line is dropped), one root node:
+    index_start = 12 + header_size
+    nodes = [struct.unpack_from("<4dQ", data, index_start + 40 * i) for i in range(3)]
+    assert nodes[0] == (5.0, -44.0, 172.0, 8.0, 1)
+    features_start = index_start + 40 * 3
+    leaves = sorted(nodes[1:], key=lambda node: node[4])
+    assert leaves[0][4] == 0
+    (first_size,) = struct.unpack_from("<I", data, features_start)
+    assert leaves[1][4] == 4 + first_size
+    (second_size,) = struct.unpack_from("<I", data, features_start + 4 + first_size)
+    assert features_start + 8 + first_size + second_size == len(data)
+    assert {leaf[:4] for leaf in leaves} == {
+        (170.0, -44.0, 172.0, -43.0),
+        (5.0, 5.0, 8.0, 8.0),
+    }
@@ -0,0 +1,201 @@
+#
+# Copyright 2021 Clement
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+import math
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import gpxpy
+import pytest
+
+from flaskr.gpx_reader import GpxSegment
+from flaskr.gpx_reader import StreamedGpx
+from flaskr.gpx_reader import get_gpx_arrays_path
+from flaskr.gpx_reader import load_gpx
+from flaskr.gpx_reader import read_gpx
+
+
+def test_read_gpx():
+    """ The streamed tracks and waypoints are the same as the gpxpy ones. """
+    gpx_path = "Gillespie_Circuit.gpx"
+    with open(gpx_path, "r") as gpx_file:
+        expected_gpx = gpxpy.parse(gpx_file)
+    gpx = read_gpx(gpx_path)
+    assert len(gpx.tracks) == len(expected_gpx.tracks)
+    assert gpx.get_points_no() == expected_gpx.get_points_no()
+    for track, expected_track in zip(gpx.tracks, expected_gpx.tracks):
+        assert len(track) == len(expected_track.segments)
+        for segment, expected_segment in zip(track, expected_track.segments):
+            for i, point in enumerate(expected_segment.points):
+                assert segment.latitudes[i] == point.latitude
+                assert segment.longitudes[i] == point.longitude
+                assert segment.get_elevation(i) == point.elevation
+    assert len(gpx.waypoints) == len(expected_gpx.waypoints)
+    for waypoint, expected_waypoint in zip(gpx.waypoints, expected_gpx.waypoints):
+        assert waypoint.latitude == expected_waypoint.latitude
+        assert waypoint.longitude == expected_waypoint.longitude
+        assert waypoint.elevation == expected_waypoint.elevation
+        assert waypoint.symbol == expected_waypoint.symbol
+        assert waypoint.name == expected_waypoint.name
+    bounds = expected_gpx.get_bounds()
+    assert gpx.get_bounds() == (
+        bounds.min_longitude,
+        bounds.min_latitude,
+        bounds.max_longitude,
+        bounds.max_latitude,
+    )
+
+
+def test_simplify():
+    """ The simplification gives the same result as gpxpy. """
+    gpx_path = "test_gpx_to_geojson.gpx"
+    with open(gpx_path, "r") as gpx_file:
+        expected_gpx = gpxpy.parse(gpx_file)
+    gpx = read_gpx(gpx_path)
+    for max_distance in (None, 0, 50, 500):
+        for segment, expected_segment in zip(
+            gpx.segments(),
+            (s for t in expected_gpx.tracks for s in t.segments),
+        ):
+            expected_segment = expected_segment.clone()
+            expected_segment.simplify(max_distance)
+            assert [
+                (segment.latitudes[i], segment.longitudes[i])
+                for i in segment.simplify_indices(max_distance)
+            ] == [(p.latitude, p.longitude) for p in expected_segment.points]
+
+
+def test_importances():
+    """ The importances give all the simplification levels at once. """
+    for segment in read_gpx("test_gpx_to_geojson.gpx").segments():
+        importances = segment.get_importances()
+        assert importances[0] == importances[-1] == math.inf
+        for max_distance in (0, 10, 50, 500):
+            assert segment.simplify_indices(max_distance) == [
+                i
+                for i, importance in enumerate(importances)
+                if importance >= max_distance
+            ]
+
+
+def test_top_indices():
+    """ The exact number of points is kept, the most important first. """
+    for segment in read_gpx("test_gpx_to_geojson.gpx").segments():
+        assert segment.top_indices(len(segment) + 10) == list(range(len(segment)))
+        for max_distance in (10, 50, 500):
+            indices = segment.simplify_indices(max_distance)
+            assert segment.top_indices(len(indices)) == indices
+        indices = segment.top_indices(7)
+        assert len(indices) == 7
+        assert indices[0] == 0
+        assert indices[-1] == len(segment) - 1
+
+
+def test_top_indices_tie():
+    """ A point with the importance of its parent split point comes after it. """
+    segment = GpxSegment()
+    for latitude, longitude in (
+        (0, 0),
+        (-0.00045, 0.0005),
+        (0.0005, 0.0025),
+        (0, 0.003),
+    ):
+        segment.append(latitude, longitude, 0)
+    importances = segment.get_importances()
+    assert importances[1] == importances[2]  # inherited from the split point 2
+    assert segment.top_indices(3) == [0, 2, 3]
+
+
+def test_load_gpx(tmp_path):
+    """ The GPX file is parsed once and then read from the cached arrays. """
+    gpx_path = str(tmp_path / "Gillespie_Circuit.gpx")
+    shutil.copyfile("Gillespie_Circuit.gpx", gpx_path)
+    cache_path = get_gpx_arrays_path(gpx_path)
+    assert cache_path == str(tmp_path / "Gillespie_Circuit.gpx_arrays")
+    assert not os.path.isfile(cache_path)
+
+    expected_gpx = read_gpx(gpx_path)
+    gpx = load_gpx(gpx_path)
+    assert os.path.isfile(cache_path)
+    cached_gpx = StreamedGpx.from_file(cache_path)
+    for loaded_gpx in (gpx, cached_gpx, load_gpx(gpx_path)):
+        assert [[len(s) for s in t] for t in loaded_gpx.tracks] == [
+            [len(s) for s in t] for t in expected_gpx.tracks
+        ]
+        for segment, expected_segment in zip(
+            loaded_gpx.segments(), expected_gpx.segments()
+        ):
+            assert segment.latitudes == expected_segment.latitudes
+            assert segment.longitudes == expected_segment.longitudes
+            assert [segment.get_elevation(i) for i in range(len(segment))] == [
+                expected_segment.get_elevation(i) for i in range(len(segment))
+            ]
+        assert [(w.latitude, w.name) for w in loaded_gpx.waypoints] == [
+            (w.latitude, w.name) for w in expected_gpx.waypoints
+        ]
+
+    # a corrupted cache is replaced:
+    with open(cache_path, "wb") as cache_file:
+        cache_file.write(b"garbage")
+    assert load_gpx(gpx_path).get_points_no() == expected_gpx.get_points_no()
+    assert StreamedGpx.from_file(cache_path).get_points_no() > 0
+
+    # an updated GPX file invalidates the cache:
+    gpx_mtime = os.stat(gpx_path).st_mtime
+    os.utime(cache_path, (gpx_mtime - 10, gpx_mtime - 10))
+    load_gpx(gpx_path)
+    assert os.stat(cache_path).st_mtime >= gpx_mtime
+
+
+def test_load_gpx_concurrently(tmp_path, monkeypatch):
+    """ Threads create the cache at the same time, a failure leaves no file. """
+    gpx_path = str(tmp_path / "Gillespie_Circuit.gpx")
+    shutil.copyfile("Gillespie_Circuit.gpx", gpx_path)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        points = list(
+            executor.map(lambda _: load_gpx(gpx_path).get_points_no(), range(8))
+        )
+    assert len(set(points)) == 1
+    assert sorted(os.listdir(tmp_path)) == [
+        "Gillespie_Circuit.gpx",
+        "Gillespie_Circuit.gpx_arrays",
+    ]
+
+    def failing_to_file(self, file_path):
+        with open(file_path, "wb") as cache_file:
+            cache_file.write(b"partial")
+        raise OSError("No space left on device")
+
+    os.remove(get_gpx_arrays_path(gpx_path))
+    monkeypatch.setattr(StreamedGpx, "to_file", failing_to_file)
+    with pytest.raises(OSError):
+        load_gpx(gpx_path)
+    assert os.listdir(tmp_path) == ["Gillespie_Circuit.gpx"]
@@ -28,18 +28,18 @@
 # POSSIBILITY OF SUCH DAMAGE.
 #
 
+from urllib.parse import unquote_plus
 from urllib.parse import urlparse
 
-import gpxpy
+import polyline
 
+from flaskr.gpx_reader import read_gpx
 from flaskr.gpx_to_img import gpx_to_src
 
 
 def test_gpx_to_src(app):
     """ Test of the GPX to the Mapbox API URL conversion. """
-    gpx_path = "Gillespie_Circuit.gpx"
-    with open(gpx_path, "r") as gpx_file:
-        gpx = gpxpy.parse(gpx_file)
+    gpx = read_gpx("Gillespie_Circuit.gpx")
     with app.app_context():
         url = gpx_to_src(gpx, app.config["MAPBOX_STATIC_IMAGES"])
         parsed_url = urlparse(url)
@@ -63,3 +63,8 @@ def test_gpx_to_src(app):
                 )
         assert has_access_token
         assert has_logo_set
+
+        # the path has exactly the expected number of points:
+        conf = dict(app.config["MAPBOX_STATIC_IMAGES"], points=42)
+        path = unquote_plus(gpx_to_src(gpx, conf)).split("(")[-1].split(")")[0]
+        assert len(polyline.decode(path)) == 42
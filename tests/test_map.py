@@ -28,14 +28,30 @@
 # POSSIBILITY OF SUCH DAMAGE.
 #
 
+import json
 import os
 
 import pytest
 from flask import request
 from PIL import Image
 
+from flaskr.book_manifest import get_manifest
+from flaskr.book_manifest import refresh_manifest
+from flaskr.gpx_reader import GpxSegment
+from flaskr.gpx_reader import load_gpx
+from flaskr.map import IMMUTABLE_CACHE_CONTROL
+from flaskr.map import build_export
 from flaskr.map import create_static_map
+from flaskr.map import get_elevation_data
+from flaskr.map import get_export_hash
+from flaskr.map import get_export_queue
+from flaskr.map import get_geojson_lod
+from flaskr.map import get_geojson_lod_path
+from flaskr.map import gpx_to_geojson_lods
 from flaskr.map import gpx_to_simplified_geojson
+from flaskr.map import iter_geojson
+from flaskr.track_index import TrackIndex
+from flaskr.webtrack import FORMAT_VERSIONS
 
 
 @pytest.mark.parametrize(
@@ -109,6 +125,70 @@ def test_gpx_to_simplified_geojson(files):
         )
 
 
+def test_iter_geojson():
+    """
+    Test the streamed GeoJSON, including tracks without any point.
+    """
+    gpx = load_gpx("test_gpx_to_geojson.gpx")
+    indices = [
+        [segment.simplify_indices() for segment in track] for track in gpx.tracks
+    ]
+    chunks = list(iter_geojson(gpx, indices))
+    assert len(chunks) > 2
+    with open("test_gpx_to_geojson.expected_output.geojson") as expected_output:
+        assert expected_output.read() == "".join(chunks)
+
+    gpx.tracks = [[GpxSegment(), GpxSegment()]]
+    geojson = json.loads("".join(iter_geojson(gpx, [[[], []]])))
+    assert geojson["features"][0]["geometry"]["coordinates"] == [[], []]
+    gpx.tracks = []
+    assert json.loads("".join(iter_geojson(gpx, []))) == {
+        "type": "FeatureCollection",
+        "features": [],
+    }
+
+
+def test_gpx_to_geojson_lods(tmp_path):
+    """
+    Test the GeoJSON levels of detail, built at once.
+    """
+    gpx_path = "test_gpx_to_geojson.gpx"
+    geojson_path = str(tmp_path / "test_gpx_to_geojson.geojson")
+    gpx_to_geojson_lods(gpx_path, geojson_path)
+    assert get_geojson_lod_path(geojson_path, 2) == str(
+        tmp_path / "test_gpx_to_geojson.lod2.geojson"
+    )
+    sizes = []
+    for lod in range(5):
+        with open(get_geojson_lod_path(geojson_path, lod)) as geojson_file:
+            geojson = geojson_file.read()
+        assert geojson == gpx_to_simplified_geojson(gpx_path, lod)
+        sizes.append(len(geojson))
+    assert sizes == sorted(sizes, reverse=True)
+    assert sizes[0] > sizes[-1]
+    with open("test_gpx_to_geojson.expected_output.geojson") as expected_output:
+        with open(geojson_path) as geojson_file:
+            assert expected_output.read() == geojson_file.read()
+
+
+@pytest.mark.parametrize(
+    "max_distance,lod",
+    (
+        (None, 0),
+        (5, 0),
+        (10, 0),
+        (100, 1),
+        (160, 2),
+        (1e6, 4),
+    ),
+)
+def test_get_geojson_lod(max_distance, lod):
+    """
+    Test the level of detail selection.
+    """
+    assert get_geojson_lod(max_distance) == lod
+
+
 @pytest.mark.parametrize(
     "track_type",
     (
@@ -148,13 +228,163 @@ def test_export(files, client, app, auth, track_type):
         )
         assert os.path.isfile(track_path)
         if track_type == "webtrack":
-            webtrack_header = b"webtrack-bin"
+            webtrack_header = b"webtrack-bin:0.1.0:"
             assert open(track_path, "rb").read(len(webtrack_header)) == webtrack_header
+            # newer format served side by side:
+            rv = client.get("/map/webtracks/1/" + track_filename + "?version=0.2.0")
+            assert rv.status_code == 200
+            assert rv.data.startswith(b"webtrack-bin:0.2.0:")
+            assert len(rv.data) < os.stat(track_path).st_size
+            rv = client.get("/map/webtracks/1/" + track_filename + "?version=9.9.9")
+            assert rv.status_code == 404
+            # progressive loading:
+            rv = client.get("/map/webtracks/1/" + track_filename)
+            offsets = [
+                int(offset)
+                for offset in rv.headers["WebTrack-Segment-Offsets"].split(",")
+            ]
+            assert len(offsets) == 2
+            rv = client.get(
+                "/map/webtracks/1/" + track_filename,
+                headers={"Range": "bytes={}-{}".format(offsets[0], offsets[1] - 1)},
+            )
+            assert rv.status_code == 206
+            assert len(rv.data) == offsets[1] - offsets[0]
         elif track_type == "geojson":
             geojson_header = '{"type":"FeatureCollection","features":['
             assert open(track_path, "r").read(len(geojson_header)) == geojson_header
 
 
+def test_geojson_lod(files, client, app):
+    """
+    Test the GeoJSON level of detail selected by the map zoom.
+    """
+    geojson_url = "/map/geojsons/1/test_Gillespie_Circuit.geojson"
+    rv_full = client.get(geojson_url)
+    assert rv_full.status_code == 200
+    assert client.get(geojson_url + "?zoom=15").data == rv_full.data
+    rv_overview = client.get(geojson_url + "?zoom=3")
+    assert rv_overview.status_code == 200
+    assert len(rv_overview.data) < len(rv_full.data)
+    assert client.get(geojson_url + "?tolerance=2560").data == rv_overview.data
+    with app.app_context():
+        assert os.path.isfile(
+            os.path.join(
+                app.config["SHELF_FOLDER"],
+                "first_story",
+                "test_Gillespie_Circuit.lod4.geojson",
+            )
+        )
+
+
+def test_flatgeobuf(files, client, app):
+    """
+    Test the FlatGeobuf exports of a track and of a whole book.
+    """
+    rv = client.get("/map/flatgeobufs/1/test_Gillespie_Circuit.fgb")
+    assert rv.status_code == 200
+    assert rv.mimetype == "application/flatgeobuf"
+    assert rv.data.startswith(b"fgb\x03")
+    rv = client.get(
+        "/map/flatgeobufs/1/test_Gillespie_Circuit.fgb", headers={"Range": "bytes=0-7"}
+    )
+    assert rv.status_code == 206
+    assert rv.data == b"fgb\x03fgb\x00"
+
+    rv = client.get("/map/books/1/tracks.fgb")
+    assert rv.status_code == 200
+    assert rv.data.startswith(b"fgb\x03")
+    assert b"test_Gillespie_Circuit" in rv.data
+    with app.app_context():
+        assert os.path.isfile(
+            os.path.join(app.config["SHELF_FOLDER"], "first_story", ".book_tracks.fgb")
+        )
+    for unavailable_book_id in (4, 42):  # restricted and unknown
+        assert (
+            client.get(f"/map/books/{unavailable_book_id}/tracks.fgb").status_code
+            == 404
+        )
+
+
+def test_book_bundles(files, client, app):
+    """
+    Test the GeoJSON and WebTrack exports of a whole book.
+    """
+    rv = client.get("/map/books/1/tracks.geojson")
+    assert rv.status_code == 200
+    assert rv.mimetype == "application/geo+json"
+    geojson = json.loads(rv.data)
+    assert geojson["type"] == "FeatureCollection"
+    assert geojson["features"][0]["properties"] == {"name": "test_Gillespie_Circuit"}
+    for format_version in FORMAT_VERSIONS:
+        rv = client.get(
+            "/map/books/1/tracks.webtrack?version=" + format_version.decode()
+        )
+        assert rv.status_code == 200
+        assert rv.mimetype == "application/prs.webtrack"
+        assert rv.data.startswith(b"webtrack-bin:" + format_version)
+        assert rv.headers["WebTrack-Segment-Offsets"]
+    with app.app_context():
+        book_dir = os.path.join(app.config["SHELF_FOLDER"], "first_story")
+        assert os.path.isfile(os.path.join(book_dir, ".book_tracks.geojson"))
+        assert os.path.isfile(os.path.join(book_dir, ".book_tracks.webtrack"))
+    assert client.get("/map/books/1/tracks.webtrack?version=9.9.9").status_code == 404
+    for unavailable_book_id in (4, 42):  # restricted and unknown
+        for ext in ("geojson", "webtrack"):
+            assert (
+                client.get(f"/map/books/{unavailable_book_id}/tracks.{ext}").status_code
+                == 404
+            )
+
+
+def test_book_webtrack_overflow(files, client, monkeypatch):
+    """
+    Test the WebTrack of a book with too many segments or waypoints.
+    """
+
+    def merge_files(*args, **kwargs):
+        raise OverflowError("Too many segments or waypoints to merge")
+
+    monkeypatch.setattr("flaskr.map.WebTrack.merge_files", merge_files)
+    assert client.get("/map/books/1/tracks.webtrack").status_code == 413
+
+
+def test_hashed_exports(files, client, app):
+    """
+    Test the exports requested with their content hash.
+    """
+    with app.app_context():
+        gpx_path = os.path.join(
+            app.config["SHELF_FOLDER"], "first_story", "test_Gillespie_Circuit.gpx"
+        )
+    for export_type, url in (
+        ("webtrack", "/map/webtracks/1/test_Gillespie_Circuit{}.webtrack"),
+        ("geojson", "/map/geojsons/1/test_Gillespie_Circuit{}.geojson"),
+        ("static_map", "/map/static_map/1/test_Gillespie_Circuit{}.jpg"),
+    ):
+        rv = client.get(url.format(""))
+        assert rv.status_code == 200
+        assert "immutable" not in rv.headers.get("Cache-Control", "")
+        content_hash = get_export_hash(
+            get_manifest(os.path.dirname(gpx_path)), export_type, gpx_path
+        )
+        rv = client.get(url.format("." + content_hash))
+        assert rv.status_code == 200
+        assert rv.headers["Cache-Control"] == IMMUTABLE_CACHE_CONTROL
+        rv = client.get(url.format(".0123456789abcdef"))
+        assert rv.status_code == 302
+        assert rv.headers["Location"].endswith(url.format("." + content_hash))
+        # query arguments named like the view arguments:
+        rv = client.get(
+            url.format(".0123456789abcdef")
+            + "?book_id=2&gpx_name=other&content_hash=0123456789abcdef&utm=1"
+        )
+        assert rv.status_code == 302
+        assert rv.headers["Location"].endswith(
+            url.format("." + content_hash) + "?utm=1"
+        )
+
+
 def test_static_map(files, client, auth):
     """
     Test the static map.
@@ -182,6 +412,107 @@ def test_static_map(files, client, auth):
     assert rv.status_code == 200
 
 
+def test_queued_webtrack(files, client, app, runner, tmp_path):
+    """
+    Test the background generation of the WebTrack.
+    """
+    app.config["EXPORT_QUEUE_ENABLED"] = True
+    app.config["EXPORT_QUEUE_DATABASE"] = str(tmp_path / "queue.sqlite")
+    webtrack_url = "/map/webtracks/1/test_gpx_to_geojson.webtrack"
+    with app.app_context():
+        webtrack_path = os.path.join(
+            app.config["SHELF_FOLDER"], "first_story", "test_gpx_to_geojson.webtrack"
+        )
+    if os.path.isfile(webtrack_path):
+        os.remove(webtrack_path)
+    refresh_manifest(os.path.dirname(webtrack_path))  # changed by hand
+
+    # nothing to serve yet:
+    for _ in range(2):
+        rv = client.get(webtrack_url)
+        assert rv.status_code == 202
+        assert rv.headers["Retry-After"] == str(app.config["EXPORT_RETRY_AFTER"])
+    assert not os.path.isfile(webtrack_path)
+    with app.app_context():
+        assert len(get_export_queue()) == 1  # queued once
+
+    result = runner.invoke(args=["export-worker", "--once"])
+    assert "Exported: " + webtrack_path in result.output
+    rv = client.get(webtrack_url)
+    assert rv.status_code == 200
+    with app.app_context():
+        assert len(get_export_queue()) == 0
+
+    # the outdated WebTrack is served while the new one is queued:
+    webtrack_mtime = os.stat(webtrack_path).st_mtime
+    os.utime(webtrack_path, (webtrack_mtime - 3600, webtrack_mtime - 3600))
+    refresh_manifest(os.path.dirname(webtrack_path))
+    rv = client.get(webtrack_url)
+    assert rv.status_code == 200
+    assert rv.data.startswith(b"webtrack-bin")
+    with app.app_context():
+        assert len(get_export_queue()) == 1
+
+
+def test_elevation_profile(files, client, app):
+    """
+    Test the downsampled elevation profile.
+    """
+    profile_url = "/map/profiles/1/test_Gillespie_Circuit.json"
+    for width in [0, 2, app.config["ELEVATION_PROFILE_MAX_WIDTH"] + 1]:
+        rv = client.get(profile_url + "?width=" + str(width))
+        assert rv.get_json()["success"] is False
+    rv = client.get("/map/profiles/4/test_Gillespie_Circuit.json?width=10")
+    assert rv.status_code == 404  # restricted book
+
+    rv = client.get(profile_url + "?width=10")
+    assert rv.status_code == 200
+    profile = rv.get_json()["profile"]
+    assert len(profile) == 10
+    assert profile == sorted(profile)  # sorted by distance
+    assert profile[0][0] == 0
+
+
+def test_build_export(files, app, tmp_path):
+    """
+    Test the locked and atomic generation of an export.
+    """
+    geojson_path = str(tmp_path / "test_gpx_to_geojson.geojson")
+    with app.app_context():
+        assert build_export("geojson", "test_gpx_to_geojson.gpx", geojson_path)
+        # already generated, e.g. by an other process waiting for the lock:
+        assert not build_export("geojson", "test_gpx_to_geojson.gpx", geojson_path)
+        with pytest.raises(KeyError):
+            build_export("pdf", "test_gpx_to_geojson.gpx", geojson_path)
+    with open("test_gpx_to_geojson.expected_output.geojson") as expected_output:
+        with open(geojson_path) as geojson_file:
+            assert expected_output.read() == geojson_file.read()
+    assert not [path for path in os.listdir(tmp_path) if path.endswith(".tmp")]
+
+
+def test_build_track_assets(files, app, runner):
+    """
+    Test the batch generation of the exports, skipping the up to date ones.
+    """
+    with app.app_context():
+        geojson_path = os.path.join(
+            app.config["SHELF_FOLDER"], "first_story", "test_gpx_to_geojson.geojson"
+        )
+    if os.path.isfile(geojson_path):
+        os.remove(geojson_path)
+    args = ["build-track-assets", "--jobs", "2", "--export-type", "geojson"]
+    result = runner.invoke(args=args)
+    assert result.exit_code == 0
+    assert "Exported in " in result.output
+    assert geojson_path in result.output
+    assert os.path.isfile(geojson_path)
+
+    result = runner.invoke(args=args)
+    assert result.exit_code == 0
+    assert "0 to build." in result.output
+    assert geojson_path not in result.output
+
+
 def test_create_static_map(app):
     with app.app_context():
         static_image = "Gillespie_Circuit.jpeg"
@@ -195,6 +526,97 @@ def test_create_static_map(app):
         os.remove(static_image)
 
 
+def test_tracks(files, client, app, auth, tmp_path):
+    """ Test the area and nearest track queries based on the access level. """
+    app.config["TRACK_INDEX_DATABASE"] = str(tmp_path / "tracks.sqlite")
+    track_index = TrackIndex(app.config["TRACK_INDEX_DATABASE"])
+    for book_url in ("first_story", "fourth_story"):
+        with app.app_context():
+            gpx_path = os.path.join(
+                app.config["SHELF_FOLDER"], book_url, "test_Gillespie_Circuit.gpx"
+            )
+        assert track_index.index(gpx_path, "Gillespie_Circuit.webtrack")
+
+    rv = client.get("/map/tracks?bbox=-180,-90,180,90")
+    data = json.loads(rv.data)
+    assert data["success"]
+    assert [track["bookId"] for track in data["tracks"]] == [1]  # 4 is restricted
+    assert data["tracks"][0]["gpxName"] == "test_Gillespie_Circuit"
+    assert data["tracks"][0]["length"] == 41460
+    rv = client.get("/map/tracks?bbox=0,0,1,1")
+    assert json.loads(rv.data)["tracks"] == []
+    rv = client.get("/map/tracks?bbox=1,0,0,1")
+    assert not json.loads(rv.data)["success"]
+    rv = client.get("/map/tracks/nearest?lon=169.1&lat=-44.2")
+    data = json.loads(rv.data)
+    assert data["track"]["bookId"] == 1
+    assert 1800 < data["distance"] < 2000
+    rv = client.get("/map/tracks/nearest?lon=169.1")
+    assert not json.loads(rv.data)["success"]
+
+    with client:
+        auth.login()
+        rv = client.get("/map/tracks?bbox=169,-45,170,-44")
+        data = json.loads(rv.data)
+        assert [track["bookId"] for track in data["tracks"]] == [1, 4]
+        auth.logout()
+
+
+def test_track_tile(files, client, app, auth, tmp_path):
+    """ Test the vector tiles of the tracks based on the access level. """
+    app.config["TRACK_INDEX_DATABASE"] = str(tmp_path / "tracks.sqlite")
+    track_index = TrackIndex(app.config["TRACK_INDEX_DATABASE"])
+    for book_url in ("first_story", "fourth_story"):
+        with app.app_context():
+            gpx_path = os.path.join(
+                app.config["SHELF_FOLDER"], book_url, "test_Gillespie_Circuit.gpx"
+            )
+        assert track_index.index(gpx_path, "Gillespie_Circuit.webtrack")
+
+    rv = client.get("/map/tracks/0/0/0.mvt")
+    assert rv.status_code == 200
+    assert rv.mimetype == "application/vnd.mapbox-vector-tile"
+    assert b"test_Gillespie_Circuit" in rv.data
+    public_tile = rv.data
+    rv = client.get("/map/tracks/0/0/1.mvt")
+    assert rv.status_code == 404
+    rv = client.get("/map/tracks/2/0/0.mvt")  # no track there
+    assert rv.status_code == 200
+    assert rv.data == b""
+
+    with client:
+        auth.login()
+        rv = client.get("/map/tracks/0/0/0.mvt")
+        assert len(rv.data) > len(public_tile)  # book 4 is restricted
+        auth.logout()
+
+
+def test_elevation(client):
+    """ Test the elevation of points looked up in the SRTM cache only. """
+    rv = client.post("/map/elevation", json={"points": [[6.5]]})
+    assert rv.status_code == 200
+    assert not json.loads(rv.data)["success"]
+    rv = client.post("/map/elevation", json={"points": [[200.0, 0.5]]})
+    assert not json.loads(rv.data)["success"]
+    for points in (["12"], [[1, 2, 3]], [["1", 2]], [[True, 2]], [{"a": 1, "b": 2}]):
+        rv = client.post("/map/elevation", json={"points": points})
+        assert not json.loads(rv.data)["success"]
+    rv = client.post("/map/elevation", json={"points": [[-30.5, 0.5]]})  # ocean
+    data = json.loads(rv.data)
+    assert data["success"]
+    assert data["elevations"] == [None]
+
+
+def test_get_elevation_data(app):
+    """ The elevation engine and its open tiles are kept by the process. """
+    with app.app_context():
+        elevation_data = get_elevation_data()
+        assert get_elevation_data() is elevation_data
+        fetching = get_elevation_data(fetch_tile=lambda latitude, longitude: None)
+        assert fetching is not elevation_data
+        assert fetching.fetch_tile is not None
+
+
 @pytest.mark.parametrize(
     "path",
     (
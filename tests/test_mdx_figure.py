@@ -146,3 +146,34 @@ def test_mdx_figure_custom_src_path(data) -> None:
         ]
     )
     assert same_html(data[0], data[1], md)
+
+
+def test_mdx_figure_srcset() -> None:
+    """ Test the srcset of the resized figures. """
+    md = markdown.Markdown(extensions=[FigureExtension(widths=[320, 640, 960])])
+    assert same_html(
+        """\
+        ![Alt](card2.jpg "Caption")
+        """,
+        """\
+        <figure>
+        <div style="position:relative; width:100%; height:0; padding-top:66.67%">
+        <img alt="Alt" data-height="600" data-width="900" 
+        sizes="(min-width: 1200px) 1140px, 100vw" src="card2.jpg" 
+        srcset="320/card2.jpg 320w, 640/card2.jpg 640w, 900/card2.jpg 900w" 
+        style="position:absolute; top:0; left:0; max-width:100%;" width="900" />
+        </div>
+        <figcaption>Caption</figcaption>
+        </figure>
+        """,
+        md,
+    )
+    md = markdown.Markdown(extensions=[FigureExtension(widths=[320, 640])])
+    assert 'srcset="320/card2.jpg 320w, 640/card2.jpg 640w"' in md.convert(
+        '![Alt](card2.jpg "Caption")'
+    )
+    for figure in (
+        '![Alt](card2.jpg "Caption" class="can-zoom-in")',
+        '![Alt](card2.jpg "Caption" config="no-resize")',
+    ):
+        assert "srcset" not in md.convert(figure)
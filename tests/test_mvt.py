@@ -0,0 +1,181 @@
+#
+# Copyright 2021 Clement
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+import math
+
+import pytest
+
+from flaskr.mvt import EXTENT
+from flaskr.mvt import clip_line
+from flaskr.mvt import encode_geometry
+from flaskr.mvt import encode_tile
+from flaskr.mvt import get_tile_bounds
+from flaskr.mvt import get_tile_lines
+from flaskr.mvt import project
+from flaskr.mvt import simplify_line
+
+
+def read_varint(data, offset):
+    """ Returns the varint at `offset` and the offset of the next field. """
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, offset
+
+
+def read_message(data):
+    """ Returns the fields of a Protocol Buffers message as (number, value). """
+    fields = []
+    offset = 0
+    while offset < len(data):
+        key, offset = read_varint(data, offset)
+        if key & 7 == 0:
+            value, offset = read_varint(data, offset)
+        elif key & 7 == 2:
+            length, offset = read_varint(data, offset)
+            value, offset = data[offset : offset + length], offset + length
+        else:
+            value, offset = data[offset : offset + 8], offset + 8
+        fields.append((key >> 3, value))
+    return fields
+
+
+def read_packed(data):
+    """ Returns the varints of a packed field. """
+    values = []
+    offset = 0
+    while offset < len(data):
+        value, offset = read_varint(data, offset)
+        values.append(value)
+    return values
+
+
+def test_get_tile_bounds():
+    """ Test the tile bounds in decimal degrees. """
+    west, south, east, north = get_tile_bounds(0, 0, 0)
+    assert (west, east) == (-180, 180)
+    assert south == pytest.approx(-85.0511287798066)
+    assert north == pytest.approx(85.0511287798066)
+    assert get_tile_bounds(1, 1, 0)[:3] == (0, 0, 180)
+    west, south, east, north = get_tile_bounds(1, 1, 0, EXTENT // 2)
+    assert (west, east) == (-90, 270)
+    assert south < 0
+
+
+def test_project():
+    """ Test the projection in tile units. """
+    assert project([0.0, 0.0], 0, 0, 0) == [(EXTENT / 2, pytest.approx(EXTENT / 2))]
+    ((x, y),) = project([-180.0, 90.0], 1, 0, 0)
+    assert x == 0 and y == pytest.approx(0, abs=1e-6)  # clamped latitude
+    ((x, y),) = project([90.0, 0.0], 1, 1, 1)
+    assert x == EXTENT / 2 and y == pytest.approx(0, abs=1e-6)
+
+
+def test_clip_line():
+    """ Test the clipping of lines to a square. """
+    assert clip_line([(-10, 5), (20, 5)], 0, 10) == [[(0, 5), (10, 5)]]
+    assert clip_line([(1, 1), (2, 2), (3, 3)], 0, 10) == [[(1, 1), (2, 2), (3, 3)]]
+    assert clip_line([(-5, -5), (-1, -1)], 0, 10) == []
+    # leaving and entering again:
+    assert clip_line([(5, 5), (15, 5), (15, 8), (5, 8)], 0, 10) == [
+        [(5, 5), (10, 5)],
+        [(10, 8), (5, 8)],
+    ]
+
+
+def test_simplify_line():
+    """ Test the Ramer-Douglas-Peucker simplification. """
+    line = [(0, 0), (1, 0.1), (2, -0.1), (3, 5), (4, 0), (5, 0)]
+    assert simplify_line(line, 1) == [(0, 0), (2, -0.1), (3, 5), (5, 0)]
+    assert simplify_line(line, 10) == [(0, 0), (5, 0)]
+    assert simplify_line(line[:2], 10) == line[:2]
+
+
+def test_get_tile_lines():
+    """ Consecutive pieces are joined, the lines are clipped to the buffer. """
+    pieces = [[0.0, 0.0, 10.0, 0.0], [10.0, 0.0, 20.0, 0.0], [-170.0, 0.0, -160.0, 0.0]]
+    lines = get_tile_lines(pieces, 1, 1, 0)
+    assert len(lines) == 1
+    assert lines[0][0][0] == 0 and lines[0][-1][0] > 0
+    assert lines[0][0][1] == pytest.approx(EXTENT)
+    assert len(get_tile_lines(pieces, 0, 0, 0)) == 2
+
+
+def test_encode_geometry():
+    """ Test the command encoding of the specifications example. """
+    assert encode_geometry([[(2, 2), (2, 10), (10, 10)], [(1, 1), (3, 5)]]) == [
+        9,
+        4,
+        4,
+        18,
+        0,
+        16,
+        16,
+        0,
+        9,
+        17,
+        17,
+        10,
+        4,
+        8,
+    ]
+    assert encode_geometry([[(2, 2), (2.2, 1.9)]]) == []  # too short
+
+
+def test_encode_tile():
+    """ Decode a tile and check the layer content. """
+    assert encode_tile("tracks", []) == b""
+    assert encode_tile("tracks", [([[(1, 1), (1.2, 1)]], {"name": "dot"})]) == b""
+    tile = encode_tile(
+        "tracks",
+        [
+            ([[(1, 1), (5, 1)]], {"bookId": 1, "gpxName": "a", "length": 10}),
+            ([[(5, 5), (5, 8)]], {"bookId": 1, "gpxName": "b", "length": -1.5}),
+        ],
+    )
+    ((number, layer),) = read_message(tile)
+    assert number == 3
+    layer = read_message(layer)
+    assert (15, 2) in layer and (1, b"tracks") in layer and (5, EXTENT) in layer
+    keys = [value for number, value in layer if number == 3]
+    assert keys == [b"bookId", b"gpxName", b"length"]
+    values = [read_message(value)[0] for number, value in layer if number == 4]
+    assert values[:3] == [(5, 1), (1, b"a"), (5, 10)]
+    assert values[3][0] == 1 and values[4][0] == 3  # "b" and -1.5 as double
+    features = [read_message(value) for number, value in layer if number == 2]
+    assert len(features) == 2
+    assert read_packed(features[1][0][1]) == [0, 0, 1, 3, 2, 4]
+    assert features[0][1] == (3, 2)  # LineString
+    assert read_packed(features[0][2][1]) == [9, 2, 2, 10, 8, 0]
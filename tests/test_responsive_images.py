@@ -0,0 +1,108 @@
+#
+# Copyright 2018-2020 Clement
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+import os
+
+import pytest
+from PIL import Image
+from werkzeug.exceptions import NotFound
+
+from flaskr import responsive_images
+
+
+def test_get_bucket_width():
+    """ Test the rounding of the requested widths. """
+    widths = [320, 640, 960]
+    assert responsive_images.get_bucket_width(0, widths) == 320
+    assert responsive_images.get_bucket_width(320, widths) == 320
+    assert responsive_images.get_bucket_width(321, widths) == 640
+    assert responsive_images.get_bucket_width(5000, widths) == 960
+
+
+def test_negotiate_format():
+    """ Test the choice of the format according to the Accept header. """
+    accepted = ["image/avif", "image/webp", "image/apng", "*/*"]
+    mimetype = responsive_images.negotiate_format(accepted)[0]
+    assert mimetype == (
+        "image/avif"
+        if responsive_images.is_format_supported("AVIF")
+        else "image/webp"
+        if responsive_images.is_format_supported("WEBP")
+        else "image/jpeg"
+    )
+    assert responsive_images.negotiate_format(["*/*"])[0] == "image/jpeg"
+    assert responsive_images.negotiate_format([])[0] == "image/jpeg"
+    assert not responsive_images.is_format_supported("UNKNOWN")
+
+
+@pytest.mark.parametrize("image_format", responsive_images.IMAGE_FORMATS)
+def test_resized_image(app, tmp_path, image_format):
+    """ Generate a resized image on demand and send the cached one after. """
+    mimetype, pil_format, ext = image_format
+    if not responsive_images.is_format_supported(pil_format):
+        pytest.skip(pil_format + " not supported by Pillow")
+    source_path = str(tmp_path / "source.png")
+    Image.new("RGBA", (1000, 500), (10, 20, 30, 128)).save(source_path)
+    cache_dir = str(tmp_path / "cache")
+    app.config["IMAGE_WIDTHS"] = [320, 640, 960]
+    resized_path = os.path.join(cache_dir, "source.png.640w." + ext)
+
+    with app.test_request_context(headers={"Accept": mimetype + ",*/*;q=0.8"}):
+        response = responsive_images.send_resized_image(source_path, cache_dir, 400)
+        response.direct_passthrough = False
+        assert response.mimetype == mimetype
+        assert "Accept" in response.vary
+        with Image.open(resized_path) as image:
+            assert image.format == pil_format
+            assert image.size == (640, 320)
+            assert image.mode == ("RGB" if pil_format == "JPEG" else "RGBA")
+        mtime = os.stat(resized_path).st_mtime_ns
+        responsive_images.send_resized_image(source_path, cache_dir, 640)
+        assert os.stat(resized_path).st_mtime_ns == mtime
+
+        responsive_images.send_resized_image(source_path, cache_dir, 2000)
+        with Image.open(os.path.join(cache_dir, "source.png.960w." + ext)) as image:
+            assert image.size == (960, 480)
+
+        os.utime(source_path, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+        responsive_images.send_resized_image(source_path, cache_dir, 640)
+        assert os.stat(resized_path).st_mtime_ns > mtime
+
+
+def test_resized_image_not_found(app, tmp_path):
+    """ A missing or broken image is not found. """
+    broken_path = str(tmp_path / "broken.jpg")
+    with open(broken_path, "w") as broken_file:
+        broken_file.write("not an image")
+    with app.test_request_context():
+        for path in (broken_path, str(tmp_path / "missing.jpg")):
+            with pytest.raises(NotFound):
+                responsive_images.send_resized_image(path, str(tmp_path), 320)
+    assert not any(name.endswith(".jpg.320w.jpg") for name in os.listdir(tmp_path))
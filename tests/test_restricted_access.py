@@ -56,11 +56,15 @@ import pytest
         "/admin/photos/move_into_wastebasket",
         "/admin/photos/open/test_1zy071k164o6rjjjynvms47kr16a9h.jpg",
         "/admin/statistics",
+        "/admin/uploads/new",
+        "/admin/uploads/0123456789abcdef0123456789abcdef",
         "/photos/3/test_74gdf8hpw41i4qbpnl7b.jpg",  # access level = 1
         "/photos/3/test_wkd6xdrmbt9io96zcygpg12gt.jpg",  # access level = 1
         "/photos/4/test_1zy071k164o6rjjjynvms47kr16a9h.jpg",  # access level = 240
         "/photos/4/test_b4f6add9a5657725d156a94cde808ce8a5d4cf38.tif",  # access level = 240
+        "/photos/4/640/test_1zy071k164o6rjjjynvms47kr16a9h.jpg",  # access level = 240
         "/stories/5/test_image.jpg",  # access level = 1
+        "/stories/5/640/test_image.jpg",  # access level = 1
         "/stories/5/fifth_story",  # access level = 1
         "/stories/4/my_track.gpx",  # access level = ACCESS_LEVEL_DOWNLOAD_GPX=200
         "/stories/42/my_track.gpx",  # bad book ID
@@ -133,8 +137,11 @@ def test_member_access_granted(files, client, auth, path):
         "/admin/photos/move_into_wastebasket",
         "/admin/photos/open/test_1zy071k164o6rjjjynvms47kr16a9h.jpg",
         "/admin/statistics",
+        "/admin/uploads/new",
+        "/admin/uploads/0123456789abcdef0123456789abcdef",
         "/photos/4/test_1zy071k164o6rjjjynvms47kr16a9h.jpg",  # access level = 240
         "/photos/4/test_b4f6add9a5657725d156a94cde808ce8a5d4cf38.tif",  # access level = 240
+        "/photos/4/640/test_1zy071k164o6rjjjynvms47kr16a9h.jpg",  # access level = 240
         "/stories/4/test_Gillespie_Circuit.gpx",  # access level = ACCESS_LEVEL_DOWNLOAD_GPX=200
         "/create_password",
     ),
@@ -0,0 +1,150 @@
+#
+# Copyright 2021 Clement
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+import io
+import os
+import struct
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from flaskr.srtm_cache import SrtmTileManager
+from flaskr.srtm_cache import get_tile_keys
+
+#: 3x3 samples of a valid tile.
+HGT_DATA = struct.pack(">9h", *range(100, 1000, 100))
+
+
+def zip_tile(name, hgt_data=HGT_DATA):
+    zip_data = io.BytesIO()
+    with zipfile.ZipFile(zip_data, "w") as hgt_zip:
+        hgt_zip.writestr(name + ".hgt", hgt_data)
+    return zip_data.getvalue()
+
+
+@pytest.fixture
+def srtm_server():
+    """ Local stand-in for the NASA server, serving `server.tiles`. """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with server.lock:
+                server.requests.append(self.path)
+                server.active += 1
+                server.max_active = max(server.max_active, server.active)
+            time.sleep(0.1)
+            data = server.tiles.get(self.path.strip("/").split(".")[0])
+            with server.lock:
+                server.active -= 1
+            if data is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.tiles = {}
+    server.requests = []
+    server.active = 0
+    server.max_active = 0
+    server.lock = threading.Lock()
+    server.url = "http://127.0.0.1:{}/{{}}.SRTMGL1.hgt.zip".format(
+        server.server_address[1]
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_tile_keys():
+    """ Test the tiles of a track. """
+    assert get_tile_keys([-44.5, -44.6, -43.5, 0.5], [169.5, 169.9, 169.5, -0.5]) == {
+        (-45, 169),
+        (-44, 169),
+        (0, -1),
+    }
+
+
+def test_prefetch(tmp_path, srtm_server):
+    """ Test the parallel downloads, the missing and the corrupted tiles. """
+    names = ("N45E006", "N45E007", "N46E006", "N46E007")
+    for name in names:
+        srtm_server.tiles[name] = zip_tile(name)
+    manager = SrtmTileManager(str(tmp_path), srtm_server.url, jobs=4)
+    keys = [(45, 6), (45, 7), (46, 6), (46, 7), (0, -31)]
+    assert manager.prefetch(keys) == [(45, 6), (45, 7), (46, 6), (46, 7)]
+    assert srtm_server.max_active > 1
+    for name in names:
+        with open(str(tmp_path / (name + ".hgt")), "rb") as hgt_file:
+            assert hgt_file.read() == HGT_DATA
+    assert os.path.isfile(str(tmp_path / "N00W031.hgt.missing"))
+    assert manager.prefetch(keys) == []  # nothing requested again
+    assert len(srtm_server.requests) == 5
+
+    srtm_server.tiles["S45E169"] = zip_tile("S45E169", HGT_DATA + b"\0")
+    with pytest.raises(ValueError, match="Invalid HGT file size"):
+        manager.fetch_tile(-44.5, 169.5)
+    corrupted = bytearray(zip_tile("S45E169"))
+    corrupted[40] ^= 0xFF  # in the compressed data
+    srtm_server.tiles["S45E169"] = bytes(corrupted)
+    with pytest.raises(ValueError, match="Corrupted SRTM tile"):
+        manager.fetch_tile(-44.5, 169.5)
+    assert not manager.is_cached((-45, 169))
+    assert sorted(os.listdir(str(tmp_path))) == sorted(
+        [name + ".hgt" for name in names]
+        + [name + ".hgt.lock" for name in names]
+        + ["N00W031.hgt.lock", "N00W031.hgt.missing", "S45E169.hgt.lock"]
+    )
+
+
+def test_evict(tmp_path):
+    """ Test the removal of the least recently used tiles. """
+    for age, name in enumerate(("N45E006.hgt", "N45E007.hgt.zip", "N46E006.hgt")):
+        path = str(tmp_path / name)
+        with open(path, "wb") as hgt_file:
+            hgt_file.write(HGT_DATA)
+        os.utime(path, (1000 + age, 1000 + age))  # the first one is the oldest
+    manager = SrtmTileManager(str(tmp_path), "", max_bytes=2 * len(HGT_DATA))
+    assert manager.evict(keep=[(45, 6)]) == ["N45E007.hgt.zip"]
+    assert manager.evict() == []
+    manager.max_bytes = 0
+    assert manager.evict(keep=[(46, 6)]) == ["N45E006.hgt"]
+    assert os.listdir(str(tmp_path)) == ["N46E006.hgt"]
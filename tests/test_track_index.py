@@ -0,0 +1,208 @@
+#
+# Copyright 2021 Clement
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+import shutil
+from array import array
+
+import pytest
+
+from flaskr.gpx_reader import load_gpx
+from flaskr.track_index import ENVELOPE_POINTS
+from flaskr.track_index import TrackIndex
+from flaskr.track_index import TrackStats
+from flaskr.track_index import distance_to_line
+from flaskr.track_index import get_envelopes
+from flaskr.track_index import get_file_hash
+from flaskr.track_index import get_track_key
+from flaskr.track_index import line_intersects_box
+
+
+def test_get_track_key():
+    """ A track is identified by its book directory and GPX name. """
+    assert get_track_key("/shelf/my_story/My_Track.gpx") == ("my_story", "My_Track")
+
+
+def test_track_index(tmp_path):
+    """ Tracks are indexed once per GPX version, listed, and removed. """
+    book_dir = tmp_path / "my_story"
+    book_dir.mkdir()
+    gpx_path = str(book_dir / "Gillespie_Circuit.gpx")
+    webtrack_path = str(book_dir / "Gillespie_Circuit.webtrack")
+    shutil.copyfile("Gillespie_Circuit.gpx", gpx_path)
+    shutil.copyfile("Gillespie_Circuit.webtrack", webtrack_path)
+    track_index = TrackIndex(str(tmp_path / "tracks.sqlite"))
+    assert track_index.get("my_story", "Gillespie_Circuit") is None
+
+    assert track_index.index(gpx_path, webtrack_path)
+    assert not track_index.index(gpx_path, webtrack_path)  # up to date
+    stats = track_index.get("my_story", "Gillespie_Circuit")
+    assert stats.source_hash == get_file_hash(gpx_path)
+    assert stats.points == 128
+    assert stats.length == 41460
+    assert stats.minimum_altitude == 291
+    assert stats.maximum_altitude == 727
+    assert stats.elevation_gain == 823
+    assert stats.elevation_loss == 726
+    west, south, east, north = stats.get_bounds()
+    assert west < east and south < north
+    assert 169 < west < 169.3 and -44.3 < south < -44.1
+
+    with open(gpx_path, "a") as gpx_file:
+        gpx_file.write("\n")  # new version
+    assert track_index.index(gpx_path, webtrack_path)
+
+    shutil.copyfile(gpx_path, str(book_dir / "Another.gpx"))
+    assert track_index.index(str(book_dir / "Another.gpx"), webtrack_path)
+    tracks = track_index.get_book_tracks("my_story")
+    assert [track.gpx_name for track in tracks] == ["Another", "Gillespie_Circuit"]
+    assert track_index.get_book_tracks("other_story") == []
+    assert track_index.remove_missing({("my_story", "Gillespie_Circuit")}) == 1
+    assert track_index.get("my_story", "Another") is None
+    assert track_index.remove_missing({("my_story", "Gillespie_Circuit")}) == 0
+    assert track_index.index(str(book_dir / "Another.gpx"), webtrack_path)
+    assert track_index.remove("my_story", "Another") == 1
+    assert track_index.remove("my_story") == 1
+    assert track_index.get_book_tracks("my_story") == []
+
+
+def test_get_envelopes():
+    """ The envelopes cover all the lines of the segments. """
+    gpx = load_gpx("Gillespie_Circuit.gpx")
+    envelopes = get_envelopes(gpx)
+    segments = list(gpx.segments())
+    assert len(envelopes) >= len(segments)
+    total_points = 0
+    for west, south, east, north, coordinates in envelopes:
+        assert len(coordinates) <= 2 * (ENVELOPE_POINTS + 1)
+        assert min(coordinates[0::2]) == west and max(coordinates[0::2]) == east
+        assert min(coordinates[1::2]) == south and max(coordinates[1::2]) == north
+        total_points += len(coordinates) // 2 - 1  # shared with the next one
+    assert total_points == gpx.get_points_no() - len(segments)
+
+
+def test_distance_to_line():
+    """ Distance to the nearest point of the line. """
+    line = array("d", [0.0, 0.0, 0.0, 1.0, 1.0, 1.0])
+    assert distance_to_line(0.0, 0.5, line) == 0
+    assert distance_to_line(0.01, 0.5, line) == pytest.approx(1112, rel=0.01)
+    assert distance_to_line(0.0, -1.0, line) == pytest.approx(111195)
+    assert distance_to_line(0.0, 0.0, array("d", [0.0, 0.0])) == 0
+
+
+def test_line_intersects_box():
+    """ A point in the area or a segment crossing it. """
+    line = array("d", [0.0, 0.0, 1.0, 1.0])
+    assert line_intersects_box(line, (-1.0, -1.0, 0.0, 0.0))  # touching point
+    assert line_intersects_box(line, (0.4, 0.4, 0.6, 0.6))  # crossing segment
+    assert line_intersects_box(line, (0.0, 0.4, 1.0, 0.6))
+    assert not line_intersects_box(line, (0.9, 0.0, 1.0, 0.1))  # in the envelope
+    assert not line_intersects_box(line, (2.0, 2.0, 3.0, 3.0))
+    vertical = array("d", [0.5, 0.0, 0.5, 1.0])
+    assert line_intersects_box(vertical, (0.0, 0.4, 1.0, 0.6))
+    assert not line_intersects_box(vertical, (0.6, 0.4, 1.0, 0.6))
+    assert line_intersects_box(array("d", [0.5, 0.5]), (0.0, 0.0, 1.0, 1.0))
+
+
+def test_find_exact(tmp_path):
+    """ A track passing near the area is not found. """
+    track_index = TrackIndex(str(tmp_path / "tracks.sqlite"))
+    stats = TrackStats(
+        "my_story", "diagonal", "", 2, 157000.0, *[None] * 4, 0, 0, 1, 1, 0
+    )
+    track_index.update(stats, [(0.0, 0.0, 1.0, 1.0, array("d", [0, 0, 1, 1]))])
+    assert track_index.find((0.9, 0.0, 1.0, 0.1)) == []
+    assert [track.gpx_name for track in track_index.find((0.4, 0.4, 0.6, 0.6))] == [
+        "diagonal"
+    ]
+
+
+def test_spatial_index(tmp_path):
+    """ Tracks found in an area, nearest track, and filtered by books. """
+    track_index = TrackIndex(str(tmp_path / "tracks.sqlite"))
+    for book_url in ("first_story", "second_story"):
+        book_dir = tmp_path / book_url
+        book_dir.mkdir()
+        gpx_path = str(book_dir / "Gillespie_Circuit.gpx")
+        shutil.copyfile("Gillespie_Circuit.gpx", gpx_path)
+        assert track_index.index(gpx_path, "Gillespie_Circuit.webtrack")
+
+    assert [track.book_url for track in track_index.find((169, -45, 170, -44))] == [
+        "first_story",
+        "second_story",
+    ]
+    assert track_index.find((169, -45, 170, -44), ["second_story"])[0].book_url == (
+        "second_story"
+    )
+    assert track_index.find((169, -45, 170, -44), []) == []
+    assert track_index.find((0, 0, 1, 1)) == []
+    # in the bounding box but away from the track:
+    west, south, east, north = track_index.find((169, -45, 170, -44))[0].get_bounds()
+    assert track_index.find((west, south, west + 0.001, south + 0.001)) == []
+
+    track, distance = track_index.nearest(169.1, -44.2, ["second_story"])
+    assert track.book_url == "second_story"
+    assert 1800 < distance < 2000
+    track, distance = track_index.nearest(0.0, 0.0)
+    assert track.gpx_name == "Gillespie_Circuit"
+    assert distance > 10000000
+    assert track_index.nearest(169.1, -44.2, []) is None
+
+    assert track_index.remove("first_story") == 1
+    assert [track.book_url for track in track_index.find((169, -45, 170, -44))] == [
+        "second_story"
+    ]
+    assert track_index.remove("second_story", "Gillespie_Circuit") == 1
+    assert track_index.nearest(169.1, -44.2) is None
+
+
+def test_get_pieces(tmp_path):
+    """ Pieces of tracks in an area and index revision. """
+    track_index = TrackIndex(str(tmp_path / "tracks.sqlite"))
+    assert track_index.get_revision() == 0
+    book_dir = tmp_path / "first_story"
+    book_dir.mkdir()
+    gpx_path = str(book_dir / "Gillespie_Circuit.gpx")
+    shutil.copyfile("Gillespie_Circuit.gpx", gpx_path)
+    assert track_index.index(gpx_path, "Gillespie_Circuit.webtrack")
+    assert track_index.get_revision() == 1
+
+    pieces = track_index.get_pieces((-180, -90, 180, 90))
+    envelopes = get_envelopes(load_gpx("Gillespie_Circuit.gpx"))
+    assert len(pieces) == len(envelopes)
+    for (book_url, gpx_name, length, coordinates), envelope in zip(pieces, envelopes):
+        assert (book_url, gpx_name) == ("first_story", "Gillespie_Circuit")
+        assert length == pytest.approx(41460, abs=10)
+        assert coordinates == envelope[4]
+    assert len(track_index.get_pieces((169, -44.5, 169.3, -44.3))) < len(pieces)
+    assert track_index.get_pieces((0, 0, 1, 1)) == []
+    assert track_index.get_pieces((-180, -90, 180, 90), ["second_story"]) == []
+
+    assert track_index.remove("first_story") == 1
+    assert track_index.get_revision() == 2
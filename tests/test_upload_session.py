@@ -0,0 +1,97 @@
+#
+# Copyright 2018-2020 Clement
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+import io
+import os
+import time
+
+import pytest
+
+from flaskr import upload_session
+
+
+def test_resumable_upload(tmp_path):
+    """ Upload a file by chunks, resume after an error and open it. """
+    upload_folder = str(tmp_path / "uploads")
+    content = os.urandom(2 * 1024 * 1024 + 5)
+    upload_id = upload_session.create_upload(
+        upload_folder, "photo.tif", len(content), 60
+    )
+    assert len(upload_id) == upload_session.UPLOAD_ID_LENGTH
+    assert upload_session.get_upload_offset(upload_folder, upload_id) == (
+        0,
+        len(content),
+    )
+
+    offset = upload_session.append_upload_chunk(
+        upload_folder, upload_id, 0, io.BytesIO(content[:1000])
+    )
+    assert offset == 1000
+    with pytest.raises(ValueError):  # chunk sent twice
+        upload_session.append_upload_chunk(
+            upload_folder, upload_id, 0, io.BytesIO(content[:1000])
+        )
+    with pytest.raises(ValueError):  # beyond the file size
+        upload_session.append_upload_chunk(
+            upload_folder, upload_id, 1000, io.BytesIO(content[1000:] + b"extra")
+        )
+    assert upload_session.get_upload_offset(upload_folder, upload_id)[0] == 1000
+    with pytest.raises(ValueError):
+        upload_session.open_upload(upload_folder, upload_id)
+    with pytest.raises(ValueError):
+        upload_session.get_upload_path(upload_folder, upload_id)
+
+    offset = upload_session.append_upload_chunk(
+        upload_folder, upload_id, 1000, io.BytesIO(content[1000:])
+    )
+    assert offset == len(content)
+    with open(upload_session.get_upload_path(upload_folder, upload_id), "rb") as data:
+        assert data.read() == content
+    file = upload_session.open_upload(upload_folder, upload_id)
+    assert file.filename == "photo.tif"
+    assert file.read() == content
+    file.close()
+
+    upload_session.remove_upload(upload_folder, upload_id)
+    with pytest.raises(FileNotFoundError):
+        upload_session.get_upload_offset(upload_folder, upload_id)
+    with pytest.raises(ValueError):
+        upload_session.get_upload_offset(upload_folder, "../" + upload_id[3:])
+
+
+def test_remove_expired_uploads(tmp_path):
+    """ Idle uploads are removed when a new one is created. """
+    upload_folder = str(tmp_path)
+    old_id = upload_session.create_upload(upload_folder, "old.jpg", 10, 60)
+    data_path = os.path.join(upload_folder, old_id, upload_session.UPLOAD_DATA_NAME)
+    os.utime(data_path, (time.time() - 120, time.time() - 120))
+    recent_id = upload_session.create_upload(upload_folder, "recent.jpg", 10, 60)
+    new_id = upload_session.create_upload(upload_folder, "new.jpg", 10, 60)
+    assert sorted(os.listdir(upload_folder)) == sorted([recent_id, new_id])
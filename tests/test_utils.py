@@ -28,7 +28,13 @@
 # POSSIBILITY OF SUCH DAMAGE.
 #
 
+import hashlib
+import io
+import os
+
 import pytest
+from PIL import Image
+from werkzeug.exceptions import NotFound
 
 from flaskr import utils
 from flaskr.db import get_db
@@ -226,3 +232,138 @@ def test_replace_extension():
     )
     assert utils.replace_extension("main", "txt") == "main.txt"
     assert utils.replace_extension(".main", "txt") == ".main.txt"
+
+
+def test_replace_file_atomically(tmp_path):
+    """ Test the atomic file writer, including the lock. """
+    path = str(tmp_path / "export.txt")
+
+    def write(tmp_file_path):
+        assert tmp_file_path != path
+        with open(tmp_file_path, "w") as tmp_file:
+            tmp_file.write("new")
+        assert not os.path.exists(path)
+
+    with utils.file_lock(path + ".lock"):
+        utils.replace_file_atomically(path, write)
+    with open(path) as export_file:
+        assert export_file.read() == "new"
+
+    def failing_write(tmp_file_path):
+        with open(tmp_file_path, "w") as tmp_file:
+            tmp_file.write("partial")
+        raise OSError("Cannot write")
+
+    with pytest.raises(OSError):
+        utils.replace_file_atomically(path, failing_write)
+    with open(path) as export_file:
+        assert export_file.read() == "new"
+    assert sorted(os.listdir(tmp_path)) == ["export.txt", "export.txt.lock"]
+
+
+def test_fit_size():
+    """ Test the aspect-ratio preserving size fitting. """
+    assert utils.fit_size((6000, 4000), (2560, 1440)) == (2160, 1440)
+    assert utils.fit_size((4000, 6000), (1366, 768)) == (512, 768)
+    assert utils.fit_size((800, 600), (2560, 1440)) == (800, 600)
+
+
+@pytest.mark.parametrize("raw_format", ("JPEG", "TIFF"))
+def test_create_photo_derivatives(tmp_path, raw_format):
+    """ Test the single-decode pipeline creating the sizes of a photo. """
+    raw_path = str(tmp_path / "raw")
+    Image.new("RGB", (1800, 1200), (200, 100, 50)).save(raw_path, raw_format)
+    raw_size, photos, thumbnail_filename, image_exif = utils.create_photo_derivatives(
+        raw_path, ((1000, 600), (480, 270)), (30, 25), 300, 20, 90, str(tmp_path)
+    )
+    assert raw_size == (1800, 1200)
+    assert [photo[1] for photo in photos] == [(900, 600), (405, 270)]
+    assert [len(photo[0]) for photo in photos] == [30 + 4, 25 + 4]
+    for photo_filename, photo_size in photos:
+        assert utils.get_image_size(str(tmp_path / photo_filename)) == photo_size
+    assert len(thumbnail_filename) == 20 + 4
+    assert utils.get_image_size(str(tmp_path / thumbnail_filename)) == (300, 300)
+    assert image_exif == (None, None, None, None, None)
+
+
+def test_save_hashed_stream(tmp_path):
+    """ Test the upload copy hashing the content on the fly. """
+    content = os.urandom(3 * 1024 * 1024 + 17)
+    tmp_file_path, sha1 = utils.save_hashed_stream(io.BytesIO(content), str(tmp_path))
+    assert sha1 == hashlib.sha1(content).hexdigest()
+    assert os.path.dirname(tmp_file_path) == str(tmp_path)
+    with open(tmp_file_path, "rb") as tmp_file:
+        assert tmp_file.read() == content
+
+    class FailingStream(io.BytesIO):
+        def read(self, *args):
+            raise OSError("Connection lost")
+
+    with pytest.raises(OSError):
+        utils.save_hashed_stream(FailingStream(), str(tmp_path))
+    assert os.listdir(tmp_path) == [os.path.basename(tmp_file_path)]
+
+
+def test_send_offloaded_file(app, tmp_path):
+    """ Test the files sent by Flask, nginx or Apache. """
+    photos = tmp_path / "photos"
+    os.mkdir(photos)
+    (photos / "my photo.jpg").write_bytes(b"JPEG")
+    (tmp_path / "secret.txt").write_bytes(b"secret")
+    app.config["FILE_OFFLOAD_LOCATIONS"] = {str(photos): "/internal/photos/"}
+    with app.test_request_context():
+        app.config["FILE_OFFLOAD"] = None
+        response = utils.send_offloaded_file(str(photos), "my photo.jpg")
+        response.direct_passthrough = False
+        assert response.get_data() == b"JPEG"
+        assert "X-Accel-Redirect" not in response.headers
+
+        app.config["FILE_OFFLOAD"] = "x-accel-redirect"
+        response = utils.send_offloaded_file(str(photos), "my photo.jpg")
+        assert response.headers["X-Accel-Redirect"] == "/internal/photos/my%20photo.jpg"
+        assert response.mimetype == "image/jpeg"
+        assert response.get_data() == b""
+        response = utils.send_offloaded_file(str(tmp_path), "secret.txt")
+        response.direct_passthrough = False
+        assert "X-Accel-Redirect" not in response.headers  # no location
+        assert response.get_data() == b"secret"
+
+        app.config["FILE_OFFLOAD"] = "x-sendfile"
+        response = utils.send_offloaded_file(
+            str(photos), "my photo.jpg", mimetype="image/x-test", as_attachment=True
+        )
+        assert response.headers["X-Sendfile"] == os.path.realpath(
+            photos / "my photo.jpg"
+        )
+        assert response.mimetype == "image/x-test"
+        assert response.headers["Content-Disposition"] == (
+            'attachment; filename="my photo.jpg"'
+        )
+        for filename in ("missing.jpg", "../secret.txt"):
+            with pytest.raises(NotFound):
+                utils.send_offloaded_file(str(photos), filename)
+
+
+def test_immutable_cache_control():
+    """ The restricted files are not stored by the shared caches. """
+    assert utils.immutable_cache_control(0).startswith("public,")
+    assert utils.immutable_cache_control(1).startswith("private,")
+
+
+def test_downsample_lttb():
+    """ Test the Largest-Triangle-Three-Buckets downsampling. """
+    xs = list(range(101))
+    ys = [0] * 101
+    ys[37] = 500  # peak to keep
+    ys[80] = -200  # trough to keep
+    indices = utils.downsample_lttb(xs, ys, 10)
+    assert len(indices) == 10
+    assert indices[0] == 0 and indices[-1] == 100
+    assert indices == sorted(set(indices))
+    assert 37 in indices and 80 in indices
+
+    # short series are kept as is:
+    assert utils.downsample_lttb([0, 1, 2], [5, 6, 7], 3) == [0, 1, 2]
+    assert utils.downsample_lttb([], [], 3) == []
+    with pytest.raises(ValueError):
+        utils.downsample_lttb(xs, ys, 2)
@@ -29,10 +29,17 @@
 #
 
 import os
+import struct
 from filecmp import cmp
 
+import pyproj
+import pytest
+
+from flaskr.map import get_webtrack_path
 from flaskr.map import good_webtrack_version
 from flaskr.map import gpx_to_webtrack_with_elevation
+from flaskr.webtrack import FORMAT_VERSIONS
+from flaskr.webtrack import WebTrack
 
 
 def test_gpx_to_webtrack(app):
@@ -57,9 +64,184 @@ def test_gpx_to_webtrack(app):
             raise Exception("Failed to create WebTrack") from err
         assert cmp(generated_webtrack_file, expected_webtrack_file)
         os.remove(generated_webtrack_file)
+        compact_webtrack_file = get_webtrack_path(generated_webtrack_file, b"0.2.0")
+        assert good_webtrack_version(compact_webtrack_file, b"0.2.0")
+        os.remove(compact_webtrack_file)
 
 
 def test_good_webtrack_version():
     """ Check the read capability. """
     expected_webtrack_file = "Gillespie_Circuit.webtrack"
     assert good_webtrack_version(expected_webtrack_file)
+    assert not good_webtrack_version(expected_webtrack_file, b"0.2.0")
+
+
+def test_get_track_information():
+    """ Read the track information without the segments. """
+    assert WebTrack().get_track_information("Gillespie_Circuit.webtrack") == {
+        "length": 41460,
+        "minimumAltitude": 291,
+        "maximumAltitude": 727,
+        "elevationGain": 823,
+        "elevationLoss": 726,
+    }
+
+
+def test_get_segment_index():
+    """ Byte offsets of the segments and the waypoints. """
+    assert WebTrack().get_segment_index("Gillespie_Circuit.webtrack") == [43, 1071]
+
+
+def test_get_elevation_profile():
+    """ Read the distances and elevations without the coordinates. """
+    distances, elevations = WebTrack().get_elevation_profile(
+        "Gillespie_Circuit.webtrack"
+    )
+    assert len(distances) == len(elevations) == 128
+    assert distances[0] == 0
+    assert distances[-1] == 41460
+    assert distances == sorted(distances)
+    assert min(elevations) == 291
+    assert max(elevations) == 727
+
+
+def read_webtrack_data(file_path):
+    """ Returns the data of a WebTrack without waypoint as given to to_file(). """
+    webtrack = WebTrack()
+    track_information = webtrack.get_track_information(file_path)
+    inverse_proj = pyproj.Transformer.from_crs("epsg:3857", "epsg:4326", always_xy=True)
+    with open(file_path, "rb") as stream:
+        webtrack.webtrack = stream
+        webtrack._read_format_information()
+        webtrack.total_segments = webtrack._r_int(1)
+        webtrack.total_waypoints = webtrack._r_int(2)
+        segment_headers = webtrack._read_segment_headers()
+        webtrack._read_track_information()
+        segments = []
+        for with_ele, total_points, _, _ in segment_headers:
+            points = webtrack._read_segment(with_ele, total_points)
+            segments.append(
+                {
+                    "withEle": with_ele,
+                    "points": [
+                        [*inverse_proj.transform(lon, lat), distance * 10, ele]
+                        for lon, lat, distance, ele in points
+                    ],
+                }
+            )
+    return {"segments": segments, "trackInformation": track_information}
+
+
+@pytest.mark.parametrize("compress", (True, False))
+def test_compact_webtrack(tmp_path, compress):
+    """ Write the format 0.2.0 and read it back. """
+    data = read_webtrack_data("Gillespie_Circuit.webtrack")
+    data["segments"].append({"withEle": False, "points": data["segments"][0]["points"]})
+    data["waypoints"] = [[169.2, -44.3, True, 512, "Flag", "Hut"]]
+    webtrack_paths = {}
+    for format_version in FORMAT_VERSIONS:
+        webtrack_paths[format_version] = str(tmp_path / format_version.decode())
+        WebTrack(format_version=format_version, compress=compress).to_file(
+            webtrack_paths[format_version], data
+        )
+    compact_path = webtrack_paths[b"0.2.0"]
+    assert WebTrack().get_format_information(compact_path)["format_version"] == (
+        b"0.2.0"
+    )
+    assert os.stat(compact_path).st_size < os.stat(webtrack_paths[b"0.1.0"]).st_size
+    assert WebTrack().get_track_information(compact_path) == (
+        WebTrack().get_track_information("Gillespie_Circuit.webtrack")
+    )
+    assert WebTrack().get_elevation_profile(compact_path) == (
+        WebTrack().get_elevation_profile("Gillespie_Circuit.webtrack")
+    )
+
+    # same points as the format 0.1.0:
+    webtrack = WebTrack()
+    points = {}
+    for format_version, webtrack_path in webtrack_paths.items():
+        with open(webtrack_path, "rb") as stream:
+            webtrack.webtrack = stream
+            webtrack._read_format_information()
+            webtrack.total_segments = webtrack._r_int(1)
+            webtrack.total_waypoints = webtrack._r_int(2)
+            segment_headers = webtrack._read_segment_headers()
+            webtrack._read_track_information()
+            if format_version == b"0.1.0":
+                points[format_version] = [
+                    webtrack._read_segment(with_ele, total_points)
+                    for with_ele, total_points, _, _ in segment_headers
+                ]
+            else:
+                points[format_version] = [
+                    webtrack._read_segment_block(*segment_header)
+                    for segment_header in segment_headers
+                ]
+    assert points[b"0.1.0"] == points[b"0.2.0"]
+    assert points[b"0.2.0"][1][0][3] == 0  # no elevation
+
+    # the waypoints are found with the index:
+    waypoint = struct.pack(
+        ">ii", *(round(c) for c in WebTrack.proj.transform(169.2, -44.3))
+    )
+    for webtrack_path in webtrack_paths.values():
+        offsets = WebTrack().get_segment_index(webtrack_path)
+        assert len(offsets) == 3
+        with open(webtrack_path, "rb") as stream:
+            stream.seek(offsets[-1])
+            assert stream.read(len(waypoint)) == waypoint
+
+    with pytest.raises(ValueError, match="Unsupported"):
+        WebTrack(format_version=b"0.3.0").to_file(str(tmp_path / "bad"), data)
+    with open(compact_path, "rb") as stream:
+        truncated = stream.read(os.stat(compact_path).st_size // 2)
+    with open(compact_path, "wb") as stream:
+        stream.write(truncated)
+    with pytest.raises(EOFError):
+        WebTrack().get_elevation_profile(compact_path)
+
+
+def test_merge_files(tmp_path):
+    """ Gather the segments of several WebTracks. """
+    gillespie_path = "Gillespie_Circuit.webtrack"
+    data = read_webtrack_data(gillespie_path)
+    data["segments"][0]["withEle"] = False
+    data["trackInformation"] = {
+        "length": 100,
+        "minimumAltitude": 0,
+        "maximumAltitude": 0,
+        "elevationGain": 0,
+        "elevationLoss": 0,
+    }
+    data["waypoints"] = [[169.2, -44.3, False, 0, "Flag", "Hut"]]
+    flat_path = str(tmp_path / "flat.webtrack")
+    WebTrack().to_file(flat_path, data)
+    merged_path = str(tmp_path / "merged.webtrack")
+    WebTrack().merge_files([gillespie_path, flat_path, gillespie_path], merged_path)
+    assert WebTrack().get_track_information(merged_path) == {
+        "length": 41460 * 2 + 100,
+        "minimumAltitude": 291,
+        "maximumAltitude": 727,
+        "elevationGain": 823 * 2,
+        "elevationLoss": 726 * 2,
+    }
+    assert len(WebTrack().get_segment_index(merged_path)) == 4
+    sources = [
+        WebTrack()._read_sections(path)
+        for path in (gillespie_path, flat_path, gillespie_path)
+    ]
+    webtrack = WebTrack()
+    segment_headers, _, segments, waypoints = webtrack._read_sections(merged_path)
+    assert webtrack.total_segments == 3
+    assert webtrack.total_waypoints == 4 + 1 + 4
+    assert segment_headers == b"".join(section[0] for section in sources)
+    assert segments == b"".join(section[2] for section in sources)
+    assert waypoints == b"".join(section[3] for section in sources)
+    compact_path = str(tmp_path / "compact.webtrack")
+    WebTrack(format_version=FORMAT_VERSIONS[1]).to_file(compact_path, data)
+    with pytest.raises(ValueError, match="format"):
+        WebTrack().merge_files([gillespie_path, compact_path], merged_path)
+    WebTrack(format_version=FORMAT_VERSIONS[1]).merge_files(
+        [compact_path, compact_path], merged_path
+    )
+    assert len(WebTrack().get_segment_index(merged_path)) == 3
@@ -632,6 +632,71 @@ def test_add_delete_photo(files, client, auth, app):
         assert not Path(path).is_file()
 
 
+def test_resumable_photo_upload(files, client, auth, app, tmp_path):
+    """ Upload a photo by chunks, resume after a wrong offset and process it. """
+    app.config["UPLOAD_FOLDER"] = str(tmp_path)
+    auth.login("root@test.com", "admin")
+    filename = utils.absolute_path("card2.jpg", __file__)
+    with open(filename, "rb") as photo_file:
+        content = photo_file.read()
+
+    rv = client.post("/admin/uploads/new", data={"filename": "card2.jpg"})
+    assert b"Missing data" in rv.data
+    rv = client.post(
+        "/admin/uploads/new", data={"filename": "card2.jpg", "size": len(content)}
+    )
+    upload_id = rv.get_json()["upload_id"]
+    rv = client.post("/admin/uploads/" + upload_id + "?offset=0", data=content[:1000])
+    assert rv.get_json()["offset"] == 1000
+    rv = client.post("/admin/uploads/" + upload_id + "?offset=0", data=content[:1000])
+    assert not rv.get_json()["success"] and rv.get_json()["offset"] == 1000
+
+    photo_form = {
+        "add-photo-access-level": 10,
+        "add-photo-title": "Resumed upload",
+        "add-photo-description": "",
+        "add-photo-file-upload": upload_id,
+    }
+    rv = client.post("/admin/photos/add/request", data=photo_form)
+    assert b"Upload not complete" in rv.data
+
+    rv = client.get("/admin/uploads/" + upload_id)
+    assert rv.get_json()["offset"] == 1000
+    rv = client.post(
+        "/admin/uploads/" + upload_id + "?offset=1000", data=content[1000:]
+    )
+    assert rv.get_json()["offset"] == len(content)
+    rv = client.post("/admin/photos/add/request", data=photo_form)
+    assert b"Photo successfully added to the gallery" in rv.data
+    assert os.listdir(tmp_path) == []
+    assert client.get("/admin/uploads/" + upload_id).status_code == 404
+
+    rv = client.post(
+        "/admin/uploads/new", data={"filename": "card2.jpg", "size": len(content)}
+    )
+    photo_form["add-photo-file-upload"] = rv.get_json()["upload_id"]
+    client.post(
+        "/admin/uploads/" + photo_form["add-photo-file-upload"] + "?offset=0",
+        data=content,
+    )
+    rv = client.post("/admin/photos/add/request", data=photo_form)
+    assert b"Photo already in the database" in rv.data
+    assert os.listdir(tmp_path) == []  # removed on error too
+
+    with app.app_context():
+        cursor = get_db().cursor()
+        cursor.execute(
+            """SELECT photo_id, raw_src
+            FROM gallery
+            ORDER BY photo_id DESC LIMIT 1"""
+        )
+        photo_id, raw_src = cursor.fetchone()
+    path_to_raw = os.path.join(app.config["GALLERY_FOLDER"], raw_src)
+    assert filecmp.cmp(path_to_raw, filename, shallow=False)
+    rv = client.post("/admin/photos/delete", data=dict(photo_id=photo_id))
+    assert b"Photo successfully deleted" in rv.data
+
+
 def test_add_delete_book(files, client, auth, app):
     """ Try to add a book in the database and the shelf folder and finally delete it. """
     auth.login("root@test.com", "admin")